@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
@@ -28,6 +28,28 @@ async_session_factory = async_sessionmaker(
 # ベースクラス作成
 Base = declarative_base()
 
+# 既存テーブルへのスキーマ変更（create_allは既存テーブルに列を追加しないため）
+SCHEMA_UPGRADES = [
+    "ALTER TABLE diary_entries ADD COLUMN IF NOT EXISTS duration_seconds DOUBLE PRECISION",
+    "ALTER TABLE diary_entries ADD COLUMN IF NOT EXISTS audio_sha256 VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS idx_diary_entries_audio_sha256 ON diary_entries (audio_sha256)",
+    "ALTER TABLE diary_entries ADD COLUMN IF NOT EXISTS audio_container VARCHAR(16)",
+    "ALTER TABLE diary_entries ADD COLUMN IF NOT EXISTS audio_codec VARCHAR(16)",
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS next_stage VARCHAR(20)",
+    "CREATE INDEX IF NOT EXISTS idx_diary_entries_transcription_task_id ON diary_entries (transcription_task_id)",
+    "CREATE INDEX IF NOT EXISTS idx_diary_entries_summary_task_id ON diary_entries (summary_task_id)",
+    # ジョブの優先度（レーン）
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS priority VARCHAR(20) NOT NULL DEFAULT 'interactive'",
+    "DROP INDEX IF EXISTS idx_processing_jobs_claim",
+    "CREATE INDEX IF NOT EXISTS idx_processing_jobs_lane_claim ON processing_jobs (stage, priority, status, run_after)",
+]
+
+def upgrade_schema():
+    """既存データベースにスキーマ変更を適用（何度実行しても同じ結果になる）"""
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
+
 # データベースセッション依存性（同期）
 def get_db():
     db = SessionLocal()
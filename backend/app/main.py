@@ -1,14 +1,23 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import engine
+from .database import engine, upgrade_schema, SessionLocal
 from .models import Base
-from .routers import audio, summary, diary, settings, auth
+from .routers import audio, summary, diary, settings, auth, tasks
+from .services.upload_sessions import upload_session_service
+from .services.audio_workers import audio_worker_pool
+from .services.processing import processing_queue
+from .services.entry_events import entry_event_broker
+from .services.settings_cache import settings_cache
+from .services.provider_clients import provider_clients
 
 app = FastAPI(title="Voice Diary API", version="0.1.0")
 
 # データベーステーブル作成
 Base.metadata.create_all(bind=engine)
+upgrade_schema()
 
 # CORS設定
 import os
@@ -25,10 +34,39 @@ app.add_middleware(
 app.include_router(auth.router)  # 認証は prefix="/api" が auth.py で既に設定済み
 app.include_router(audio.router, prefix="/api")
 app.include_router(summary.router, prefix="/api")
+app.include_router(tasks.router, prefix="/api")
 app.include_router(diary.router, prefix="/api")
 app.include_router(settings.router, prefix="/api")
 
 
+@app.on_event("startup")
+async def startup():
+    # 期限切れのアップロードセッションを削除
+    await asyncio.to_thread(upload_session_service.cleanup_expired)
+    # 期限切れの録音（プログレッシブアップロード）を削除
+    with SessionLocal() as db:
+        await audio.cleanup_abandoned_streams(db)
+    # 文字起こし・要約ワーカーを起動し、前回の停止時に未完了だったジョブを登録し直す
+    processing_queue.start()
+    await asyncio.to_thread(processing_queue.requeue_unfinished)
+    # プロバイダーへの接続を確立しておく（最初の文字起こし・要約でTLS接続を待たない）
+    await provider_clients.warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # 文字起こし・要約ワーカーを停止
+    await processing_queue.stop()
+    # 処理状況の配信を停止
+    await entry_event_broker.stop()
+    # 設定の変更通知の受信を停止
+    await settings_cache.stop()
+    # プロバイダーへの接続を閉じる
+    await provider_clients.aclose()
+    # 音声処理ワーカープロセスを停止
+    audio_worker_pool.shutdown()
+
+
 @app.get("/")
 async def root():
     return {"message": "Voice Diary API is running"}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer, Index, Boolean, LargeBinary
+from sqlalchemy import Column, String, Text, DateTime, Integer, BigInteger, Float, Index, Boolean, LargeBinary, ForeignKey, func
 from sqlalchemy.dialects.postgresql import UUID, TIMESTAMP, JSONB
 import uuid
 from datetime import datetime, timezone, timedelta
@@ -18,6 +18,10 @@ class DiaryEntry(Base):
     # ファイル情報
     audio_file_path = Column(String(500), nullable=True)
     file_id = Column(String(100), nullable=True)  # アップロード時のfile_id
+    audio_sha256 = Column(String(64), nullable=True)  # 音声ファイルの内容ハッシュ（AudioBlobへの参照）
+    duration_seconds = Column(Float, nullable=True)  # コンテナヘッダから取得した録音時間
+    audio_container = Column(String(16), nullable=True)  # マジックバイトから判定したコンテナ（webm, ogg, mp4 等）
+    audio_codec = Column(String(16), nullable=True)  # コーデック（opus, aac 等）
     
     # AI処理結果
     transcription = Column(Text, nullable=True)
@@ -51,6 +55,63 @@ class DiaryEntry(Base):
         Index('idx_diary_entries_recorded_at_desc', 'recorded_at', postgresql_using='btree'),
         # 複合インデックス（ステータス検索最適化）
         Index('idx_diary_entries_status', 'transcription_status', 'summary_status'),
+        # 同一内容の音声の検索用
+        Index('idx_diary_entries_audio_sha256', 'audio_sha256'),
+        # タスクIDからの状態・結果の取得用
+        Index('idx_diary_entries_transcription_task_id', 'transcription_task_id'),
+        Index('idx_diary_entries_summary_task_id', 'summary_task_id'),
+    )
+
+class TranscriptionSegment(Base):
+    """文字起こしの区間（音声上の開始・終了位置とテキスト）"""
+    __tablename__ = "transcription_segments"
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    entry_id = Column(UUID(as_uuid=True), ForeignKey("diary_entries.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)  # 日記エントリ内での順番
+    start_seconds = Column(Float, nullable=False)
+    end_seconds = Column(Float, nullable=False)
+    text = Column(Text, nullable=False)
+    
+    __table_args__ = (
+        Index('idx_transcription_segments_entry_seq', 'entry_id', 'seq'),
+    )
+
+class AudioBlob(Base):
+    """内容アドレス（SHA-256）で保存された音声ファイルと、日記エントリからの参照数"""
+    __tablename__ = "audio_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String(500), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    
+    # タイムスタンプ
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(JST))
+
+class ProcessingJob(Base):
+    """文字起こし・要約ジョブ（試行回数・実行権の期限・再試行の時刻を持つ）"""
+    __tablename__ = "processing_jobs"
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    stage = Column(String(20), nullable=False)  # transcription, summary
+    entry_id = Column(UUID(as_uuid=True), ForeignKey("diary_entries.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(String(100), nullable=False, unique=True)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    next_stage = Column(String(20), nullable=True)  # 完了後に続けて開始する段階（自動処理）
+    priority = Column(String(20), nullable=False, default="interactive", server_default="interactive")  # interactive, backfill（一括再処理）
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())  # 再試行の待ち時間
+    lease_until = Column(TIMESTAMP(timezone=True), nullable=True)  # 実行中のワーカーの実行権の期限
+    last_error = Column(Text, nullable=True)
+    
+    # タイムスタンプ
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(JST))
+    updated_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(JST), onupdate=lambda: datetime.now(JST))
+    
+    __table_args__ = (
+        # 実行待ちジョブの取得用（段階・優先度ごと）
+        Index('idx_processing_jobs_lane_claim', 'stage', 'priority', 'status', 'run_after'),
     )
 
 class User(Base):
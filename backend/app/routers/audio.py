@@ -1,14 +1,33 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Request, Query
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 import uuid
+import asyncio
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from typing import Optional
+import os
 
 from ..database import get_db
 from ..models import DiaryEntry
-from ..schemas import TranscribeRequest, TranscribeResponse, TranscribeResultResponse
+from ..schemas import (
+    TranscribeRequest, TranscribeResponse, TranscribeResultResponse, UploadSessionCreateRequest
+)
 from ..services.transcription import transcription_service
+from ..services.audio_artifacts import audio_artifact_service
+from ..services.transcript_segments import replace_segments, copy_segments
+from ..services.processing import processing_queue, wait_while_processing, TRANSCRIPTION, SUMMARY
+from ..services.settings_cache import settings_cache
+from ..services.audio_probe import CONTAINER_MEDIA_TYPES, probe_duration, sniff_format
+from ..services.audio_storage import (
+    UPLOAD_DIR, UPLOAD_TMP_DIR, MAX_UPLOAD_SIZE, StoredFile, UploadTooLargeError,
+    save_upload_file, hash_file, acquire_blob
+)
+from ..services.realtime_transcription import realtime_transcriber, SegmentOutOfOrder
+from ..services.upload_sessions import (
+    upload_session_service, UploadSessionNotFound, UploadSessionIncomplete
+)
+from .settings import DEFAULT_SETTINGS
 
 router = APIRouter(tags=["audio"])
 
@@ -16,8 +35,11 @@ router = APIRouter(tags=["audio"])
 JST = timezone(timedelta(hours=9))
 
 # アップロードディレクトリ設定
-UPLOAD_DIR = Path("/app/uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_TMP_DIR.mkdir(exist_ok=True)
+
+# 受け付ける最短の録音時間（秒）
+MIN_RECORDING_SECONDS = int(os.getenv("MIN_RECORDING_SECONDS", "10"))
 
 
 @router.post("/audio/upload")
@@ -27,31 +49,254 @@ async def upload_audio(file: UploadFile = File(...), db: Session = Depends(get_d
     if not file.content_type or not file.content_type.startswith('audio/'):
         raise HTTPException(status_code=400, detail="音声ファイルのみアップロード可能です")
     
-    # ファイルサイズチェック（50MB制限）
-    file_content = await file.read()
-    if len(file_content) > 50 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="ファイルサイズが50MBを超えています")
-    
-    # 音声ファイルの長さをチェック（10秒未満は拒否）
-    # 注意: これは簡易的なチェックです。正確な時間測定にはffprobeなどが必要
-    if len(file_content) < 10000:  # 約10秒未満の目安（簡易的）
-        raise HTTPException(status_code=400, detail="録音時間が短すぎます。10秒以上録音してください。")
-    
     # ユニークなファイル名生成
     file_id = str(uuid.uuid4())
-    timestamp = datetime.now(JST).strftime("%Y%m%d_%H%M%S")
-    file_extension = ".webm"  # WebRTCからの録音はwebm形式
-    filename = f"{timestamp}_{file_id}{file_extension}"
-    file_path = UPLOAD_DIR / filename
+    file_path = _new_temp_path(file_id)
     
-    # ファイル保存
+    # ファイル保存（チャンク単位でストリーミング、サイズ上限は書き込み中にチェック）
     try:
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
+        stored = await save_upload_file(file, file_path)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=400, detail=f"ファイルサイズが{e.max_size // (1024 * 1024)}MBを超えています")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ファイル保存エラー: {str(e)}")
     
+    return await _create_entry_from_file(db, file_id, stored)
+
+
+def _new_temp_path(file_id: str) -> Path:
+    """受信中の音声の一時保存先パスを生成（ハッシュ確定後に内容アドレスの格納先へ移動する）"""
+    file_extension = ".webm"  # WebRTCからの録音はwebm形式（格納時に実際の形式の拡張子にする）
+    return UPLOAD_TMP_DIR / f"{file_id}{file_extension}"
+
+
+async def _store_blob(db: Session, entry: DiaryEntry, stored: StoredFile):
+    """音声の実際の形式を判定し、その拡張子で内容アドレスの格納先へ移動する"""
+    audio_format = await asyncio.to_thread(sniff_format, stored.path)
+    await acquire_blob(db, stored, audio_format.suffix if audio_format else stored.path.suffix)
+    entry.audio_file_path = str(stored.path)
+    entry.audio_sha256 = stored.sha256
+    entry.audio_container = audio_format.container if audio_format else None
+    entry.audio_codec = audio_format.codec if audio_format else None
+
+
+async def _check_duration(file_path: Path, file_size: int) -> Optional[float]:
+    """
+    音声ファイルの長さを取得し、短すぎる場合は拒否する
+    
+    Returns:
+        Optional[float]: 録音時間（秒）。ヘッダから取得できない場合はNone
+    """
+    duration = await asyncio.to_thread(probe_duration, file_path)
+    
+    if duration is not None:
+        too_short = duration < MIN_RECORDING_SECONDS
+    else:
+        # ヘッダから長さを取得できない形式はファイルサイズで判定（簡易的）
+        too_short = file_size < 10000
+    
+    if too_short:
+        raise HTTPException(
+            status_code=400,
+            detail=f"録音時間が短すぎます。{MIN_RECORDING_SECONDS}秒以上録音してください。"
+        )
+    return duration
+
+
+async def _create_entry_from_file(db: Session, file_id: str, stored: StoredFile) -> dict:
+    """保存済みの音声ファイルから日記エントリを作成し、アップロード結果を返す"""
+    # 音声ファイルの長さをチェック（短すぎる録音は拒否）
+    try:
+        duration = await _check_duration(stored.path, stored.size)
+    except HTTPException:
+        stored.path.unlink(missing_ok=True)
+        raise
+    
+    # 同じ内容の音声が登録済みなら既存のエントリを返す（再送による重複エントリを防ぐ）
+    existing = db.query(DiaryEntry).filter(
+        DiaryEntry.audio_sha256 == stored.sha256
+    ).order_by(DiaryEntry.created_at).first()
+    if existing:
+        stored.path.unlink(missing_ok=True)
+        return _upload_response(existing, stored, duplicate=True)
+    
     # 日記エントリを自動作成
+    db_entry = DiaryEntry(
+        file_id=file_id,
+        duration_seconds=duration,
+        transcription_status="pending",
+        summary_status="pending"
+    )
+    
+    # 内容アドレスの格納先へ移動（同じ内容のファイルがあれば共有）
+    await _store_blob(db, db_entry, stored)
+    
+    db.add(db_entry)
+    
+    # 自動処理が有効な場合は、エントリの作成と同時に文字起こし→要約を開始
+    if _get_setting(db, "auto_pipeline"):
+        _start_transcription(db, db_entry, next_stage=SUMMARY)
+    
+    db.commit()
+    db.refresh(db_entry)
+    
+    # 文字起こしに備えて送信用の正規化済み音声を作成しておく
+    if db_entry.transcription_status != "completed":
+        _prepare_audio(db_entry)
+    
+    return _upload_response(db_entry, stored)
+
+
+def _get_setting(db: Session, key: str):
+    """設定値を取得（未設定の場合はデフォルト値）"""
+    return settings_cache.current(db).get(key, DEFAULT_SETTINGS[key])
+
+
+def _start_transcription(db: Session, entry: DiaryEntry, next_stage: Optional[str] = None) -> str:
+    """
+    文字起こしを開始（コミットしない）
+    
+    同じ内容の音声で文字起こし済みのエントリがあれば結果を再利用し、ワーカーには登録しない。
+    next_stage を指定すると文字起こしの完了後（再利用した場合はすぐに）その段階を開始する。
+    
+    Returns:
+        str: タスクID
+    """
+    source = None
+    if entry.audio_sha256:
+        source = db.query(DiaryEntry).filter(
+            DiaryEntry.audio_sha256 == entry.audio_sha256,
+            DiaryEntry.id != entry.id,
+            DiaryEntry.transcription_status == "completed"
+        ).first()
+    if not source:
+        return processing_queue.start_stage(db, TRANSCRIPTION, entry, next_stage)
+    
+    task_id = str(uuid.uuid4())
+    entry.transcription_task_id = task_id
+    entry.transcription = source.transcription
+    entry.transcribe_model = source.transcribe_model
+    entry.transcription_status = "completed"
+    entry.updated_at = datetime.now(JST)
+    copy_segments(db, source.id, entry.id)
+    if next_stage:
+        processing_queue.start_stage(db, next_stage, entry)
+    return task_id
+
+
+def _prepare_audio(entry: DiaryEntry):
+    """送信用の正規化済み音声の作成をバックグラウンドで開始"""
+    audio_artifact_service.run_in_background(
+        transcription_service.prepare_audio(entry.audio_file_path, entry.audio_sha256)
+    )
+
+
+def _upload_response(entry: DiaryEntry, stored: StoredFile, duplicate: bool = False) -> dict:
+    """アップロード結果のレスポンスを作成"""
+    return {
+        "file_id": entry.file_id,
+        "entry_id": str(entry.id),
+        "filename": Path(entry.audio_file_path).name,
+        "file_path": entry.audio_file_path,
+        "file_size": stored.size,
+        "duration_seconds": entry.duration_seconds,
+        "audio_container": entry.audio_container,
+        "audio_codec": entry.audio_codec,
+        "sha256": stored.sha256,
+        "transcription_task_id": entry.transcription_task_id,
+        "transcription_status": entry.transcription_status,
+        "summary_task_id": entry.summary_task_id,
+        "summary_status": entry.summary_status,
+        "duplicate": duplicate,
+        "upload_time": datetime.now(JST).isoformat(),
+        "message": "同じ音声ファイルが既にアップロードされています" if duplicate else "音声ファイルのアップロードが完了しました"
+    }
+
+
+@router.post("/audio/upload/sessions")
+async def create_upload_session(request: UploadSessionCreateRequest):
+    """再開可能なアップロードセッションを作成"""
+    if not request.content_type.startswith('audio/'):
+        raise HTTPException(status_code=400, detail="音声ファイルのみアップロード可能です")
+    if request.total_size is not None and request.total_size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail=f"ファイルサイズが{MAX_UPLOAD_SIZE // (1024 * 1024)}MBを超えています")
+    
+    return await upload_session_service.create(
+        content_type=request.content_type,
+        filename=request.filename,
+        total_size=request.total_size
+    )
+
+
+@router.get("/audio/upload/sessions/{session_id}")
+async def get_upload_session(session_id: str):
+    """アップロードセッションの受信状況（再開位置）を取得"""
+    try:
+        return await upload_session_service.get_status(session_id)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+
+
+@router.put("/audio/upload/sessions/{session_id}/chunks/{index}")
+async def put_upload_chunk(session_id: str, index: int, request: Request):
+    """番号付きチャンクをアップロード（同じ番号の再送は上書き）"""
+    if index < 0:
+        raise HTTPException(status_code=400, detail="チャンク番号が不正です")
+    
+    try:
+        return await upload_session_service.put_chunk(session_id, index, request.stream())
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+    except UploadTooLargeError:
+        raise HTTPException(status_code=400, detail=f"ファイルサイズが{MAX_UPLOAD_SIZE // (1024 * 1024)}MBを超えています")
+
+
+@router.post("/audio/upload/sessions/{session_id}/complete")
+async def complete_upload_session(session_id: str, db: Session = Depends(get_db)):
+    """チャンクを結合してアップロードを完了し、日記エントリを作成"""
+    file_id = str(uuid.uuid4())
+    file_path = _new_temp_path(file_id)
+    
+    try:
+        stored = await upload_session_service.complete(session_id, file_path)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+    except UploadSessionIncomplete as e:
+        raise HTTPException(status_code=409, detail=f"チャンクが揃っていません: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ファイル保存エラー: {str(e)}")
+    
+    return await _create_entry_from_file(db, file_id, stored)
+
+
+@router.delete("/audio/upload/sessions/{session_id}")
+async def abort_upload_session(session_id: str):
+    """アップロードセッションを破棄"""
+    try:
+        await upload_session_service.abort(session_id)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+    
+    return {"message": "アップロードセッションを破棄しました"}
+
+
+@router.post("/audio/stream")
+async def start_audio_stream(db: Session = Depends(get_db)):
+    """録音中のセグメント送信（プログレッシブアップロード）を開始し、日記エントリを作成"""
+    file_id = str(uuid.uuid4())
+    file_path = _new_temp_path(file_id)
+    
+    # 放棄された録音を削除
+    await cleanup_abandoned_streams(db)
+    
+    # 設定でリアルタイム文字起こしが有効な場合のみ録音中に文字起こしを進める
+    realtime = _get_setting(db, "enable_realtime_transcription")
+    
+    try:
+        await asyncio.to_thread(realtime_transcriber.start, file_path, bool(realtime))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ファイル保存エラー: {str(e)}")
+    
     db_entry = DiaryEntry(
         file_id=file_id,
         audio_file_path=str(file_path),
@@ -66,14 +311,137 @@ async def upload_audio(file: UploadFile = File(...), db: Session = Depends(get_d
     return {
         "file_id": file_id,
         "entry_id": str(db_entry.id),
-        "filename": filename,
-        "file_path": str(file_path),
-        "file_size": len(file_content),
-        "upload_time": datetime.now(JST).isoformat(),
-        "message": "音声ファイルのアップロードが完了しました"
+        "realtime_transcription": bool(realtime),
+        "message": "録音セッションを開始しました"
+    }
+
+
+async def cleanup_abandoned_streams(db: Session) -> int:
+    """完了も破棄もされずに期限切れになった録音を、日記エントリごと削除し、削除件数を返す"""
+    expired = await realtime_transcriber.cleanup_expired(UPLOAD_TMP_DIR)
+    if not expired:
+        return 0
+    
+    entries = db.query(DiaryEntry).filter(
+        DiaryEntry.audio_file_path.in_([str(path) for path in expired]),
+        DiaryEntry.audio_sha256.is_(None)
+    ).all()
+    for entry in entries:
+        db.delete(entry)
+    db.commit()
+    return len(expired)
+
+
+def _get_stream_entry(db: Session, file_id: str) -> DiaryEntry:
+    """
+    録音中（プログレッシブアップロード中）の日記エントリを取得
+
+    通常のアップロードや完了済みの録音の音声は内容アドレスの格納先にあり、他のエントリと
+    共有している場合があるため、受信中の一時ファイルを使っているエントリのみを対象にする。
+    """
+    entry = db.query(DiaryEntry).filter(DiaryEntry.file_id == file_id).first()
+    if not entry or not entry.audio_file_path:
+        raise HTTPException(status_code=404, detail="録音セッションが見つかりません")
+    file_path = Path(entry.audio_file_path)
+    if entry.audio_sha256 or file_path.parent.resolve() != UPLOAD_TMP_DIR.resolve():
+        raise HTTPException(status_code=409, detail="録音中のセッションではありません")
+    return entry
+
+
+async def _discard_stream_entry(db: Session, entry: DiaryEntry):
+    """録音を破棄し、日記エントリと受信中の音声を削除（_get_stream_entry で取得したエントリのみ）"""
+    file_path = Path(entry.audio_file_path)
+    await realtime_transcriber.abort(file_path)
+    
+    file_path.unlink(missing_ok=True)
+    db.delete(entry)
+    db.commit()
+
+
+@router.put("/audio/stream/{file_id}/segments/{seq}")
+async def put_audio_segment(file_id: str, seq: int, request: Request, db: Session = Depends(get_db)):
+    """録音中のWebMセグメントを追記（同じ番号の再送は無視）"""
+    entry = _get_stream_entry(db, file_id)
+    
+    try:
+        return await realtime_transcriber.append_segment(Path(entry.audio_file_path), seq, request.stream())
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="録音セッションが見つかりません")
+    except SegmentOutOfOrder as e:
+        raise HTTPException(status_code=409, detail=f"セグメント番号が不正です（期待値: {e.expected}）")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=400, detail=f"ファイルサイズが{e.max_size // (1024 * 1024)}MBを超えています")
+
+
+@router.post("/audio/stream/{file_id}/complete")
+async def complete_audio_stream(file_id: str, db: Session = Depends(get_db)):
+    """録音を完了し、録音中に進めた文字起こしを結合して保存"""
+    entry = _get_stream_entry(db, file_id)
+    file_path = Path(entry.audio_file_path)
+    
+    # 音声ファイルの長さをチェック（短すぎる録音は拒否）
+    file_size = file_path.stat().st_size if file_path.exists() else 0
+    try:
+        entry.duration_seconds = await _check_duration(file_path, file_size)
+    except HTTPException:
+        await _discard_stream_entry(db, entry)
+        raise
+    
+    try:
+        result = await realtime_transcriber.finish(file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="録音セッションが見つかりません")
+    except Exception as e:
+        entry.transcription_status = "failed"
+        db.commit()
+        raise HTTPException(status_code=500, detail=f"文字起こし処理でエラーが発生しました: {str(e)}")
+    
+    if result:
+        entry.transcription = result["transcription"]
+        entry.transcription_status = "completed"
+        entry.transcription_task_id = str(uuid.uuid4())
+        entry.transcribe_model = result["model"]
+        entry.updated_at = datetime.now(JST)
+        replace_segments(db, entry.id, result.get("segments"))
+    
+    # 録音が確定したので内容アドレスの格納先へ移動
+    stored = await asyncio.to_thread(hash_file, file_path)
+    await _store_blob(db, entry, stored)
+    
+    # 自動処理が有効な場合は続けて文字起こし（録音中に完了していれば要約）を開始
+    if _get_setting(db, "auto_pipeline"):
+        if result:
+            processing_queue.start_stage(db, SUMMARY, entry)
+        else:
+            _start_transcription(db, entry, next_stage=SUMMARY)
+    db.commit()
+    
+    if entry.transcription_status != "completed":
+        _prepare_audio(entry)
+    
+    return {
+        "file_id": file_id,
+        "entry_id": str(entry.id),
+        "file_size": file_size,
+        "duration_seconds": entry.duration_seconds,
+        "transcription_task_id": entry.transcription_task_id,
+        "transcription_status": entry.transcription_status,
+        "transcription": entry.transcription,
+        "summary_task_id": entry.summary_task_id,
+        "summary_status": entry.summary_status,
+        "message": "録音のアップロードが完了しました"
     }
 
 
+@router.delete("/audio/stream/{file_id}")
+async def abort_audio_stream(file_id: str, db: Session = Depends(get_db)):
+    """録音を破棄し、日記エントリと音声ファイルを削除"""
+    entry = _get_stream_entry(db, file_id)
+    await _discard_stream_entry(db, entry)
+    
+    return {"message": "録音を破棄しました"}
+
+
 @router.post("/transcribe", response_model=TranscribeResponse)
 async def transcribe_audio(request: TranscribeRequest, db: Session = Depends(get_db)):
     """文字起こし処理を開始"""
@@ -82,13 +450,19 @@ async def transcribe_audio(request: TranscribeRequest, db: Session = Depends(get
     if not entry:
         raise HTTPException(status_code=404, detail="対応する日記エントリが見つかりません")
     
-    # タスクIDを生成してDiaryEntryに保存
-    task_id = str(uuid.uuid4())
-    entry.transcription_task_id = task_id
-    entry.transcription_status = "processing"
-    
+    # 同じ内容の音声で文字起こし済みのエントリがあれば結果を再利用し、なければワーカーで実行
+    # （結果は GET /transcribe/{task_id} で取得）
+    task_id = _start_transcription(db, entry)
     db.commit()
     
+    if entry.transcription_status == "completed":
+        return {
+            "task_id": task_id,
+            "file_id": request.file_id,
+            "status": "completed",
+            "message": "同じ音声の文字起こし結果を再利用しました"
+        }
+    
     return {
         "task_id": task_id,
         "file_id": request.file_id,
@@ -98,13 +472,20 @@ async def transcribe_audio(request: TranscribeRequest, db: Session = Depends(get
 
 
 @router.get("/transcribe/{task_id}", response_model=TranscribeResultResponse)
-async def get_transcription_result(task_id: str, db: Session = Depends(get_db)):
+async def get_transcription_result(
+    task_id: str,
+    wait: float = Query(0, ge=0, description="処理中の場合に完了を待つ秒数（ロングポーリング）"),
+    db: Session = Depends(get_db)
+):
     """文字起こし結果を取得"""
     # task_idに対応するDiaryEntryを見つける
     entry = db.query(DiaryEntry).filter(DiaryEntry.transcription_task_id == task_id).first()
     if not entry:
         raise HTTPException(status_code=404, detail="対応するタスクが見つかりません")
     
+    # 処理中の場合は完了・失敗するか指定した時間が経つまで待つ
+    await wait_while_processing(db, entry, TRANSCRIPTION, wait)
+    
     # 既に完了している場合は結果を返す
     if entry.transcription_status == "completed":
         return {
@@ -115,41 +496,7 @@ async def get_transcription_result(task_id: str, db: Session = Depends(get_db)):
             "completed_at": entry.updated_at.isoformat()
         }
     
-    # 処理中の場合、実際に文字起こしを実行
-    if entry.transcription_status == "processing":
-        try:
-            # 音声ファイルの存在確認
-            if not entry.audio_file_path or not Path(entry.audio_file_path).exists():
-                entry.transcription_status = "failed"
-                db.commit()
-                raise HTTPException(status_code=404, detail="音声ファイルが見つかりません")
-            
-            # AI サービスで文字起こし実行
-            result = await transcription_service.transcribe_audio(entry.audio_file_path)
-            
-            # 結果をDiaryEntryに保存
-            entry.transcription = result["transcription"]
-            entry.transcription_status = "completed"
-            entry.transcribe_model = result["model"]
-            entry.updated_at = datetime.now(JST)
-            
-            db.commit()
-            
-            return {
-                "task_id": task_id,
-                "status": "completed",
-                "transcription": result["transcription"],
-                "confidence": result["confidence"],
-                "completed_at": datetime.now(JST).isoformat()
-            }
-            
-        except Exception as e:
-            # エラーが発生した場合
-            entry.transcription_status = "failed"
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"文字起こし処理でエラーが発生しました: {str(e)}")
-    
-    # その他のステータス（pending, failed）
+    # その他のステータス（pending, processing, failed）
     return {
         "task_id": task_id,
         "status": entry.transcription_status,
@@ -174,14 +521,11 @@ async def get_audio_file(file_id: str, db: Session = Depends(get_db)):
     # ファイルを返す
     file_path = Path(entry.audio_file_path)
     
-    # Content-Typeを適切に設定
-    media_type = "audio/webm"
-    if file_path.suffix.lower() == ".mp3":
-        media_type = "audio/mpeg"
-    elif file_path.suffix.lower() == ".wav":
-        media_type = "audio/wav"
-    elif file_path.suffix.lower() == ".ogg":
-        media_type = "audio/ogg"
+    # Content-Typeを適切に設定（判定済みのコンテナを優先し、未判定の既存データは拡張子から）
+    media_type = CONTAINER_MEDIA_TYPES.get(entry.audio_container)
+    if media_type is None:
+        audio_format = await asyncio.to_thread(sniff_format, file_path)
+        media_type = audio_format.media_type if audio_format else "audio/webm"
     
     return FileResponse(
         path=str(file_path),
@@ -1,15 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from typing import List
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, and_, text
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 import json
+import asyncio
 
-from ..database import get_db
-from ..models import DiaryEntry
+from ..database import get_db, SessionLocal
+from ..models import DiaryEntry, TranscriptionSegment
+from ..services.audio_storage import release_blob, purge_blob
+from ..services.entry_events import entry_event_broker
 from ..schemas import (
     DiaryEntryCreate, DiaryEntryUpdate, DiaryEntryResponse, 
-    DiaryEntryListResponse
+    DiaryEntryListResponse, TranscriptionSegmentResponse
 )
 
 router = APIRouter(tags=["diary"])
@@ -17,6 +22,9 @@ router = APIRouter(tags=["diary"])
 # JST (UTC+9) タイムゾーン定義
 JST = timezone(timedelta(hours=9))
 
+# SSEの接続維持のためのコメントを送る間隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+
 
 @router.post("/diary/", response_model=DiaryEntryResponse)
 async def create_diary_entry(entry: DiaryEntryCreate, db: Session = Depends(get_db)):
@@ -67,6 +75,51 @@ async def get_diary_entry(entry_id: str, db: Session = Depends(get_db)):
     return entry
 
 
+@router.get("/diary/by-tag/{tag_name}")
+async def get_diary_entries_by_tag(tag_name: str, page: int = 1, size: int = 10, db: Session = Depends(get_db)):
+    """指定されたタグを含む日記エントリを取得"""
+    offset = (page - 1) * size
+    
+    # JSONエンコードでエスケープを確実に行う
+    tag_array_json = json.dumps([tag_name])
+    
+    entries = db.query(DiaryEntry).filter(
+        text("tags @> :tag_array")
+    ).params(
+        tag_array=tag_array_json
+    ).order_by(DiaryEntry.recorded_at.desc()).offset(offset).limit(size).all()
+    
+    total = db.query(DiaryEntry).filter(
+        text("tags @> :tag_array")
+    ).params(
+        tag_array=tag_array_json
+    ).count()
+    
+    has_next = offset + size < total
+    
+    return {
+        "entries": entries,
+        "total": total,
+        "page": page,
+        "size": size,
+        "has_next": has_next,
+        "tag_name": tag_name
+    }
+
+
+
+@router.get("/diary/{entry_id}/segments", response_model=List[TranscriptionSegmentResponse])
+async def get_diary_segments(entry_id: str, db: Session = Depends(get_db)):
+    """日記エントリの文字起こし区間（音声内の開始・終了秒つき）を取得"""
+    entry = db.query(DiaryEntry.id).filter(DiaryEntry.id == entry_id).first()
+    if not entry:
+        raise HTTPException(status_code=404, detail="日記エントリが見つかりません")
+
+    return db.query(TranscriptionSegment).filter(
+        TranscriptionSegment.entry_id == entry_id
+    ).order_by(TranscriptionSegment.seq).all()
+
+
 @router.put("/diary/{entry_id}", response_model=DiaryEntryResponse)
 async def update_diary_entry(entry_id: str, entry_update: DiaryEntryUpdate, db: Session = Depends(get_db)):
     """日記エントリを更新"""
@@ -103,6 +156,16 @@ async def delete_diary_entry(entry_id: str, db: Session = Depends(get_db)):
     if not entry:
         raise HTTPException(status_code=404, detail="日記エントリが見つかりません")
     
+    # 内容アドレスで保存された音声は参照カウントを減らし、参照がなくなった場合のみ削除
+    if entry.audio_sha256:
+        audio_sha256 = entry.audio_sha256
+        unused = release_blob(db, audio_sha256)
+        db.delete(entry)
+        db.commit()
+        if unused:
+            purge_blob(db, audio_sha256)
+        return {"message": "日記エントリが削除されました"}
+    
     # 関連する音声ファイルも削除
     if entry.audio_file_path and Path(entry.audio_file_path).exists():
         Path(entry.audio_file_path).unlink()
@@ -113,36 +176,62 @@ async def delete_diary_entry(entry_id: str, db: Session = Depends(get_db)):
     return {"message": "日記エントリが削除されました"}
 
 
-@router.get("/diary/by-tag/{tag_name}")
-async def get_diary_entries_by_tag(tag_name: str, page: int = 1, size: int = 10, db: Session = Depends(get_db)):
-    """指定されたタグを含む日記エントリを取得"""
-    offset = (page - 1) * size
-    
-    # JSONエンコードでエスケープを確実に行う
-    tag_array_json = json.dumps([tag_name])
-    
-    entries = db.query(DiaryEntry).filter(
-        text("tags @> :tag_array")
-    ).params(
-        tag_array=tag_array_json
-    ).order_by(DiaryEntry.recorded_at.desc()).offset(offset).limit(size).all()
+def _entry_snapshot(entry_id: str) -> dict:
+    """日記エントリの現在の処理状況"""
+    with SessionLocal() as db:
+        entry = db.query(DiaryEntry).filter(DiaryEntry.id == entry_id).first()
+        if not entry:
+            return {"entry_id": entry_id, "deleted": True}
+        return {
+            "entry_id": entry_id,
+            "title": entry.title,
+            "transcription_status": entry.transcription_status,
+            "summary_status": entry.summary_status,
+            "transcription": entry.transcription,
+            "summary": entry.summary,
+            "tags": entry.tags,
+        }
+
+
+def _sse(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/diary/{entry_id}/events")
+async def stream_diary_events(entry_id: str, request: Request, db: Session = Depends(get_db)):
+    """
+    日記エントリの処理状況をServer-Sent Eventsで配信
     
-    total = db.query(DiaryEntry).filter(
-        text("tags @> :tag_array")
-    ).params(
-        tag_array=tag_array_json
-    ).count()
+    接続時に現在の状況（snapshot）を送り、その後は文字起こし・要約の
+    started / progress / retrying / completed / failed を送る。
+    """
+    entry = db.query(DiaryEntry.id).filter(DiaryEntry.id == entry_id).first()
+    if not entry:
+        raise HTTPException(status_code=404, detail="日記エントリが見つかりません")
+    entry_key = str(entry.id)
+    # 配信中はDB接続を保持しない
+    db.close()
     
-    has_next = offset + size < total
+    async def events():
+        async with entry_event_broker.subscribe(entry_key) as queue:
+            # 購読を開始してから現在の状況を送る（その間のイベントを取りこぼさない）
+            yield _sse("snapshot", await asyncio.to_thread(_entry_snapshot, entry_key))
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["type"] == "resync":
+                    yield _sse("snapshot", await asyncio.to_thread(_entry_snapshot, entry_key))
+                else:
+                    yield _sse(event["type"], event)
     
-    return {
-        "entries": entries,
-        "total": total,
-        "page": page,
-        "size": size,
-        "has_next": has_next,
-        "tag_name": tag_name
-    }
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get("/search")
@@ -178,13 +267,22 @@ async def search_diary_entries(q: str, page: int = 1, size: int = 10, db: Sessio
     
     has_next = offset + size < total
     
+    # 一致した文字起こし区間（音声の該当位置から再生できるよう開始秒を返す）
+    hits = []
+    if entries:
+        hits = db.query(TranscriptionSegment).filter(
+            TranscriptionSegment.entry_id.in_([entry.id for entry in entries]),
+            TranscriptionSegment.text.ilike(f"%{search_query}%")
+        ).order_by(TranscriptionSegment.entry_id, TranscriptionSegment.seq).all()
+    
     return {
         "entries": entries,
         "total": total,
         "page": page,
         "size": size,
         "has_next": has_next,
-        "query": search_query
+        "query": search_query,
+        "hits": [TranscriptionSegmentResponse.model_validate(hit) for hit in hits]
     }
 
 
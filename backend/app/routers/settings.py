@@ -7,6 +7,7 @@ import os
 
 from ..database import get_async_db
 from ..models import UserSettings
+from ..services.settings_cache import settings_cache
 
 router = APIRouter()
 
@@ -16,6 +17,7 @@ class SettingsRequest(BaseModel):
     summary_api: str
     summary_model: str
     enable_realtime_transcription: bool
+    auto_pipeline: bool = False
 
 class SettingsResponse(BaseModel):
     transcribe_api: str
@@ -23,6 +25,7 @@ class SettingsResponse(BaseModel):
     summary_api: str
     summary_model: str
     enable_realtime_transcription: bool
+    auto_pipeline: bool
 
 # 設定のデフォルト値
 DEFAULT_SETTINGS = {
@@ -30,7 +33,9 @@ DEFAULT_SETTINGS = {
     "transcribe_model": "mock-whisper-v1",
     "summary_api": "mock", 
     "summary_model": "mock-gpt-4o-mini",
-    "enable_realtime_transcription": True
+    "enable_realtime_transcription": True,
+    # 録音のアップロード後に文字起こし→要約→タグ提案を自動で実行
+    "auto_pipeline": False
 }
 
 @router.get("/settings", response_model=SettingsResponse)
@@ -72,7 +77,10 @@ async def save_settings(settings: SettingsRequest, db: AsyncSession = Depends(ge
             new_setting = UserSettings(key=key, value=value)
             db.add(new_setting)
         
+        # 同じトランザクションでバージョンを上げ、全プロセスの設定のキャッシュを無効にする
+        version = await settings_cache.bump(db)
         await db.commit()
+        settings_cache.invalidate(version)
         
         # 設定が有効かバリデーション
         await validate_settings(settings_dict)
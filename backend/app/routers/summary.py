@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy.orm import Session
 import uuid
 from datetime import datetime, timezone, timedelta
@@ -6,8 +6,7 @@ from datetime import datetime, timezone, timedelta
 from ..database import get_db
 from ..models import DiaryEntry
 from ..schemas import SummarizeRequest, SummarizeResponse, SummarizeResultResponse
-from ..services.summary import summary_service
-from ..services.tag_suggestion import tag_suggestion_service
+from ..services.processing import processing_queue, wait_while_processing, SUMMARY
 
 router = APIRouter(tags=["summary"])
 
@@ -25,14 +24,12 @@ async def summarize_text(request: SummarizeRequest, db: Session = Depends(get_db
         if not entry:
             raise HTTPException(status_code=404, detail="対応する日記エントリが見つかりません")
     
-    # タスクIDを生成
-    task_id = str(uuid.uuid4())
-    
-    # DiaryEntryがある場合はタスクIDを保存
+    # DiaryEntryがある場合はタスクIDを保存し、要約はワーカーで実行（結果は GET /summarize/{task_id} で取得）
     if entry:
-        entry.summary_task_id = task_id
-        entry.summary_status = "processing"
+        task_id = processing_queue.start_stage(db, SUMMARY, entry)
         db.commit()
+    else:
+        task_id = str(uuid.uuid4())
     
     return {
         "task_id": task_id,
@@ -43,7 +40,11 @@ async def summarize_text(request: SummarizeRequest, db: Session = Depends(get_db
 
 
 @router.get("/summarize/{task_id}", response_model=SummarizeResultResponse)
-async def get_summary_result(task_id: str, db: Session = Depends(get_db)):
+async def get_summary_result(
+    task_id: str,
+    wait: float = Query(0, ge=0, description="処理中の場合に完了を待つ秒数（ロングポーリング）"),
+    db: Session = Depends(get_db)
+):
     """要約結果を取得"""
     # task_idに対応するDiaryEntryを見つける
     entry = db.query(DiaryEntry).filter(DiaryEntry.summary_task_id == task_id).first()
@@ -56,6 +57,9 @@ async def get_summary_result(task_id: str, db: Session = Depends(get_db)):
             "completed_at": datetime.now(JST).isoformat()
         }
     
+    # 処理中の場合は完了・失敗するか指定した時間が経つまで待つ
+    await wait_while_processing(db, entry, SUMMARY, wait)
+    
     # 既に完了している場合は結果を返す
     if entry.summary_status == "completed":
         return {
@@ -65,57 +69,7 @@ async def get_summary_result(task_id: str, db: Session = Depends(get_db)):
             "completed_at": entry.updated_at.isoformat()
         }
     
-    # 処理中の場合、実際に要約を実行
-    if entry.summary_status == "processing":
-        try:
-            # 文字起こし結果が必要
-            if not entry.transcription:
-                entry.summary_status = "failed"
-                db.commit()
-                raise HTTPException(status_code=400, detail="文字起こし結果がありません。先に文字起こしを完了してください。")
-            
-            # AI サービスで要約実行
-            result = await summary_service.summarize_text(entry.transcription)
-            
-            # 結果をDiaryEntryに保存
-            entry.summary = result["summary"]
-            entry.summary_status = "completed"
-            entry.summary_model = result["model"]
-            
-            # タイトルが未設定の場合は自動生成
-            if not entry.title:
-                entry.title = result["title"]
-            
-            # 新規録音の場合のみタグ自動提案（タグが未設定かつ要約が初回完了）
-            if not entry.tags and entry.transcription and entry.summary:
-                try:
-                    suggested_tags = await tag_suggestion_service.suggest_tags(
-                        entry.transcription, entry.summary
-                    )
-                    if suggested_tags:
-                        entry.tags = suggested_tags
-                except Exception as e:
-                    print(f"Tag suggestion failed: {str(e)}")
-                    # タグ提案の失敗は処理を継続させる
-            
-            entry.updated_at = datetime.now(JST)
-            
-            db.commit()
-            
-            return {
-                "task_id": task_id,
-                "status": "completed",
-                "summary": result["summary"],
-                "completed_at": datetime.now(JST).isoformat()
-            }
-            
-        except Exception as e:
-            # エラーが発生した場合
-            entry.summary_status = "failed"
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"要約処理でエラーが発生しました: {str(e)}")
-    
-    # その他のステータス（pending, failed）
+    # その他のステータス（pending, processing, failed）
     return {
         "task_id": task_id,
         "status": entry.summary_status,
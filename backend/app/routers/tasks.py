@@ -0,0 +1,103 @@
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..models import DiaryEntry, User
+from ..schemas import ReprocessRequest, TaskStatusRequest, TaskStatusResponse
+from ..services.processing import processing_queue, BACKFILL, TRANSCRIPTION, SUMMARY
+from .auth import get_current_user
+
+router = APIRouter(tags=["tasks"])
+
+# 一度に問い合わせできるタスク数の上限
+TASK_STATUS_BATCH_LIMIT = 500
+
+
+@router.post("/tasks/status", response_model=TaskStatusResponse)
+async def get_task_statuses(request: TaskStatusRequest, db: Session = Depends(get_db)):
+    """
+    複数の文字起こし・要約タスクの状態をまとめて取得
+
+    1回のクエリ（タスクIDの IN 検索）で取得するため、オフライン同期後に多数の
+    処理中エントリを確認する場合もタスクごとにリクエストする必要がない。
+    見つからないタスク（別のタスクで置き換えられた場合等）は not_found を返す。
+    """
+    transcription_ids = list(dict.fromkeys(request.transcription_task_ids))
+    summary_ids = list(dict.fromkeys(request.summary_task_ids))
+    if len(transcription_ids) + len(summary_ids) > TASK_STATUS_BATCH_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一度に問い合わせできるタスクは{TASK_STATUS_BATCH_LIMIT}件までです"
+        )
+    if not transcription_ids and not summary_ids:
+        return {"tasks": []}
+
+    conditions = []
+    if transcription_ids:
+        conditions.append(DiaryEntry.transcription_task_id.in_(transcription_ids))
+    if summary_ids:
+        conditions.append(DiaryEntry.summary_task_id.in_(summary_ids))
+    rows = db.query(
+        DiaryEntry.id,
+        DiaryEntry.transcription_task_id,
+        DiaryEntry.transcription_status,
+        DiaryEntry.summary_task_id,
+        DiaryEntry.summary_status,
+    ).filter(or_(*conditions)).all()
+
+    transcriptions = {row.transcription_task_id: (row.id, row.transcription_status) for row in rows}
+    summaries = {row.summary_task_id: (row.id, row.summary_status) for row in rows}
+
+    tasks = []
+    for task_type, task_ids, found in (
+        ("transcription", transcription_ids, transcriptions),
+        ("summary", summary_ids, summaries),
+    ):
+        for task_id in task_ids:
+            entry_id, status = found.get(task_id, (None, "not_found"))
+            tasks.append({"task_id": task_id, "type": task_type, "entry_id": entry_id, "status": status})
+
+    return {"tasks": tasks}
+
+
+@router.post("/tasks/reprocess", response_model=TaskStatusResponse)
+async def reprocess_entries(
+    request: ReprocessRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    日記エントリの文字起こし・要約を一括でやり直す（管理者のみ）
+
+    モデルの変更後や失敗したエントリの再処理用。ジョブは低優先度（backfill）のレーンに
+    登録されるため、新しく録音されたエントリの処理を待たせない。
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="管理者のみ実行できます")
+    if request.stage not in (TRANSCRIPTION, SUMMARY):
+        raise HTTPException(status_code=400, detail="stage には transcription または summary を指定してください")
+    if not 1 <= request.limit <= TASK_STATUS_BATCH_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一度に再処理できるエントリは{TASK_STATUS_BATCH_LIMIT}件までです"
+        )
+
+    if request.stage == TRANSCRIPTION:
+        status_column, source_column = DiaryEntry.transcription_status, DiaryEntry.audio_file_path
+    else:
+        status_column, source_column = DiaryEntry.summary_status, DiaryEntry.transcription
+    query = db.query(DiaryEntry).filter(status_column != "processing", source_column.isnot(None))
+    if request.entry_ids:
+        query = query.filter(DiaryEntry.id.in_(request.entry_ids))
+    else:
+        query = query.filter(status_column == request.status)
+    entries = query.order_by(DiaryEntry.recorded_at.desc()).limit(request.limit).all()
+
+    tasks = []
+    for entry in entries:
+        task_id = processing_queue.start_stage(db, request.stage, entry, priority=BACKFILL)
+        tasks.append({"task_id": task_id, "type": request.stage, "entry_id": entry.id, "status": "processing"})
+    db.commit()
+
+    return {"tasks": tasks}
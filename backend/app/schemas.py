@@ -7,6 +7,11 @@ from uuid import UUID
 class TranscribeRequest(BaseModel):
     file_id: str
 
+class UploadSessionCreateRequest(BaseModel):
+    content_type: str
+    filename: Optional[str] = None
+    total_size: Optional[int] = None  # 分かっている場合は完了時に検証
+
 class SummarizeRequest(BaseModel):
     text: str
     entry_id: Optional[str] = None  # 日記エントリIDを追加
@@ -29,6 +34,9 @@ class DiaryEntryResponse(BaseModel):
     recorded_at: datetime
     audio_file_path: Optional[str]
     file_id: Optional[str]
+    duration_seconds: Optional[float] = None
+    audio_container: Optional[str] = None
+    audio_codec: Optional[str] = None
     transcription: Optional[str]
     summary: Optional[str]
     tags: Optional[List[str]]
@@ -56,6 +64,16 @@ class TranscribeResponse(BaseModel):
     status: str
     message: str
 
+class TranscriptionSegmentResponse(BaseModel):
+    entry_id: UUID
+    seq: int
+    start_seconds: float
+    end_seconds: float
+    text: str
+    
+    class Config:
+        from_attributes = True
+
 class TranscribeResultResponse(BaseModel):
     task_id: str
     status: str
@@ -75,6 +93,25 @@ class SummarizeResultResponse(BaseModel):
     summary: Optional[str] = None
     completed_at: Optional[datetime] = None
 
+class TaskStatusRequest(BaseModel):
+    transcription_task_ids: List[str] = []
+    summary_task_ids: List[str] = []
+
+class ReprocessRequest(BaseModel):
+    stage: str  # transcription, summary
+    entry_ids: Optional[List[UUID]] = None  # 指定しない場合は status が一致するエントリ
+    status: str = "failed"
+    limit: int = 100
+
+class TaskStatusItem(BaseModel):
+    task_id: str
+    type: str  # transcription, summary
+    entry_id: Optional[UUID] = None
+    status: str  # pending, processing, completed, failed, not_found
+
+class TaskStatusResponse(BaseModel):
+    tasks: List[TaskStatusItem]
+
 # 認証関連スキーマ
 class UserCreate(BaseModel):
     username: str
@@ -0,0 +1,57 @@
+import asyncio
+from pathlib import Path
+from typing import Awaitable, Dict, Set
+
+from .audio_storage import artifact_path
+from .audio_transcode import WireFormat, transcode_to_path
+
+
+class AudioArtifactService:
+    """
+    プロバイダー送信用に正規化（16kHzモノラル・送信形式へ変換）した音声の管理
+
+    正規化済みの音声は元の音声の隣に、内容ハッシュと送信形式をキーとして保存する
+    （objects/ab/cd/<hash>.norm<拡張子>）。同じ音声の文字起こしをやり直す場合や
+    モデルを変えて再実行する場合も、デコード・リサンプリングは一度だけ行われる。
+    """
+
+    def __init__(self):
+        self._pending: Dict[Path, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+
+    def normalized_path(self, sha256: str, wire: WireFormat) -> Path:
+        return artifact_path(sha256, "norm", wire.suffix)
+
+    async def ensure_normalized(self, src_path: str, sha256: str, wire: WireFormat) -> Path:
+        """
+        正規化済みの音声を取得（なければ作成）
+
+        同じ音声・形式の作成が進行中の場合はその完了を待つ。
+        """
+        dest = self.normalized_path(sha256, wire)
+        if await asyncio.to_thread(dest.exists):
+            return dest
+
+        task = self._pending.get(dest)
+        if task is None:
+            task = asyncio.create_task(transcode_to_path(src_path, dest, wire))
+            self._pending[dest] = task
+            task.add_done_callback(lambda _: self._pending.pop(dest, None))
+        # 待っている側がキャンセルされても作成は続ける
+        return await asyncio.shield(task)
+
+    def run_in_background(self, job: Awaitable):
+        """作成処理をバックグラウンドで実行（失敗しても文字起こし時に改めて作成される）"""
+        async def _run():
+            try:
+                await job
+            except Exception:
+                pass
+
+        task = asyncio.create_task(_run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+
+# シングルトンインスタンス
+audio_artifact_service = AudioArtifactService()
@@ -0,0 +1,562 @@
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple, Union
+
+
+# WebM(EBML)の要素ID
+EBML_HEADER_ID = 0x1A45DFA3
+EBML_SEGMENT_ID = 0x18538067
+EBML_INFO_ID = 0x1549A966
+EBML_TIMECODE_SCALE_ID = 0x2AD7B1
+EBML_DURATION_ID = 0x4489
+EBML_CLUSTER_ID = 0x1F43B675
+EBML_TIMECODE_ID = 0xE7
+EBML_SIMPLE_BLOCK_ID = 0xA3
+EBML_BLOCK_GROUP_ID = 0xA0
+EBML_BLOCK_ID = 0xA1
+
+EBML_CLUSTER_ID_BYTES = EBML_CLUSTER_ID.to_bytes(4, "big")
+
+# ヘッダ解析のために読み込む範囲
+_HEAD_BYTES = 64 * 1024
+_TAIL_BYTES = (256 * 1024, 4 * 1024 * 1024)
+_MP4_MOOV_MAX_BYTES = 4 * 1024 * 1024
+
+# コンテナごとの拡張子とMIMEタイプ
+CONTAINER_SUFFIXES = {
+    "webm": ".webm", "ogg": ".ogg", "mp4": ".m4a", "mp3": ".mp3", "wav": ".wav", "flac": ".flac",
+}
+CONTAINER_MEDIA_TYPES = {
+    "webm": "audio/webm", "ogg": "audio/ogg", "mp4": "audio/mp4", "mp3": "audio/mpeg",
+    "wav": "audio/wav", "flac": "audio/flac",
+}
+
+# WebMのCodecID・MP4のサンプルエントリとコーデック名の対応
+_WEBM_CODECS = {b"A_OPUS": "opus", b"A_VORBIS": "vorbis", b"A_AAC": "aac", b"A_PCM": "pcm", b"A_FLAC": "flac"}
+_MP4_CODECS = {b"mp4a": "aac", b"alac": "alac", b"Opus": "opus", b"fLaC": "flac", b".mp3": "mp3"}
+
+# MP3のビットレート表（kbps）: [MPEG1, MPEG2/2.5][Layer I, II, III]
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """マジックバイトから判定した音声の形式"""
+    container: str                      # webm / ogg / mp4 / mp3 / wav / flac
+    codec: Optional[str] = None         # opus / vorbis / aac / mp3 / pcm / flac など
+    sample_rate: Optional[int] = None   # ヘッダから取得できた場合のみ
+    channels: Optional[int] = None
+
+    @property
+    def suffix(self) -> str:
+        return CONTAINER_SUFFIXES[self.container]
+
+    @property
+    def media_type(self) -> str:
+        return CONTAINER_MEDIA_TYPES[self.container]
+
+
+def read_vint(data: bytes, pos: int) -> Optional[Tuple[int, int]]:
+    """EBMLの可変長整数を読む（値, バイト長）。データ不足・不正な場合はNone"""
+    if pos >= len(data):
+        return None
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        return None
+    value = first & (mask - 1)
+    for b in data[pos + 1:pos + length]:
+        value = (value << 8) | b
+    return value, length
+
+
+def read_element_id(data: bytes, pos: int) -> Optional[Tuple[int, int]]:
+    """EBMLの要素IDを読む（ID, バイト長）。IDはマーカービットを含めた値"""
+    vint = read_vint(data, pos)
+    if vint is None or vint[1] > 4:
+        return None
+    return int.from_bytes(data[pos:pos + vint[1]], "big"), vint[1]
+
+
+def read_element_header(data: bytes, pos: int) -> Optional[Tuple[int, Optional[int], int]]:
+    """要素ヘッダを読む（ID, データサイズ（不定長はNone）, ヘッダ長）"""
+    element_id = read_element_id(data, pos)
+    if element_id is None:
+        return None
+    size = read_vint(data, pos + element_id[1])
+    if size is None:
+        return None
+    # 全ビットが1のサイズは不定長（MediaRecorderのSegment/Clusterなど）
+    data_size = None if size[0] == (1 << (7 * size[1])) - 1 else size[0]
+    return element_id[0], data_size, element_id[1] + size[1]
+
+
+def cluster_timecode(data: bytes, pos: int) -> Optional[int]:
+    """posにあるClusterのTimecodeを返す。Clusterでない・データ不足の場合はNone"""
+    header = read_element_header(data, pos)
+    if header is None or header[0] != EBML_CLUSTER_ID:
+        return None
+    p = pos + header[2]
+    child = read_element_header(data, p)
+    if child is None or child[0] != EBML_TIMECODE_ID or child[1] is None or child[1] > 8:
+        return None
+    p += child[2]
+    if p + child[1] > len(data):
+        return None
+    return int.from_bytes(data[p:p + child[1]], "big")
+
+
+def find_clusters(data: bytes, base_offset: int = 0) -> list:
+    """データ中のWebM Clusterを検出し、[(ファイル内オフセット, Timecode)] を返す"""
+    clusters = []
+    pos = data.find(EBML_CLUSTER_ID_BYTES)
+    while pos != -1:
+        timecode = cluster_timecode(data, pos)
+        if timecode is not None:
+            clusters.append((base_offset + pos, timecode))
+        pos = data.find(EBML_CLUSTER_ID_BYTES, pos + 1)
+    return clusters
+
+
+def _read_uint(data: bytes) -> int:
+    return int.from_bytes(data, "big")
+
+
+def _read_float(data: bytes) -> Optional[float]:
+    if len(data) == 4:
+        return struct.unpack(">f", data)[0]
+    if len(data) == 8:
+        return struct.unpack(">d", data)[0]
+    return None
+
+
+def _webm_info(head: bytes) -> Tuple[int, Optional[float]]:
+    """Segment Info から (TimecodeScale, Duration) を読む"""
+    timecode_scale = 1_000_000
+    duration = None
+
+    pos = 0
+    header = read_element_header(head, pos)
+    if header is None or header[0] != EBML_HEADER_ID or header[1] is None:
+        return timecode_scale, None
+    pos += header[2] + header[1]
+
+    header = read_element_header(head, pos)
+    if header is None or header[0] != EBML_SEGMENT_ID:
+        return timecode_scale, None
+    pos += header[2]
+
+    # Segment直下の要素を順に走査してInfoを探す
+    while pos < len(head):
+        header = read_element_header(head, pos)
+        if header is None:
+            break
+        element_id, size, header_len = header
+        if element_id == EBML_CLUSTER_ID or size is None:
+            break
+        if element_id == EBML_INFO_ID:
+            p = pos + header_len
+            end = min(p + size, len(head))
+            while p < end:
+                child = read_element_header(head, p)
+                if child is None or child[1] is None:
+                    break
+                value = head[p + child[2]:p + child[2] + child[1]]
+                if child[0] == EBML_TIMECODE_SCALE_ID:
+                    timecode_scale = _read_uint(value) or timecode_scale
+                elif child[0] == EBML_DURATION_ID:
+                    duration = _read_float(value)
+                p += child[2] + child[1]
+            break
+        pos += header_len + size
+
+    return timecode_scale, duration
+
+
+def _webm_last_timecode(tail: bytes) -> Optional[int]:
+    """末尾データの最後のClusterから、最後のブロックの絶対Timecodeを求める"""
+    clusters = find_clusters(tail)
+    if not clusters:
+        return None
+    offset, base = clusters[-1]
+    last = base
+
+    header = read_element_header(tail, offset)
+    p = offset + header[2]
+    while p < len(tail):
+        child = read_element_header(tail, p)
+        if child is None:
+            break
+        element_id, size, header_len = child
+        if element_id == EBML_CLUSTER_ID:
+            break
+        body = p + header_len
+        if element_id == EBML_SIMPLE_BLOCK_ID:
+            block = body
+        elif element_id == EBML_BLOCK_GROUP_ID:
+            inner = read_element_header(tail, body)
+            block = body + inner[2] if inner and inner[0] == EBML_BLOCK_ID else None
+        else:
+            block = None
+        if block is not None:
+            track = read_vint(tail, block)
+            if track and block + track[1] + 2 <= len(tail):
+                relative = struct.unpack(">h", tail[block + track[1]:block + track[1] + 2])[0]
+                last = max(last, base + relative)
+        if size is None:
+            break
+        p = body + size
+
+    return last
+
+
+def _probe_webm(f: BinaryIO, head: bytes, file_size: int) -> Optional[float]:
+    timecode_scale, duration = _webm_info(head)
+    if duration:
+        return duration * timecode_scale / 1e9
+
+    # MediaRecorderのWebMはDurationを持たないため、最後のブロックのTimecodeから求める
+    for tail_size in _TAIL_BYTES:
+        start = max(0, file_size - tail_size)
+        f.seek(start)
+        last = _webm_last_timecode(f.read())
+        if last is not None:
+            # 最後のフレーム長（Opusは通常20ms）を加算
+            return last * timecode_scale / 1e9 + 0.02
+        if start == 0:
+            break
+    return None
+
+
+def _probe_ogg(f: BinaryIO, head: bytes, file_size: int) -> Optional[float]:
+    # 最初のページの識別ヘッダからサンプルレートを取得
+    segments = head[26] if len(head) > 27 else 0
+    packet = head[27 + segments:]
+    pre_skip = 0
+    if packet.startswith(b"OpusHead") and len(packet) >= 12:
+        sample_rate = 48000  # Opusのgranule positionは常に48kHz
+        pre_skip = struct.unpack("<H", packet[10:12])[0]
+    elif packet.startswith(b"\x01vorbis") and len(packet) >= 16:
+        sample_rate = struct.unpack("<I", packet[12:16])[0]
+    elif packet.startswith(b"\x7fFLAC") and len(packet) >= 30:
+        sample_rate = _read_uint(packet[27:30]) >> 4
+    else:
+        return None
+    if not sample_rate:
+        return None
+
+    # 最後のページのgranule positionが総サンプル数
+    for tail_size in _TAIL_BYTES:
+        start = max(0, file_size - tail_size)
+        f.seek(start)
+        tail = f.read()
+        pos = tail.rfind(b"OggS")
+        while pos != -1:
+            if pos + 14 <= len(tail):
+                granule = struct.unpack("<q", tail[pos + 6:pos + 14])[0]
+                if granule >= 0:
+                    return max(0, granule - pre_skip) / sample_rate
+            pos = tail.rfind(b"OggS", 0, pos)
+        if start == 0:
+            break
+    return None
+
+
+def _probe_wav(f: BinaryIO, head: bytes, file_size: int) -> Optional[float]:
+    byte_rate = None
+    pos = 12
+    while pos + 8 <= len(head):
+        chunk_id = head[pos:pos + 4]
+        chunk_size = struct.unpack("<I", head[pos + 4:pos + 8])[0]
+        if chunk_id == b"fmt " and pos + 20 <= len(head):
+            byte_rate = struct.unpack("<I", head[pos + 16:pos + 20])[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # ストリーミング書き出しのWAVはdataサイズが未確定（0や0xFFFFFFFF）の場合がある
+            available = file_size - (pos + 8)
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            return chunk_size / byte_rate
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _probe_mp3(f: BinaryIO, head: bytes, file_size: int) -> Optional[float]:
+    # ID3v2タグをスキップ
+    audio_start = 0
+    if head.startswith(b"ID3") and len(head) >= 10:
+        tag_size = (head[6] & 0x7F) << 21 | (head[7] & 0x7F) << 14 | (head[8] & 0x7F) << 7 | (head[9] & 0x7F)
+        audio_start = 10 + tag_size
+        f.seek(audio_start)
+        head = f.read(_HEAD_BYTES)
+
+    # 最初のフレームヘッダを探す
+    pos = 0
+    while pos + 4 <= len(head):
+        if head[pos] == 0xFF and head[pos + 1] & 0xE0 == 0xE0:
+            header = _read_uint(head[pos:pos + 4])
+            version_bits = (header >> 19) & 0x3
+            layer_bits = (header >> 17) & 0x3
+            bitrate_index = (header >> 12) & 0xF
+            sample_rate_index = (header >> 10) & 0x3
+            if version_bits != 1 and layer_bits != 0 and bitrate_index not in (0, 15) and sample_rate_index != 3:
+                break
+        pos += 1
+    else:
+        return None
+
+    version = 1 if version_bits == 3 else 2
+    layer = 4 - layer_bits
+    bitrate = _MP3_BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+    channel_mode = (header >> 6) & 0x3
+    if layer == 1:
+        samples_per_frame = 384
+    elif layer == 2 or version == 1:
+        samples_per_frame = 1152
+    else:
+        samples_per_frame = 576
+
+    # VBRの場合はXing/Info/VBRIヘッダのフレーム数から求める
+    if version == 1:
+        side_info = 17 if channel_mode == 3 else 32
+    else:
+        side_info = 9 if channel_mode == 3 else 17
+    xing = pos + 4 + side_info
+    if head[xing:xing + 4] in (b"Xing", b"Info") and len(head) >= xing + 12:
+        flags = struct.unpack(">I", head[xing + 4:xing + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack(">I", head[xing + 8:xing + 12])[0]
+            return frames * samples_per_frame / sample_rate
+    vbri = pos + 4 + 32
+    if head[vbri:vbri + 4] == b"VBRI" and len(head) >= vbri + 18:
+        frames = struct.unpack(">I", head[vbri + 14:vbri + 18])[0]
+        return frames * samples_per_frame / sample_rate
+
+    # CBRの場合はファイルサイズとビットレートから求める
+    audio_size = file_size - audio_start - pos
+    f.seek(max(0, file_size - 128))
+    if f.read(3) == b"TAG":  # ID3v1タグ
+        audio_size -= 128
+    return audio_size * 8 / bitrate if bitrate else None
+
+
+def _probe_flac(f: BinaryIO, head: bytes, file_size: int) -> Optional[float]:
+    # 最初のメタデータブロックはSTREAMINFO
+    if len(head) < 26 or head[4] & 0x7F != 0:
+        return None
+    info = head[8:42]
+    sample_rate = _read_uint(info[10:13]) >> 4
+    total_samples = _read_uint(info[13:18]) & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return total_samples / sample_rate
+
+
+def _mp4_moov(f: BinaryIO, file_size: int) -> Optional[bytes]:
+    """トップレベルのボックスを辿ってmoovボックスの中身を読む（moovは末尾にある場合もある）"""
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, box_type = struct.unpack(">I4s", header[:8])
+        header_len = 8
+        if size == 1:
+            if len(header) < 16:
+                return None
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_len = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_len:
+            return None
+        if box_type == b"moov":
+            if size > _MP4_MOOV_MAX_BYTES:
+                return None
+            f.seek(pos + header_len)
+            return f.read(size - header_len)
+        pos += size
+    return None
+
+
+def _probe_mp4(f: BinaryIO, head: bytes, file_size: int) -> Optional[float]:
+    moov = _mp4_moov(f, file_size)
+    pos = moov.find(b"mvhd") if moov else -1
+    if pos == -1:
+        return None
+    body = moov[pos + 4:]
+    if body[0] == 1:
+        timescale, duration = struct.unpack(">IQ", body[20:32])
+    else:
+        timescale, duration = struct.unpack(">II", body[12:20])
+    return duration / timescale if timescale else None
+
+
+def _detect_container(head: bytes) -> Optional[str]:
+    """先頭バイトからコンテナを判定"""
+    if head.startswith(EBML_HEADER_ID.to_bytes(4, "big")):
+        return "webm"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return "wav"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return None
+
+
+def _opus_head(data: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """OpusHeadから (入力サンプルレート, チャンネル数) を取得"""
+    pos = data.find(b"OpusHead")
+    if pos == -1 or pos + 16 > len(data):
+        return None, None
+    channels = data[pos + 9]
+    sample_rate = struct.unpack("<I", data[pos + 12:pos + 16])[0]
+    return sample_rate or None, channels or None
+
+
+def _find_codec(data: bytes, codecs: dict) -> Tuple[Optional[str], int]:
+    """最初に現れるコーデック識別子を探し、(コーデック名, 位置) を返す"""
+    found = []
+    for key, name in codecs.items():
+        pos = data.find(key)
+        if pos != -1:
+            found.append((pos, name))
+    if not found:
+        return None, -1
+    pos, name = min(found)
+    return name, pos
+
+
+def _sniff_webm(f: BinaryIO, head: bytes, file_size: int) -> AudioFormat:
+    # TracksはClusterより前にあるため先頭だけで判定できる
+    codec, _ = _find_codec(head, _WEBM_CODECS)
+    if codec == "opus":
+        sample_rate, channels = _opus_head(head)
+        return AudioFormat("webm", codec, sample_rate, channels)
+    return AudioFormat("webm", codec)
+
+
+def _sniff_ogg(f: BinaryIO, head: bytes, file_size: int) -> AudioFormat:
+    segments = head[26] if len(head) > 27 else 0
+    packet = head[27 + segments:]
+    if packet.startswith(b"OpusHead"):
+        sample_rate, channels = _opus_head(packet)
+        return AudioFormat("ogg", "opus", sample_rate, channels)
+    if packet.startswith(b"\x01vorbis") and len(packet) >= 16:
+        return AudioFormat("ogg", "vorbis", struct.unpack("<I", packet[12:16])[0], packet[11])
+    if packet.startswith(b"\x7fFLAC") and len(packet) >= 30:
+        return AudioFormat("ogg", "flac", _read_uint(packet[27:30]) >> 4, ((packet[29] >> 1) & 0x7) + 1)
+    return AudioFormat("ogg")
+
+
+def _sniff_wav(f: BinaryIO, head: bytes, file_size: int) -> AudioFormat:
+    pos = 12
+    while pos + 8 <= len(head):
+        chunk_id = head[pos:pos + 4]
+        chunk_size = struct.unpack("<I", head[pos + 4:pos + 8])[0]
+        if chunk_id == b"fmt " and pos + 16 <= len(head):
+            format_tag, channels, sample_rate = struct.unpack("<HHI", head[pos + 8:pos + 16])
+            codec = {1: "pcm", 3: "pcm_float", 6: "alaw", 7: "mulaw", 0x55: "mp3", 0xFFFE: "pcm"}.get(format_tag)
+            return AudioFormat("wav", codec, sample_rate, channels)
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return AudioFormat("wav")
+
+
+def _sniff_flac(f: BinaryIO, head: bytes, file_size: int) -> AudioFormat:
+    if len(head) < 26 or head[4] & 0x7F != 0:
+        return AudioFormat("flac", "flac")
+    info = head[8:42]
+    return AudioFormat("flac", "flac", _read_uint(info[10:13]) >> 4, ((info[12] >> 1) & 0x7) + 1)
+
+
+def _sniff_mp4(f: BinaryIO, head: bytes, file_size: int) -> AudioFormat:
+    moov = _mp4_moov(f, file_size)
+    codec, pos = _find_codec(moov or b"", _MP4_CODECS)
+    if codec is None:
+        return AudioFormat("mp4")
+    # AudioSampleEntry: 予約領域(16) + channelcount(2) + samplesize(2) + 予約(4) + samplerate(16.16)
+    entry = moov[pos + 4:pos + 32]
+    if len(entry) < 28:
+        return AudioFormat("mp4", codec)
+    channels = struct.unpack(">H", entry[16:18])[0]
+    sample_rate = struct.unpack(">I", entry[24:28])[0] >> 16
+    return AudioFormat("mp4", codec, sample_rate or None, channels or None)
+
+
+def _sniff_mp3(f: BinaryIO, head: bytes, file_size: int) -> AudioFormat:
+    return AudioFormat("mp3", "mp3")
+
+
+_PROBES = {
+    "webm": _probe_webm, "ogg": _probe_ogg, "wav": _probe_wav,
+    "flac": _probe_flac, "mp4": _probe_mp4, "mp3": _probe_mp3,
+}
+_SNIFFERS = {
+    "webm": _sniff_webm, "ogg": _sniff_ogg, "wav": _sniff_wav,
+    "flac": _sniff_flac, "mp4": _sniff_mp4, "mp3": _sniff_mp3,
+}
+
+
+def probe_duration(path: Union[str, Path]) -> Optional[float]:
+    """
+    コンテナのヘッダから音声の長さ（秒）を求める（デコードは行わない）
+
+    対応形式: WebM/Matroska, Ogg(Opus/Vorbis/FLAC), WAV, MP3, FLAC, MP4/M4A
+
+    Returns:
+        Optional[float]: 長さ（秒）。形式が不明・ヘッダが壊れている場合はNone
+    """
+    path = Path(path)
+    try:
+        file_size = path.stat().st_size
+        with open(path, "rb") as f:
+            head = f.read(_HEAD_BYTES)
+            probe = _PROBES.get(_detect_container(head))
+            if probe:
+                return probe(f, head, file_size)
+    except (OSError, struct.error, IndexError, KeyError):
+        return None
+    return None
+
+
+def sniff_format(path: Union[str, Path]) -> Optional[AudioFormat]:
+    """
+    マジックバイトから音声のコンテナとコーデックを判定する（拡張子・Content-Typeは使わない）
+
+    対応形式: WebM, Ogg, MP4/M4A, MP3, WAV, FLAC
+
+    Returns:
+        Optional[AudioFormat]: 判定結果。対応していない形式の場合はNone
+    """
+    path = Path(path)
+    try:
+        file_size = path.stat().st_size
+        with open(path, "rb") as f:
+            head = f.read(_HEAD_BYTES)
+            sniff = _SNIFFERS.get(_detect_container(head))
+            if sniff:
+                return sniff(f, head, file_size)
+    except (OSError, struct.error, IndexError):
+        return None
+    return None
@@ -0,0 +1,267 @@
+import os
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import event, func, select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import AudioBlob
+
+
+# アップロード関連の設定（環境変数から）
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "/app/uploads"))
+# 内容アドレス（SHA-256）で保存する音声ファイルの格納先
+AUDIO_OBJECT_DIR = UPLOAD_DIR / "objects"
+# 受信中・ハッシュ計算前のファイルの一時置き場
+UPLOAD_TMP_DIR = UPLOAD_DIR / ".tmp"
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+class UploadTooLargeError(Exception):
+    """アップロードサイズが上限を超えた場合のエラー"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"Upload exceeds {max_size} bytes")
+        self.max_size = max_size
+
+
+@dataclass
+class StoredFile:
+    """ディスクに書き込んだファイルの情報"""
+    path: Path
+    size: int
+    sha256: str
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """UploadFileを固定サイズのチャンクで読み出す"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def write_stream(
+    chunks: AsyncIterator[bytes],
+    dest_path: Path,
+    max_size: int = MAX_UPLOAD_SIZE,
+    append: bool = False,
+) -> StoredFile:
+    """
+    バイト列のストリームをディスクへ書き込む
+
+    書き込みはスレッドプールで行い、イベントループをブロックしない。
+    サイズ上限は書き込み中にチェックし、超過した時点で中断する。
+    SHA-256とバイト数はデータが通過する際に計算する。
+
+    Args:
+        chunks: 書き込むバイト列の非同期イテレータ
+        dest_path: 書き込み先パス
+        max_size: 最大バイト数（append時は追記分のみが対象）
+        append: Trueの場合は既存ファイルへ追記する
+
+    Returns:
+        StoredFile: 書き込んだファイルの情報（sha256は今回書き込んだ分のもの）
+
+    Raises:
+        UploadTooLargeError: サイズ上限を超えた場合
+    """
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await asyncio.to_thread(open, dest_path, "ab" if append else "wb")
+    start = buffer.tell()
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLargeError(max_size)
+            digest.update(chunk)
+            await asyncio.to_thread(buffer.write, chunk)
+    except BaseException:
+        # 失敗時は書き込み前の状態に戻す
+        if append:
+            await asyncio.to_thread(buffer.truncate, start)
+        await asyncio.to_thread(buffer.close)
+        if not append:
+            dest_path.unlink(missing_ok=True)
+        raise
+    await asyncio.to_thread(buffer.close)
+
+    return StoredFile(path=dest_path, size=size, sha256=digest.hexdigest())
+
+
+async def save_upload_file(
+    file: UploadFile,
+    dest_path: Path,
+    max_size: int = MAX_UPLOAD_SIZE,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> StoredFile:
+    """
+    UploadFileをチャンク単位でストリーミング保存する
+
+    一時ファイル（.part）に書き込んでから最終パスへリネームするため、
+    途中で失敗しても中途半端なファイルが残らない。
+    """
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    stored = await write_stream(iter_upload_file(file, chunk_size), part_path, max_size=max_size)
+    await asyncio.to_thread(os.replace, part_path, dest_path)
+    stored.path = dest_path
+    return stored
+
+
+def hash_file(path: Path, chunk_size: int = UPLOAD_CHUNK_SIZE) -> StoredFile:
+    """既存ファイルのSHA-256とサイズを計算（同期処理、スレッドで実行すること）"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            digest.update(chunk)
+    return StoredFile(path=path, size=size, sha256=digest.hexdigest())
+
+
+def blob_path(sha256: str, suffix: str = ".webm") -> Path:
+    """SHA-256から保存先パスを求める（objects/ab/cd/<hash><suffix>）"""
+    return AUDIO_OBJECT_DIR / sha256[:2] / sha256[2:4] / f"{sha256}{suffix}"
+
+
+def artifact_path(sha256: str, name: str, suffix: str) -> Path:
+    """blobから派生したファイル（正規化済み音声等）の保存先（objects/ab/cd/<hash>.<name><suffix>）"""
+    return blob_path(sha256, f".{name}{suffix}")
+
+
+def remove_blob_files(sha256: str, path: Path):
+    """参照がなくなったblobと、そこから派生したファイルを削除"""
+    path.unlink(missing_ok=True)
+    for derived in path.parent.glob(f"{sha256}.*"):
+        derived.unlink(missing_ok=True)
+
+
+def _move_into_store(src: Path, dest: Path) -> bool:
+    """ファイルを内容アドレスの格納先へ移動。既に同じ内容があれば元ファイルを削除してFalseを返す"""
+    if dest.exists():
+        src.unlink(missing_ok=True)
+        return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(src, dest)
+    return True
+
+
+def _lock_blob(db: Session, sha256: str):
+    """
+    同じ内容のblobのファイルの格納・削除を直列化する（トランザクションの終了まで保持するロック）
+
+    行がまだない（または削除済みの）blobも対象にするため、行ロックではなくアドバイザリロックを使う。
+    """
+    db.execute(select(func.pg_advisory_xact_lock(func.hashtextextended(sha256, 0))))
+
+
+def _purge_on_rollback(db: Session, sha256: str, path: Path):
+    """トランザクションがロールバックされた場合、格納したファイルを（参照がなければ）削除する"""
+    finished = False
+
+    def _committed(_):
+        nonlocal finished
+        finished = True
+
+    def _rolled_back(_):
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        try:
+            with SessionLocal() as cleanup_db:
+                purge_blob(cleanup_db, sha256, path)
+        except Exception as e:
+            print(f"Audio blob cleanup failed: {str(e)}")
+
+    event.listen(db, "after_commit", _committed, once=True)
+    event.listen(db, "after_rollback", _rolled_back, once=True)
+
+
+async def acquire_blob(db: Session, stored: StoredFile, suffix: str = ".webm") -> Path:
+    """
+    保存済みファイルを内容アドレスの格納先へ移し、参照カウントを1増やす
+
+    同じ内容のファイルが既にあればディスクには書き込まず既存ファイルを共有する。
+    参照カウントの更新はコミットしないため、日記エントリの作成と同じトランザクションで確定すること。
+    格納と参照カウントの更新はロックしたまま行うため、コミットまでの間に purge_blob が
+    同じファイルを削除することはない。ロールバックされた場合は格納したファイルを削除する。
+
+    Returns:
+        Path: 格納先のパス
+    """
+    dest = blob_path(stored.sha256, suffix)
+    _lock_blob(db, stored.sha256)
+    moved = await asyncio.to_thread(_move_into_store, stored.path, dest)
+    if moved:
+        _purge_on_rollback(db, stored.sha256, dest)
+
+    db.execute(
+        insert(AudioBlob)
+        .values(sha256=stored.sha256, path=str(dest), size=stored.size, ref_count=1)
+        .on_conflict_do_update(
+            index_elements=[AudioBlob.sha256],
+            set_={"ref_count": AudioBlob.ref_count + 1, "path": str(dest)}
+        )
+    )
+    stored.path = dest
+    return dest
+
+
+def release_blob(db: Session, sha256: str) -> bool:
+    """
+    参照カウントを1減らす（行ロックを取って更新する。コミットしない）
+
+    参照がなくなってもここではファイルとレコードを削除しない。コミット後に purge_blob を呼ぶこと。
+
+    Returns:
+        bool: 参照がなくなったか
+    """
+    ref_count = db.execute(
+        update(AudioBlob)
+        .where(AudioBlob.sha256 == sha256)
+        .values(ref_count=AudioBlob.ref_count - 1)
+        .returning(AudioBlob.ref_count)
+    ).scalar()
+    return ref_count is not None and ref_count <= 0
+
+
+def purge_blob(db: Session, sha256: str, path: Optional[Path] = None) -> bool:
+    """
+    参照がなくなったblobのファイルとレコードを削除してコミットする
+
+    ロックを取ってから参照カウントを確認し直すため、release_blob のコミット後に同じ内容が
+    acquire_blob された場合は削除しない。ファイルの削除もロックを保持したまま行う。
+
+    Args:
+        path: レコードがない場合に削除するファイル（ロールバックで残ったファイル）
+
+    Returns:
+        bool: 削除したか
+    """
+    _lock_blob(db, sha256)
+    blob = db.execute(
+        select(AudioBlob.path, AudioBlob.ref_count).where(AudioBlob.sha256 == sha256)
+    ).first()
+    if blob is not None and blob.ref_count > 0:
+        db.rollback()
+        return False
+    if blob is not None:
+        path = Path(blob.path)
+    if path is not None:
+        remove_blob_files(sha256, path)
+    db.execute(delete(AudioBlob).where(AudioBlob.sha256 == sha256))
+    db.commit()
+    return True
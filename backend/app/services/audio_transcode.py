@@ -0,0 +1,210 @@
+import os
+import uuid
+import asyncio
+import struct
+import tempfile
+from pathlib import Path
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Tuple
+
+from .audio_probe import AudioFormat
+from .audio_workers import AUDIO_WORKERS, AUDIO_JOB_TIMEOUT
+
+
+# ffmpegの設定（環境変数から）
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+# 変換結果をメモリに保持する上限（超えた分は無名の一時ファイルへ退避）
+TRANSCODE_SPOOL_SIZE = int(os.getenv("TRANSCODE_SPOOL_SIZE", str(8 * 1024 * 1024)))
+
+_PIPE_CHUNK_SIZE = 64 * 1024
+
+# 同時に起動するffmpegプロセス数の上限
+_ffmpeg_slots: Optional[asyncio.Semaphore] = None
+
+
+@dataclass(frozen=True)
+class WireFormat:
+    """プロバイダーへ送信する音声形式"""
+    name: str
+    container: str                 # ffmpegの出力フォーマット（-f）
+    codec_args: Tuple[str, ...]    # エンコーダの指定
+    output: AudioFormat            # 変換後の形式
+
+    @property
+    def suffix(self) -> str:
+        return self.output.suffix
+
+
+# 送信形式の定義（いずれも16kHzモノラル）
+WIRE_FORMATS: Dict[str, WireFormat] = {
+    "wav": WireFormat("wav", "wav", ("-c:a", "pcm_s16le"), AudioFormat("wav", "pcm", 16000, 1)),
+    "flac": WireFormat("flac", "flac", ("-c:a", "flac"), AudioFormat("flac", "flac", 16000, 1)),
+    # 音声向け設定のOpus（24kbpsで1時間あたり約11MB）
+    "opus": WireFormat(
+        "opus", "ogg", ("-c:a", "libopus", "-b:a", "24k", "-application", "voip"),
+        AudioFormat("ogg", "opus", 16000, 1)
+    ),
+}
+
+
+class TranscodeError(Exception):
+    """ffmpegによる変換が失敗した場合のエラー"""
+
+
+def _slots() -> asyncio.Semaphore:
+    global _ffmpeg_slots
+    if _ffmpeg_slots is None:
+        _ffmpeg_slots = asyncio.Semaphore(AUDIO_WORKERS)
+    return _ffmpeg_slots
+
+
+def ffmpeg_command(
+    src_path: str,
+    output_format: str,
+    sample_rate: int,
+    codec_args: List[str],
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+) -> List[str]:
+    """16kHzモノラル等に変換して標準出力へ書き出すffmpegのコマンドを作成（start/durationで範囲を指定）"""
+    command = [FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error"]
+    if start:
+        command += ["-ss", f"{start:.3f}"]
+    command += ["-i", src_path]
+    if duration is not None:
+        command += ["-t", f"{duration:.3f}"]
+    return command + [
+        "-vn", "-ac", "1", "-ar", str(sample_rate),
+        # メタデータ（LISTチャンク等）を出力しない
+        "-map_metadata", "-1", "-fflags", "+bitexact",
+        *codec_args,
+        "-f", output_format, "pipe:1",
+    ]
+
+
+async def transcode_stream(
+    src_path: str,
+    output_format: str = "wav",
+    sample_rate: int = 16000,
+    codec_args: Optional[List[str]] = None,
+    timeout: float = AUDIO_JOB_TIMEOUT,
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+) -> AsyncIterator[bytes]:
+    """
+    ffmpegのサブプロセスで音声を変換し、出力をチャンク単位で返す
+
+    全体をデコードしてメモリに載せることはなく、ffmpegが入力ファイルを読みながら
+    パイプへ書き出したデータを順に返す。タイムアウト・キャンセル時はプロセスを停止する。
+
+    Raises:
+        TranscodeError: ffmpegが異常終了した、またはタイムアウトした場合
+    """
+    async with _slots():
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *ffmpeg_command(src_path, output_format, sample_rate, codec_args or [], start, duration),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise TranscodeError(f"{FFMPEG_BINARY} not found")
+
+        # stderrが詰まってffmpegが止まらないよう並行して読み出す
+        stderr_task = asyncio.create_task(process.stderr.read())
+        deadline = asyncio.get_running_loop().time() + timeout
+        try:
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                chunk = await asyncio.wait_for(process.stdout.read(_PIPE_CHUNK_SIZE), remaining)
+                if not chunk:
+                    break
+                yield chunk
+
+            returncode = await asyncio.wait_for(process.wait(), max(deadline - asyncio.get_running_loop().time(), 1))
+            stderr = (await stderr_task).decode(errors="replace").strip()
+            if returncode != 0:
+                raise TranscodeError(f"ffmpeg exited with {returncode}: {stderr}")
+        except asyncio.TimeoutError:
+            raise TranscodeError(f"ffmpeg timed out after {timeout} seconds")
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            if not stderr_task.done():
+                stderr_task.cancel()
+
+
+def _fix_wav_header(f: BinaryIO, size: int):
+    """パイプ出力のWAVはサイズ欄が未確定のため、書き込み後に正しい値へ更新する"""
+    f.seek(0)
+    header = f.read(64)
+    if not header.startswith(b"RIFF"):
+        return
+    data_pos = header.find(b"data")
+    if data_pos == -1:
+        return
+    f.seek(4)
+    f.write(struct.pack("<I", size - 8))
+    f.seek(data_pos + 4)
+    f.write(struct.pack("<I", size - data_pos - 8))
+
+
+@asynccontextmanager
+async def transcoded_file(
+    src_path: str,
+    output_format: str = "wav",
+    sample_rate: int = 16000,
+    codec_args: Optional[List[str]] = None,
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+) -> AsyncIterator[BinaryIO]:
+    """
+    変換結果をファイルオブジェクトとして提供する
+
+    変換結果は TRANSCODE_SPOOL_SIZE まではメモリ、それ以上は作成時点で削除済みの
+    無名一時ファイルに保持されるため、例外が発生しても一時ファイルが残らない。
+    プロバイダーSDKにそのまま渡せば、リクエストボディとしてチャンク単位で送信される。
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=TRANSCODE_SPOOL_SIZE)
+    try:
+        size = 0
+        async for chunk in transcode_stream(
+            src_path, output_format, sample_rate, codec_args, start=start, duration=duration
+        ):
+            await asyncio.to_thread(spool.write, chunk)
+            size += len(chunk)
+        if output_format == "wav":
+            await asyncio.to_thread(_fix_wav_header, spool, size)
+        spool.seek(0)
+        yield spool
+    finally:
+        spool.close()
+
+
+async def transcode_to_path(src_path: str, dest_path: Path, wire: WireFormat, sample_rate: int = 16000) -> Path:
+    """
+    変換結果をファイルとして保存する
+
+    一意な一時ファイルに書き込んでから置き換えるため、途中で失敗しても不完全なファイルは残らず、
+    複数のワーカーが同時に同じファイルを作成しても問題ない。
+    """
+    part_path = dest_path.with_name(f"{dest_path.name}.{uuid.uuid4().hex}.part")
+    await asyncio.to_thread(dest_path.parent.mkdir, parents=True, exist_ok=True)
+    f = await asyncio.to_thread(open, part_path, "w+b")
+    try:
+        size = 0
+        async for chunk in transcode_stream(src_path, wire.container, sample_rate, list(wire.codec_args)):
+            await asyncio.to_thread(f.write, chunk)
+            size += len(chunk)
+        if wire.container == "wav":
+            await asyncio.to_thread(_fix_wav_header, f, size)
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, part_path, dest_path)
+        return dest_path
+    finally:
+        f.close()
+        part_path.unlink(missing_ok=True)
@@ -0,0 +1,103 @@
+import os
+import subprocess
+from typing import List, Tuple
+
+import numpy as np
+
+from .audio_transcode import ffmpeg_command
+
+
+# 発話区間検出（VAD）の設定（環境変数から）
+VAD_MIN_SILENCE_SECONDS = float(os.getenv("VAD_MIN_SILENCE_SECONDS", "0.5"))
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "12"))  # ノイズフロアからのマージン
+
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_SECONDS = 0.03
+_FRAME_SIZE = int(VAD_SAMPLE_RATE * VAD_FRAME_SECONDS)
+# これより小さい音量は常に無音とみなす（dBFS）
+_ABSOLUTE_FLOOR_DB = -60.0
+# 一度に読み込むフレーム数（約30秒分）
+_READ_FRAMES = 1000
+
+
+def frame_energies_db(samples: np.ndarray, frame_size: int = _FRAME_SIZE) -> np.ndarray:
+    """16bit PCMのサンプルをフレームに分け、各フレームのRMS（dBFS）を求める"""
+    frames = len(samples) // frame_size
+    x = samples[:frames * frame_size].astype(np.float32).reshape(frames, frame_size) / 32768.0
+    rms = np.sqrt(np.mean(x * x, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def speech_mask(energies_db: np.ndarray, margin_db: float = VAD_MARGIN_DB) -> np.ndarray:
+    """ノイズフロア（下位10%の音量）よりマージン以上大きいフレームを発話とみなす"""
+    if len(energies_db) == 0:
+        return np.zeros(0, dtype=bool)
+    threshold = max(float(np.percentile(energies_db, 10)) + margin_db, _ABSOLUTE_FLOOR_DB)
+    return energies_db > threshold
+
+
+def plan_segments(
+    mask: np.ndarray,
+    max_segment_seconds: float,
+    frame_seconds: float = VAD_FRAME_SECONDS,
+    min_silence_seconds: float = VAD_MIN_SILENCE_SECONDS,
+) -> List[Tuple[float, float]]:
+    """
+    発話フレームのマスクから、無音部分で区切った区間 [(開始秒, 終了秒)] を求める
+
+    各区間は max_segment_seconds 以下になるよう、上限の手前で最も遅い無音の中央で区切る
+    （上限内に無音がない場合は上限の位置で区切る）。発話を含まない区間は除外する。
+    """
+    frames = len(mask)
+    if frames == 0:
+        return []
+
+    # 無音（連続するFalse）の開始・終了フレーム
+    edges = np.diff(np.concatenate(([1], mask.astype(np.int8), [1])))
+    silence_starts = np.flatnonzero(edges == -1)
+    silence_ends = np.flatnonzero(edges == 1)
+    long_enough = (silence_ends - silence_starts) * frame_seconds >= min_silence_seconds
+    cuts = (silence_starts[long_enough] + silence_ends[long_enough]) // 2
+
+    max_frames = max(1, int(max_segment_seconds / frame_seconds))
+    bounds = []
+    start = 0
+    while frames - start > max_frames:
+        candidates = cuts[(cuts > start) & (cuts <= start + max_frames)]
+        end = int(candidates[-1]) if len(candidates) else start + max_frames
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, frames))
+
+    return [
+        (round(s * frame_seconds, 3), round(e * frame_seconds, 3))
+        for s, e in bounds if mask[s:e].any()
+    ]
+
+
+def detect_speech_segments(src_path: str, max_segment_seconds: float) -> List[Tuple[float, float]]:
+    """
+    音声をデコードして発話区間を検出し、文字起こし用の区間に分割する（ワーカープロセスで実行）
+
+    デコード結果はフレームごとの音量に変換しながら読み進めるため、録音の長さによらず
+    メモリ使用量はほぼ一定。
+    """
+    command = ffmpeg_command(src_path, "s16le", VAD_SAMPLE_RATE, ["-c:a", "pcm_s16le"])
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    energies = []
+    try:
+        while True:
+            data = process.stdout.read(_FRAME_SIZE * 2 * _READ_FRAMES)
+            if not data:
+                break
+            energies.append(frame_energies_db(np.frombuffer(data, dtype="<i2")))
+        stderr = process.stderr.read().decode(errors="replace").strip()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    energies_db = np.concatenate(energies) if energies else np.zeros(0)
+    return plan_segments(speech_mask(energies_db), max_segment_seconds)
@@ -0,0 +1,88 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+
+# 音声処理ワーカーの設定（環境変数から）
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", str(min(4, os.cpu_count() or 1))))
+AUDIO_JOB_TIMEOUT = float(os.getenv("AUDIO_JOB_TIMEOUT", "300"))  # 秒
+
+
+class AudioJobTimeout(Exception):
+    """音声処理ジョブがタイムアウトした場合のエラー"""
+
+
+class AudioWorkerPool:
+    """
+    CPU負荷の高い音声処理（デコード・リサンプリング等）を別プロセスで実行するプール
+
+    イベントループをブロックせず、複数の処理を複数コアで並列に実行する。
+    ジョブにはタイムアウトがあり、タイムアウト・キャンセル時に実行中だったジョブは
+    ワーカープロセスごと停止する（プロセスで実行中の処理は他に中断する手段がないため）。
+    """
+
+    def __init__(self, max_workers: int = AUDIO_WORKERS, timeout: float = AUDIO_JOB_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # forkはスレッドを持つサーバープロセスでデッドロックし得るためspawnを使用
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _terminate(self, executor: ProcessPoolExecutor):
+        """プールのワーカープロセスを停止し、次回のジョブで新しいプールを作る"""
+        if self._executor is executor:
+            self._executor = None
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """
+        ワーカープロセスで関数を実行
+
+        Args:
+            fn: 実行する関数（pickle可能なモジュールレベルの関数）
+            timeout: タイムアウト秒数（省略時はAUDIO_JOB_TIMEOUT）
+
+        Raises:
+            AudioJobTimeout: タイムアウトした場合
+        """
+        for attempt in range(2):
+            executor = self._get_executor()
+            future = executor.submit(fn, *args)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                if not future.cancel():
+                    self._terminate(executor)
+                raise AudioJobTimeout(f"Audio job timed out after {timeout or self.timeout} seconds")
+            except asyncio.CancelledError:
+                if not future.cancel():
+                    self._terminate(executor)
+                raise
+            except BrokenProcessPool:
+                # 他のジョブのタイムアウトでプールが停止された場合は新しいプールで1回だけ再実行
+                if attempt > 0:
+                    raise
+                if self._executor is executor:
+                    self._executor = None
+
+    def shutdown(self):
+        """プールを停止"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# シングルトンインスタンス
+audio_worker_pool = AudioWorkerPool()
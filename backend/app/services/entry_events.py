@@ -0,0 +1,163 @@
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..database import DATABASE_URL, SessionLocal
+
+
+# 日記エントリの処理状況の通知チャンネル
+ENTRY_EVENTS_CHANNEL = "entry_events"
+# 接続が切れた場合の再接続間隔（秒）
+ENTRY_EVENTS_RECONNECT_SECONDS = float(os.getenv("ENTRY_EVENTS_RECONNECT_SECONDS", "3"))
+
+# NOTIFYのペイロード上限（8000バイト）に収まるよう、途中経過等のテキストを切り詰める文字数
+_MAX_TEXT_LENGTH = 2000
+# 購読者ごとに保持するイベント数（読み出しが遅い購読者のイベントは捨てる）
+_SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class EntryEventBroker:
+    """
+    日記エントリの処理状況（開始・進捗・完了・失敗）のイベントを配信する
+
+    イベントは Postgres の NOTIFY で送信するため、どのサーバープロセスで発生したイベントも
+    全プロセスのSSE購読者に届く。各プロセスは1本の接続で LISTEN し、受け取ったイベントを
+    エントリごとの購読者に振り分ける。接続が切れた場合は再接続し、その間のイベントを
+    取りこぼした可能性があるため購読者に resync を送る。
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def publish(self, db: Session, entry_id: Any, event_type: str, **data: Any):
+        """
+        イベントを送信（コミットしないため、状態の更新と同じトランザクションでコミット時に配信される）
+        """
+        event = {"entry_id": str(entry_id), "type": event_type}
+        for key, value in data.items():
+            if isinstance(value, str) and len(value) > _MAX_TEXT_LENGTH:
+                value = value[:_MAX_TEXT_LENGTH]
+                event["truncated"] = True
+            event[key] = value
+        db.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": ENTRY_EVENTS_CHANNEL, "payload": json.dumps(event, ensure_ascii=False)}
+        )
+
+    def publish_now(self, entry_id: Any, event_type: str, **data: Any):
+        """状態の更新を伴わないイベント（開始・進捗）をすぐに送信"""
+        with SessionLocal() as db:
+            self.publish(db, entry_id, event_type, **data)
+            db.commit()
+
+    @asynccontextmanager
+    async def subscribe(self, entry_id: str) -> AsyncIterator[asyncio.Queue]:
+        """日記エントリのイベントを購読（イベントはキューに届く）"""
+        self._ensure_listener()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(entry_id, set()).add(queue)
+        try:
+            # 購読開始前のイベントを取りこぼさないよう、LISTENの開始を待つ
+            try:
+                await asyncio.wait_for(self._ready.wait(), ENTRY_EVENTS_RECONNECT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            yield queue
+        finally:
+            queues = self._subscribers.get(entry_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[entry_id]
+
+    async def wait_for_stage(self, entry_id: str, stage: str, timeout: float, is_pending: Callable[[], bool]) -> bool:
+        """
+        段階（文字起こし・要約）の完了・失敗を待つ（ロングポーリング用）
+
+        購読を開始してから is_pending() で現在の状態を確認するため、その間に完了した場合も
+        取りこぼさない。
+
+        Returns:
+            bool: 状態が変わった（可能性がある）場合はTrue、タイムアウトした場合はFalse
+        """
+        async with self.subscribe(entry_id) as queue:
+            if not is_pending():
+                return True
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    event = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    return False
+                if event["type"] == "resync":
+                    return True
+                if event.get("stage") == stage and event["type"] in ("completed", "failed"):
+                    return True
+
+    async def stop(self):
+        """LISTENを停止"""
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    def _ensure_listener(self):
+        if self._listener is None or self._listener.done():
+            self._ready = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen())
+
+    def _dispatch(self, connection, pid, channel, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        self._deliver(event["entry_id"], event)
+
+    def _deliver(self, entry_id: str, event: Dict[str, Any]):
+        for queue in list(self._subscribers.get(entry_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+    async def _listen(self):
+        reconnecting = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(DATABASE_URL)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(ENTRY_EVENTS_CHANNEL, self._dispatch)
+                self._ready.set()
+                if reconnecting:
+                    # 切断中のイベントを取りこぼした可能性があるため、購読者に状態を取り直させる
+                    for entry_id in list(self._subscribers):
+                        self._deliver(entry_id, {"entry_id": entry_id, "type": "resync"})
+                await lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Entry event listener error: {str(e)}")
+            finally:
+                self._ready.clear()
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            reconnecting = True
+            await asyncio.sleep(ENTRY_EVENTS_RECONNECT_SECONDS)
+
+
+# シングルトンインスタンス
+entry_event_broker = EntryEventBroker()
@@ -0,0 +1,665 @@
+import os
+import uuid
+import random
+import asyncio
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import event, func, select, update, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import DiaryEntry, ProcessingJob
+from .summary import summary_service
+from .tag_suggestion import tag_suggestion_service
+from .transcription import transcription_service
+from .transcript_segments import replace_segments
+from .entry_events import entry_event_broker
+
+
+# 段階ごとの同時実行数（環境変数から）
+MAX_CONCURRENT_TRANSCRIPTIONS = int(os.getenv("MAX_CONCURRENT_TRANSCRIPTIONS", "2"))
+MAX_CONCURRENT_SUMMARIES = int(os.getenv("MAX_CONCURRENT_SUMMARIES", "3"))
+# 一括再処理（低優先度）のジョブの段階ごとの同時実行数の上限
+MAX_CONCURRENT_BACKFILL_TRANSCRIPTIONS = int(os.getenv("MAX_CONCURRENT_BACKFILL_TRANSCRIPTIONS", "1"))
+MAX_CONCURRENT_BACKFILL_SUMMARIES = int(os.getenv("MAX_CONCURRENT_BACKFILL_SUMMARIES", "1"))
+# 優先度ごとの取得の重み（両方にジョブがある場合、およそこの比率で取得する）
+JOB_INTERACTIVE_WEIGHT = float(os.getenv("JOB_INTERACTIVE_WEIGHT", "4"))
+JOB_BACKFILL_WEIGHT = float(os.getenv("JOB_BACKFILL_WEIGHT", "1"))
+
+# ジョブの実行・再試行の設定（環境変数から）
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+# 実行権の有効期間（実行中は1/3ごとに延長。ワーカーが停止した場合は期限切れ後に他のワーカーが引き継ぐ）
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# 他のプロセスで登録されたジョブを確認する間隔
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+
+# GET /transcribe・/summarize のロングポーリングで待つ最長時間（秒）
+LONG_POLL_MAX_SECONDS = float(os.getenv("LONG_POLL_MAX_SECONDS", "30"))
+
+# JST (UTC+9) タイムゾーン定義
+JST = timezone(timedelta(hours=9))
+
+TRANSCRIPTION = "transcription"
+SUMMARY = "summary"
+
+# ジョブの優先度（新しく録音・アップロードされたエントリと、一括再処理）
+INTERACTIVE = "interactive"
+BACKFILL = "backfill"
+PRIORITIES = (INTERACTIVE, BACKFILL)
+
+# 段階ごとの日記エントリの状態・タスクIDの列
+_ENTRY_COLUMNS = {
+    TRANSCRIPTION: (DiaryEntry.transcription_status, DiaryEntry.transcription_task_id),
+    SUMMARY: (DiaryEntry.summary_status, DiaryEntry.summary_task_id),
+}
+
+
+class JobFailed(Exception):
+    """再試行しても成功しないジョブのエラー（すぐに失敗として確定する）"""
+
+
+class LeaseLost(Exception):
+    """ジョブの実行権を失った（他のワーカーに引き継がれた）ため結果を保存しない"""
+
+
+@dataclass
+class ClaimedJob:
+    """ワーカーが実行権を取得したジョブ"""
+    id: int
+    stage: str
+    entry_id: str
+    task_id: str
+    attempts: int
+    next_stage: Optional[str] = None
+    priority: str = INTERACTIVE
+
+
+@dataclass
+class _Lease:
+    """実行中のタスクの実行権（同じプロセスで再取得された場合は新しい試行に置き換わる）"""
+    job: ClaimedJob
+
+
+# 実行中のジョブの実行権（結果を保存する前に check_lease で確認する）
+_current_lease: ContextVar[Optional[_Lease]] = ContextVar("current_lease", default=None)
+
+
+def check_lease(db: Session):
+    """
+    実行中のジョブの実行権をまだ持っているか確認する（失っていれば LeaseLost）
+
+    結果を保存するトランザクションの中で呼ぶ。ジョブの行をコミットまでロックするため、
+    確認から保存までの間に他のワーカーに引き継がれることはない。ワーカーの外では何もしない。
+    """
+    lease = _current_lease.get()
+    if lease is None:
+        return
+    job = lease.job
+    owned = db.execute(
+        select(ProcessingJob.id)
+        .where(
+            ProcessingJob.id == job.id,
+            ProcessingJob.status == "running",
+            ProcessingJob.attempts == job.attempts
+        )
+        .with_for_update()
+    ).first()
+    if owned is None:
+        raise LeaseLost(f"{job.stage} job {job.task_id} attempt {job.attempts} lost its lease")
+
+
+class SingleFlight:
+    """
+    キーごとに実行を1つにまとめる（シングルフライト）
+
+    同じキーの処理を実行中に再度要求された場合は、新たに実行せず実行中の処理の完了を待って
+    結果（例外を含む）を共有する。待っている側が1つでも残っていれば、他の待っている側が
+    キャンセルされても実行は続け、全員がキャンセルした場合は実行も中止する。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    async def run(self, key: str, job: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(job())
+            self._inflight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(task) == 1:
+                task.cancel()
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        self._waiters.pop(task, None)
+        # 待っている側がいない場合も例外を取り出しておく（未取得の警告を出さない）
+        task.cancelled() or task.exception()
+
+    async def cancel_all(self):
+        """実行中の処理をすべて中止"""
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def retry_delay(attempts: int) -> float:
+    """再試行までの待ち時間（指数バックオフ。同時に失敗したジョブが揃って再試行しないよう揺らぎを加える）"""
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.0)
+
+
+async def wait_while_processing(db: Session, entry: DiaryEntry, stage: str, wait: float):
+    """
+    段階が処理中の間、完了・失敗するか wait 秒（上限 LONG_POLL_MAX_SECONDS）経つまで待つ
+
+    完了・失敗は処理状況のイベントで通知されるため、ワーカーが別のプロセスでも待てる。
+    待っている間はDB接続を保持せず、戻る前に entry を最新の状態に更新する。
+    """
+    status_column, _ = _ENTRY_COLUMNS[stage]
+    if wait <= 0 or getattr(entry, status_column.key) != "processing":
+        return
+    entry_id = entry.id
+
+    def is_pending() -> bool:
+        status = db.query(status_column).filter(DiaryEntry.id == entry_id).scalar()
+        db.rollback()
+        return status == "processing"
+
+    await entry_event_broker.wait_for_stage(str(entry_id), stage, min(wait, LONG_POLL_MAX_SECONDS), is_pending)
+    db.refresh(entry)
+
+
+async def _publish_now(entry_id: str, event_type: str, **data):
+    """処理状況のイベントを送信（送信の失敗で処理を止めない）"""
+    try:
+        await asyncio.to_thread(entry_event_broker.publish_now, entry_id, event_type, **data)
+    except Exception as e:
+        print(f"Entry event publish failed: {str(e)}")
+
+
+async def run_transcription(entry_id: str, task_id: str):
+    """
+    文字起こしジョブを実行し、結果を日記エントリに保存する
+
+    プロバイダーの応答を待つ間はDB接続を保持しない。待っている間に別のタスクIDで
+    やり直された場合や、既に保存済みの場合（保存後に停止したジョブの再実行）は何もしない。
+    """
+    with SessionLocal() as db:
+        entry = db.get(DiaryEntry, entry_id)
+        if not entry or entry.transcription_task_id != task_id or entry.transcription_status != "processing":
+            return
+        audio_file_path, audio_sha256 = entry.audio_file_path, entry.audio_sha256
+
+    # 音声ファイルの存在確認
+    if not audio_file_path or not await asyncio.to_thread(Path(audio_file_path).exists):
+        raise JobFailed("音声ファイルが見つかりません")
+
+    await _publish_now(entry_id, "started", stage=TRANSCRIPTION)
+
+    async def on_progress(progress: float, partial_text: str):
+        await _publish_now(entry_id, "progress", stage=TRANSCRIPTION, progress=round(progress * 100), text=partial_text)
+
+    # AI サービスで文字起こし実行（失敗した場合は再試行される）
+    result = await transcription_service.transcribe_audio(audio_file_path, audio_sha256, on_progress)
+
+    with SessionLocal() as db:
+        entry = db.get(DiaryEntry, entry_id)
+        if not entry or entry.transcription_task_id != task_id:
+            return
+        # 実行権を失っていれば保存しない（引き継いだワーカーが保存する）
+        check_lease(db)
+        # 結果をDiaryEntryに保存
+        entry.transcription = result["transcription"]
+        entry.transcription_status = "completed"
+        entry.transcribe_model = result["model"]
+        entry.updated_at = datetime.now(JST)
+        replace_segments(db, entry.id, result.get("segments"))
+        entry_event_broker.publish(db, entry_id, "completed", stage=TRANSCRIPTION, text=result["transcription"])
+        db.commit()
+
+
+async def run_summary(entry_id: str, task_id: str):
+    """要約ジョブを実行し、結果（タイトル・タグの自動設定を含む）を日記エントリに保存する"""
+    with SessionLocal() as db:
+        entry = db.get(DiaryEntry, entry_id)
+        if not entry or entry.summary_task_id != task_id or entry.summary_status != "processing":
+            return
+        transcription, has_tags = entry.transcription, bool(entry.tags)
+
+    # 文字起こし結果が必要
+    if not transcription:
+        raise JobFailed("文字起こし結果がありません")
+
+    await _publish_now(entry_id, "started", stage=SUMMARY)
+
+    # AI サービスで要約実行（失敗した場合は再試行される）
+    result = await summary_service.summarize_text(transcription)
+
+    # 新規録音の場合のみタグ自動提案（タグが未設定かつ要約が初回完了）
+    suggested_tags = None
+    if not has_tags and result["summary"]:
+        try:
+            suggested_tags = await tag_suggestion_service.suggest_tags(transcription, result["summary"])
+        except Exception as e:
+            print(f"Tag suggestion failed: {str(e)}")
+            # タグ提案の失敗は処理を継続させる
+
+    with SessionLocal() as db:
+        entry = db.get(DiaryEntry, entry_id)
+        if not entry or entry.summary_task_id != task_id:
+            return
+        # 実行権を失っていれば保存しない（引き継いだワーカーが保存する）
+        check_lease(db)
+        # 結果をDiaryEntryに保存
+        entry.summary = result["summary"]
+        entry.summary_status = "completed"
+        entry.summary_model = result["model"]
+
+        # タイトルが未設定の場合は自動生成
+        if not entry.title:
+            entry.title = result["title"]
+        if suggested_tags and not entry.tags:
+            entry.tags = suggested_tags
+        entry.updated_at = datetime.now(JST)
+        entry_event_broker.publish(db, entry_id, "completed", stage=SUMMARY, text=result["summary"])
+        db.commit()
+
+
+class ProcessingQueue:
+    """
+    文字起こし・要約ジョブを処理するワーカー
+
+    POST /transcribe・POST /summarize で processing_jobs に登録されたジョブを、段階ごとに
+    決めた数のワーカーで実行する。結果取得のGETは状態を読むだけになるため、
+    リクエストの応答時間がプロバイダーの処理時間に左右されない。
+
+    ジョブの取得は SELECT ... FOR UPDATE SKIP LOCKED で行うため、複数のプロセス・レプリカで
+    ワーカーを動かしても同じジョブを重複して実行しない。実行中は実行権（lease_until）を
+    延長し、プロセスが停止した場合は期限切れ後に他のワーカーが引き継ぐ。
+    実行権の延長に失敗して期限が切れたジョブを同じプロセスの別のワーカーが取得した場合は、
+    タスクIDごとのシングルフライトで実行中の処理の結果を待ち、プロバイダーを重複して呼び出さない。
+    他のプロセスに引き継がれて実行権を失った場合は実行を中止し、結果の保存も check_lease で
+    拒否するため、同じジョブが同時に2か所で実行・保存されることはない。
+    失敗したジョブは指数バックオフで再試行し、JOB_MAX_ATTEMPTS 回失敗した場合に
+    日記エントリを失敗として確定する。
+
+    ジョブは優先度（interactive・backfill）ごとのレーンに分かれ、空いたワーカーは
+    重み付き公平（ストライドスケジューリング）に選んだレーンから取得する。一括再処理の
+    ジョブが大量にあっても、新しいエントリのジョブは重みの比率で先に取得され、
+    backfill の同時実行数は lane_limits で制限される（指定のないレーンは段階の同時実行数まで）。
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[Dict[str, int]] = None,
+        lane_limits: Optional[Dict[str, Dict[str, int]]] = None,
+    ):
+        self.concurrency = concurrency or {
+            TRANSCRIPTION: MAX_CONCURRENT_TRANSCRIPTIONS,
+            SUMMARY: MAX_CONCURRENT_SUMMARIES,
+        }
+        self.lane_limits = lane_limits if lane_limits is not None else {
+            TRANSCRIPTION: {BACKFILL: MAX_CONCURRENT_BACKFILL_TRANSCRIPTIONS},
+            SUMMARY: {BACKFILL: MAX_CONCURRENT_BACKFILL_SUMMARIES},
+        }
+        self.weights = {INTERACTIVE: JOB_INTERACTIVE_WEIGHT, BACKFILL: JOB_BACKFILL_WEIGHT}
+        self.handlers: Dict[str, Callable[[str, str], Awaitable[None]]] = {
+            TRANSCRIPTION: run_transcription,
+            SUMMARY: run_summary,
+        }
+        self.max_attempts = JOB_MAX_ATTEMPTS
+        self.lease_seconds = JOB_LEASE_SECONDS
+        self.poll_seconds = JOB_POLL_SECONDS
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        # 段階・レーンごとの実行中のジョブ数と、重み付き公平の仮想時間
+        self._running: Dict[str, Dict[str, int]] = {}
+        self._passes: Dict[str, Dict[str, float]] = {}
+        self._vtime: Dict[str, float] = {}
+        self._workers: List[asyncio.Task] = []
+        self._single_flight = SingleFlight()
+        self._leases: Dict[str, _Lease] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        """各段階のワーカーを起動"""
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        for stage, workers in self.concurrency.items():
+            wakeup = self._wakeups.setdefault(stage, asyncio.Event())
+            self._running[stage] = {lane: 0 for lane in PRIORITIES}
+            self._passes[stage] = {lane: 0.0 for lane in PRIORITIES}
+            self._vtime[stage] = 0.0
+            for _ in range(max(1, workers)):
+                self._workers.append(asyncio.create_task(self._work(stage, wakeup)))
+
+    async def stop(self):
+        """ワーカーを停止（実行中のジョブは実行権の期限切れ後に再実行される）"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self._single_flight.cancel_all()
+
+    def enqueue(
+        self,
+        db: Session,
+        stage: str,
+        entry_id: UUID,
+        task_id: str,
+        next_stage: Optional[str] = None,
+        priority: str = INTERACTIVE,
+    ):
+        """
+        ジョブを登録
+
+        コミットしないため、日記エントリの状態の更新と同じトランザクションで確定すること。
+        コミット後にこのプロセスのワーカーを起こす。
+        """
+        db.add(ProcessingJob(
+            stage=stage, entry_id=entry_id, task_id=task_id, next_stage=next_stage, priority=priority
+        ))
+        event.listen(db, "after_commit", lambda _: self.wake(stage), once=True)
+
+    def start_stage(
+        self,
+        db: Session,
+        stage: str,
+        entry: DiaryEntry,
+        next_stage: Optional[str] = None,
+        priority: str = INTERACTIVE,
+    ) -> str:
+        """
+        日記エントリの文字起こし・要約を開始（タスクIDを発行して処理中にし、ジョブを登録）
+
+        next_stage を指定すると、完了後に続けてその段階を同じ優先度で開始する。コミットしない。
+
+        Returns:
+            str: タスクID
+        """
+        task_id = str(uuid.uuid4())
+        status_column, task_id_column = _ENTRY_COLUMNS[stage]
+        setattr(entry, task_id_column.key, task_id)
+        setattr(entry, status_column.key, "processing")
+        if entry.id is None:
+            db.flush()
+        self.enqueue(db, stage, entry.id, task_id, next_stage, priority)
+        return task_id
+
+    def wake(self, stage: str):
+        """ジョブの登録をワーカーに知らせる"""
+        wakeup = self._wakeups.get(stage)
+        if wakeup is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(wakeup.set)
+
+    def requeue_unfinished(self):
+        """
+        ジョブのない処理中のエントリ（ジョブテーブル導入前のデータ）にジョブを登録する
+
+        実行中に停止したジョブは実行権の期限切れ後に取得されるため、ここでは扱わない。
+        """
+        with SessionLocal() as db:
+            for stage, (status_column, task_id_column) in _ENTRY_COLUMNS.items():
+                rows = db.query(DiaryEntry.id, task_id_column).filter(
+                    status_column == "processing",
+                    task_id_column.isnot(None)
+                ).all()
+                for entry_id, task_id in rows:
+                    db.execute(
+                        insert(ProcessingJob)
+                        .values(stage=stage, entry_id=entry_id, task_id=task_id, status="queued", attempts=0)
+                        .on_conflict_do_nothing(index_elements=[ProcessingJob.task_id])
+                    )
+            db.commit()
+
+    def claim(self, stage: str, priority: str = INTERACTIVE) -> Optional[ClaimedJob]:
+        """実行できるジョブ（再試行時刻を過ぎた待ちジョブ、または実行権が切れたジョブ）の実行権を取得"""
+        claimable = (
+            select(ProcessingJob.id)
+            .where(
+                ProcessingJob.stage == stage,
+                ProcessingJob.priority == priority,
+                or_(
+                    and_(ProcessingJob.status == "queued", ProcessingJob.run_after <= func.now()),
+                    and_(ProcessingJob.status == "running", ProcessingJob.lease_until < func.now()),
+                )
+            )
+            .order_by(ProcessingJob.run_after, ProcessingJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        with SessionLocal() as db:
+            row = db.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.id == claimable)
+                .values(
+                    status="running",
+                    attempts=ProcessingJob.attempts + 1,
+                    lease_until=func.now() + timedelta(seconds=self.lease_seconds),
+                    updated_at=datetime.now(JST)
+                )
+                .returning(
+                    ProcessingJob.id, ProcessingJob.entry_id, ProcessingJob.task_id,
+                    ProcessingJob.attempts, ProcessingJob.next_stage, ProcessingJob.priority
+                )
+            ).first()
+            db.commit()
+        if row is None:
+            return None
+        return ClaimedJob(
+            id=row.id, stage=stage, entry_id=str(row.entry_id), task_id=row.task_id,
+            attempts=row.attempts, next_stage=row.next_stage, priority=row.priority
+        )
+
+    def renew(self, job: ClaimedJob) -> bool:
+        """実行権の期限を延長（他のワーカーに引き継がれていた場合はFalse）"""
+        with SessionLocal() as db:
+            renewed = db.execute(
+                self._owned(job).values(lease_until=func.now() + timedelta(seconds=self.lease_seconds))
+            ).rowcount
+            db.commit()
+        return renewed > 0
+
+    def complete(self, job: ClaimedJob):
+        """ジョブを完了にし、続きの段階があれば同じトランザクションで開始する"""
+        with SessionLocal() as db:
+            completed = db.execute(
+                self._owned(job).values(status="completed", lease_until=None, updated_at=datetime.now(JST))
+            ).rowcount
+            if completed and job.next_stage:
+                self._start_next_stage(db, job)
+            db.commit()
+
+    def _start_next_stage(self, db: Session, job: ClaimedJob):
+        entry = db.get(DiaryEntry, job.entry_id)
+        if entry is None:
+            return
+        # このジョブの結果が保存されていて、次の段階がまだ開始されていない場合のみ
+        status_column, task_id_column = _ENTRY_COLUMNS[job.stage]
+        if getattr(entry, task_id_column.key) != job.task_id or getattr(entry, status_column.key) != "completed":
+            return
+        next_status_column, _ = _ENTRY_COLUMNS[job.next_stage]
+        if getattr(entry, next_status_column.key) != "pending":
+            return
+        self.start_stage(db, job.next_stage, entry, priority=job.priority)
+
+    def retry_or_fail(self, job: ClaimedJob, error: Exception, retryable: bool = True):
+        """失敗したジョブを再試行待ちに戻す（試行回数を使い切った場合は日記エントリごと失敗にする）"""
+        with SessionLocal() as db:
+            if retryable and job.attempts < self.max_attempts:
+                delay = retry_delay(job.attempts)
+                retried = db.execute(self._owned(job).values(
+                    status="queued",
+                    lease_until=None,
+                    run_after=func.now() + timedelta(seconds=delay),
+                    last_error=str(error),
+                    updated_at=datetime.now(JST)
+                )).rowcount
+                if retried:
+                    entry_event_broker.publish(
+                        db, job.entry_id, "retrying", stage=job.stage, attempts=job.attempts, retry_in=round(delay)
+                    )
+            else:
+                failed = db.execute(self._owned(job).values(
+                    status="failed", lease_until=None, last_error=str(error), updated_at=datetime.now(JST)
+                )).rowcount
+                if failed:
+                    status_column, task_id_column = _ENTRY_COLUMNS[job.stage]
+                    updated = db.execute(
+                        update(DiaryEntry)
+                        .where(DiaryEntry.id == job.entry_id, task_id_column == job.task_id)
+                        .values({status_column: "failed", DiaryEntry.updated_at: datetime.now(JST)})
+                    ).rowcount
+                    if updated:
+                        entry_event_broker.publish(db, job.entry_id, "failed", stage=job.stage, error=str(error))
+            db.commit()
+
+    def _owned(self, job: ClaimedJob):
+        # 試行回数が実行権のトークン（変わっていれば他のワーカーに引き継がれている）
+        return update(ProcessingJob).where(
+            ProcessingJob.id == job.id,
+            ProcessingJob.status == "running",
+            ProcessingJob.attempts == job.attempts
+        )
+
+    def _lane_limit(self, stage: str, lane: str) -> int:
+        return self.lane_limits.get(stage, {}).get(lane, self.concurrency[stage])
+
+    def _lanes(self, stage: str) -> List[str]:
+        """取得を試すレーンの順（仮想時間の小さい順。同時実行数の上限に達したレーンは除く）"""
+        running = self._running[stage]
+        passes = self._passes[stage]
+        lanes = [lane for lane in PRIORITIES if running[lane] < self._lane_limit(stage, lane)]
+        return sorted(lanes, key=lambda lane: (passes[lane], PRIORITIES.index(lane)))
+
+    def _charge(self, stage: str, lane: str):
+        """レーンからの取得を記録（重みが大きいほど仮想時間の進みが遅く、多く取得される）"""
+        passes = self._passes[stage]
+        # 空だったレーンが溜めた分で他のレーンを待たせないよう、現在の仮想時間から再開する
+        start = max(passes[lane], self._vtime[stage])
+        self._vtime[stage] = start
+        passes[lane] = start + 1 / self.weights[lane]
+
+    async def _claim_next(self, stage: str):
+        """重み付き公平に選んだレーンからジョブを取得（取得したレーンの実行枠を確保して返す）"""
+        running = self._running[stage]
+        for lane in self._lanes(stage):
+            # 取得を待つ間に他のワーカーが枠を確保している場合がある
+            if running[lane] >= self._lane_limit(stage, lane):
+                continue
+            running[lane] += 1
+            try:
+                job = await asyncio.to_thread(self.claim, stage, lane)
+            except Exception as e:
+                running[lane] -= 1
+                print(f"{stage} job claim failed: {str(e)}")
+                return None, None
+            if job is not None:
+                self._charge(stage, lane)
+                return job, lane
+            running[lane] -= 1
+        return None, None
+
+    async def _work(self, stage: str, wakeup: asyncio.Event):
+        while True:
+            wakeup.clear()
+            job, lane = await self._claim_next(stage)
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                if job.attempts > self.max_attempts:
+                    # 最後の試行の実行中にワーカーが停止したジョブ
+                    await asyncio.to_thread(
+                        self.retry_or_fail, job, JobFailed("実行中にワーカーが停止しました"), False
+                    )
+                    continue
+                await self._run(job)
+            except Exception as e:
+                # 状態の保存に失敗した場合も、実行権の期限切れ後に再実行される
+                print(f"{stage} job {job.task_id} bookkeeping failed: {str(e)}")
+            finally:
+                self._running[stage][lane] -= 1
+
+    async def _run(self, job: ClaimedJob):
+        lease = self._leases.get(job.task_id)
+        if lease is None:
+            lease = self._leases[job.task_id] = _Lease(job)
+        else:
+            # 同じプロセスで再取得した（実行中の処理の結果は新しい試行として保存する）
+            lease.job = job
+        handler = self.handlers[job.stage]
+        # 実行中の処理（このコンテキストで作成したタスク）から実行権を確認できるようにする
+        token = _current_lease.set(lease)
+        try:
+            work = asyncio.create_task(
+                self._single_flight.run(job.task_id, lambda: handler(job.entry_id, job.task_id))
+            )
+        finally:
+            _current_lease.reset(token)
+        heartbeat = asyncio.create_task(self._heartbeat(job, work))
+        try:
+            await work
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                raise
+            # 実行権を失った（他のワーカーが実行している）ため、状態を更新しない
+        except LeaseLost as e:
+            print(f"{job.stage} job result discarded for entry {job.entry_id}: {str(e)}")
+        except JobFailed as e:
+            print(f"{job.stage} job failed for entry {job.entry_id}: {str(e)}")
+            await asyncio.to_thread(self.retry_or_fail, job, e, False)
+        except Exception as e:
+            print(f"{job.stage} job attempt {job.attempts} failed for entry {job.entry_id}: {str(e)}")
+            await asyncio.to_thread(self.retry_or_fail, job, e)
+        else:
+            await asyncio.to_thread(self.complete, job)
+        finally:
+            heartbeat.cancel()
+            if self._leases.get(job.task_id) is lease and lease.job is job:
+                del self._leases[job.task_id]
+
+    async def _heartbeat(self, job: ClaimedJob, work: asyncio.Task):
+        """実行権を延長し続ける（他のワーカーに引き継がれていた場合は実行を中止して終了）"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await asyncio.to_thread(self.renew, job)
+            except Exception as e:
+                # 延長に失敗しても実行は続ける（期限切れ後は他のワーカーが引き継ぐ可能性がある）
+                print(f"{job.stage} job {job.task_id} lease renewal failed: {str(e)}")
+                continue
+            if not renewed:
+                print(f"{job.stage} job {job.task_id} lost its lease, cancelling attempt {job.attempts}")
+                work.cancel()
+                return
+
+
+# シングルトンインスタンス
+processing_queue = ProcessingQueue()
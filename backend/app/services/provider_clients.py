@@ -0,0 +1,127 @@
+import os
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import openai
+import anthropic
+from google.cloud import speech
+
+try:
+    import h2  # noqa: F401  HTTP/2 は httpx[http2] をインストールした場合のみ
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+# プロバイダーへの接続プールの設定（環境変数から）
+PROVIDER_HTTP2 = os.getenv("PROVIDER_HTTP2", "true").lower() == "true"
+PROVIDER_HTTP_MAX_CONNECTIONS = int(os.getenv("PROVIDER_HTTP_MAX_CONNECTIONS", "50"))
+PROVIDER_HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("PROVIDER_HTTP_KEEPALIVE_CONNECTIONS", "20"))
+PROVIDER_HTTP_KEEPALIVE_SECONDS = float(os.getenv("PROVIDER_HTTP_KEEPALIVE_SECONDS", "120"))
+# 接続の確立を待つ時間（応答の待ち時間は各SDKのリクエストごとの設定に従う）
+PROVIDER_HTTP_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_HTTP_CONNECT_TIMEOUT", "10"))
+# 起動時の接続の確立（ウォームアップ）を待つ時間
+PROVIDER_WARMUP_TIMEOUT = float(os.getenv("PROVIDER_WARMUP_TIMEOUT", "5"))
+
+# ウォームアップで接続するプロバイダーのAPI（APIキーが設定されている場合のみ）
+_WARMUP_TARGETS = {
+    "openai": ("OPENAI_API_KEY", "https://api.openai.com/v1/models"),
+    "claude": ("CLAUDE_API_KEY", "https://api.anthropic.com/v1/messages"),
+}
+
+
+class ProviderClientRegistry:
+    """
+    プロバイダーのSDKクライアントの共有
+
+    文字起こし・要約・タグ提案で (プロバイダー, APIキー) ごとに1つのクライアントを共有し、
+    どのクライアントも1つの httpx の接続プール（HTTP/2・keep-alive）を使う。
+    リクエストごとにTLS接続を確立し直さず、起動時に接続を確立しておき、停止時に閉じる。
+
+    接続プールを作り直すか閉じるたびに generation が増える。クライアントを保持するサービスは
+    generation が変わったら取得し直す（閉じた接続プール・チャネルを使い続けない）。
+    """
+
+    def __init__(self):
+        self._http: Optional[httpx.AsyncClient] = None
+        self._clients: Dict[Tuple[str, str], Any] = {}
+        self._speech: Optional[speech.SpeechAsyncClient] = None
+        self.generation = 0
+
+    def http_client(self) -> httpx.AsyncClient:
+        """共有の接続プール"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                http2=PROVIDER_HTTP2 and _HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=PROVIDER_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=PROVIDER_HTTP_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=PROVIDER_HTTP_KEEPALIVE_SECONDS,
+                ),
+                timeout=httpx.Timeout(600.0, connect=PROVIDER_HTTP_CONNECT_TIMEOUT),
+                follow_redirects=True,
+            )
+            # 閉じたプールを使っていたクライアントは作り直す
+            self._clients.clear()
+            self.generation += 1
+        return self._http
+
+    def openai(self, api_key: str) -> openai.AsyncOpenAI:
+        """OpenAIのクライアント（レート制限の再試行は provider_limiter で行うため、SDKでは再試行しない）"""
+        key = ("openai", api_key)
+        http = self.http_client()
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = openai.AsyncOpenAI(
+                api_key=api_key, max_retries=0, http_client=http
+            )
+        return client
+
+    def anthropic(self, api_key: str) -> anthropic.AsyncAnthropic:
+        """Anthropicのクライアント（同上）"""
+        key = ("claude", api_key)
+        http = self.http_client()
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = anthropic.AsyncAnthropic(
+                api_key=api_key, max_retries=0, http_client=http
+            )
+        return client
+
+    def google_speech(self) -> speech.SpeechAsyncClient:
+        """Google Cloud Speech-to-Textのクライアント（gRPCのチャネルはイベントループ上で作成する必要がある）"""
+        if self._speech is None:
+            self._speech = speech.SpeechAsyncClient()
+        return self._speech
+
+    async def warm_up(self):
+        """APIキーが設定されているプロバイダーへ接続を確立しておく（失敗しても起動は続ける）"""
+        targets = [url for env, url in _WARMUP_TARGETS.values() if os.getenv(env)]
+        if not targets:
+            return
+        http = self.http_client()
+
+        async def _connect(url: str):
+            try:
+                # 応答（認証エラー等）の内容は問わず、接続をプールに残すことが目的
+                await http.head(url, timeout=PROVIDER_WARMUP_TIMEOUT)
+            except Exception as e:
+                print(f"Provider connection warm-up failed for {url}: {str(e)}")
+
+        await asyncio.gather(*(_connect(url) for url in targets))
+
+    async def aclose(self):
+        """接続を閉じる"""
+        self._clients.clear()
+        self.generation += 1
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._speech is not None:
+            await self._speech.transport.close()
+            self._speech = None
+
+
+# シングルトンインスタンス
+provider_clients = ProviderClientRegistry()
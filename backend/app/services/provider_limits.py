@@ -0,0 +1,281 @@
+import os
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+
+# レート制限（429）を受けた呼び出しを再試行する回数（環境変数から）
+PROVIDER_RATE_LIMIT_RETRIES = int(os.getenv("PROVIDER_RATE_LIMIT_RETRIES", "6"))
+# Retry-After がない場合の再試行までの待ち時間（初回・上限、秒）
+PROVIDER_BACKOFF_BASE_SECONDS = float(os.getenv("PROVIDER_BACKOFF_BASE_SECONDS", "1"))
+PROVIDER_BACKOFF_MAX_SECONDS = float(os.getenv("PROVIDER_BACKOFF_MAX_SECONDS", "60"))
+# 応答時間がこれまでの平均のこの倍数を超えた場合は混雑とみなして同時実行数を減らす
+PROVIDER_LATENCY_TOLERANCE = float(os.getenv("PROVIDER_LATENCY_TOLERANCE", "2.0"))
+
+# レート制限・過負荷とみなすステータス（429: Too Many Requests、529: Anthropicの過負荷）
+_THROTTLE_STATUS_CODES = {429, 529}
+# 混雑時に同時実行数に掛ける係数（429・応答時間の悪化）
+_THROTTLE_DECREASE = 0.5
+_LATENCY_DECREASE = 0.9
+# 応答時間の平均（指数移動平均）の重み
+_LATENCY_SMOOTHING = 0.2
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class ProviderQuota:
+    """プロバイダーの利用枠（1分あたりのリクエスト数・トークン数。0は制限なし）"""
+    requests_per_minute: float
+    tokens_per_minute: float
+    max_concurrency: int
+
+
+def _quota(prefix: str) -> ProviderQuota:
+    return ProviderQuota(
+        requests_per_minute=float(os.getenv(f"{prefix}_REQUESTS_PER_MINUTE", "0")),
+        tokens_per_minute=float(os.getenv(f"{prefix}_TOKENS_PER_MINUTE", "0")),
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "8")),
+    )
+
+
+# プロバイダーごとの利用枠（環境変数から。キーは設定の *_api の値）
+PROVIDER_QUOTAS: Dict[str, ProviderQuota] = {
+    "openai": _quota("OPENAI"),
+    "claude": _quota("CLAUDE"),
+    "google": _quota("GOOGLE"),
+}
+
+
+def is_throttled(error: Exception) -> bool:
+    """プロバイダーのレート制限・過負荷のエラーか（OpenAI・Anthropic・Googleの例外に対応）"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        code = getattr(error, "code", None)
+        status = code if isinstance(code, int) else None
+    return status in _THROTTLE_STATUS_CODES
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """エラーレスポンスの Retry-After（retry-after-ms・秒数・HTTP日付）から待ち時間（秒）を取得"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(*texts: str, max_output: int = 0) -> int:
+    """リクエストのトークン数の見積もり（日本語は1文字1トークン程度として多めに見積もる）"""
+    return sum(len(text) for text in texts) + max_output
+
+
+class TokenBucket:
+    """1分あたりの量で補充されるトークンバケット（rate_per_minute が0なら制限なし）"""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.level = rate_per_minute
+        self._updated: Optional[float] = None
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount を取得できるまでの時間（秒）。バケットより大きい量は満杯になるまで待つ"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) * 60 / self.capacity)
+
+    def take(self, amount: float, now: float):
+        if self.unlimited:
+            return
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """見積もりとの差を反映（実際の使用量が多かった場合は残量が負になり、その分だけ後の取得を待たせる）"""
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level - amount)
+
+
+class ProviderLimiter:
+    """
+    プロバイダーへの呼び出しのレート制限と同時実行数の調整
+
+    同じプロバイダーを使う文字起こし・要約・タグ提案で共有し、1分あたりのリクエスト数・
+    トークン数をトークンバケットで守る。同時実行数はAIMDで調整し、成功すれば少しずつ
+    増やし、429（過負荷）を受けるか応答時間が平均より大きく悪化した場合は減らす。
+    応答時間の平均は処理の種類（operation）ごとに持ち、入力量（units、音声の秒数等）が
+    分かる場合は単位あたりの時間で比べる。数分かかる長い音声の文字起こしが、短いチャットの
+    呼び出しの平均と比べられて同時実行数を下げることはない。
+    Retry-After を受けた場合はその時間、プロバイダーへの呼び出し全体を止める。
+    """
+
+    def __init__(self, name: str, quota: ProviderQuota):
+        self.name = name
+        self.quota = quota
+        self.requests = TokenBucket(quota.requests_per_minute)
+        self.tokens = TokenBucket(quota.tokens_per_minute)
+        self.max_concurrency = max(1, quota.max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        # 処理の種類ごとの応答時間の平均（入力量が分かる場合は単位あたり）
+        self._latencies: Dict[str, float] = {}
+        self._decreased_at = float("-inf")
+        self._throttles = 0
+        self._changed: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._changed is None or self._loop is not loop:
+            self._changed = asyncio.Condition()
+            self._loop = loop
+        return self._changed
+
+    async def call(
+        self,
+        request: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        usage: Optional[Callable[[T], Optional[int]]] = None,
+        operation: str = "chat",
+        units: Optional[float] = None,
+    ) -> T:
+        """
+        プロバイダーを呼び出す（レート制限を受けた場合は待ってから再試行）
+
+        Args:
+            request: 呼び出し（再試行時はもう一度呼ばれる）
+            tokens: 使用するトークン数の見積もり
+            usage: レスポンスから実際の使用トークン数を取得する関数
+            operation: 応答時間の平均を分ける処理の種類
+            units: 応答時間を割る入力量（音声の秒数等。不明な場合はNone）
+        """
+        attempts = 0
+        while True:
+            try:
+                async with self.slot(tokens, operation, units):
+                    result = await request()
+            except Exception as e:
+                if not is_throttled(e) or attempts >= PROVIDER_RATE_LIMIT_RETRIES:
+                    raise
+                attempts += 1
+                print(f"{self.name} rate limited (attempt {attempts}), concurrency limit {int(self.limit)}")
+                continue
+            if usage is not None:
+                used = usage(result)
+                if used:
+                    self.tokens.adjust(used - tokens)
+            return result
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, operation: str = "chat", units: Optional[float] = None) -> AsyncIterator[None]:
+        """呼び出しの実行枠（再試行できないストリーミング等はこれで囲む）"""
+        await self._acquire(tokens)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            yield
+        except Exception as e:
+            if is_throttled(e):
+                self._on_throttled(retry_after(e), started, loop.time())
+            raise
+        else:
+            self._on_success(operation, loop.time() - started, started, units)
+        finally:
+            await self._release()
+
+    async def _acquire(self, tokens: int):
+        changed = self._condition()
+        loop = asyncio.get_running_loop()
+        async with changed:
+            while True:
+                now = loop.time()
+                wait = self.blocked_until - now
+                if wait <= 0 and self.in_flight < max(1, int(self.limit)):
+                    wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                    if wait <= 0:
+                        self.requests.take(1, now)
+                        self.tokens.take(tokens, now)
+                        self.in_flight += 1
+                        return
+                try:
+                    # 実行枠の解放、または補充・Retry-Afterの待ち時間の経過を待つ
+                    await asyncio.wait_for(changed.wait(), wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self):
+        changed = self._condition()
+        async with changed:
+            self.in_flight -= 1
+            changed.notify_all()
+
+    def _decrease(self, factor: float, started: float, now: float):
+        # 同じ混雑で同時に失敗した呼び出しが重ねて減らさないよう、前回減らした後に始まった呼び出しのみ
+        if started >= self._decreased_at:
+            self.limit = max(1.0, self.limit * factor)
+            self._decreased_at = now
+
+    def _on_success(self, operation: str, elapsed: float, started: float, units: Optional[float] = None):
+        self._throttles = 0
+        # 入力量が分からない呼び出しは、入力量で割った平均と比べない
+        key = f"{operation}/unit" if units else operation
+        latency = elapsed / units if units else elapsed
+        average = self._latencies.get(key)
+        if average is not None and latency > average * PROVIDER_LATENCY_TOLERANCE:
+            self._decrease(_LATENCY_DECREASE, started, started + elapsed)
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        if average is None:
+            self._latencies[key] = latency
+        else:
+            self._latencies[key] = average + (latency - average) * _LATENCY_SMOOTHING
+
+    def _on_throttled(self, delay: Optional[float], started: float, now: float):
+        self._decrease(_THROTTLE_DECREASE, started, now)
+        self._throttles += 1
+        if delay is None:
+            delay = min(PROVIDER_BACKOFF_MAX_SECONDS, PROVIDER_BACKOFF_BASE_SECONDS * 2 ** (self._throttles - 1))
+            delay *= random.uniform(0.8, 1.0)
+        self.blocked_until = max(self.blocked_until, now + delay)
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+
+
+def provider_limiter(name: str) -> ProviderLimiter:
+    """プロバイダーごとに共有するレート制限を取得"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = ProviderLimiter(name, PROVIDER_QUOTAS.get(name, ProviderQuota(0, 0, 8)))
+    return limiter
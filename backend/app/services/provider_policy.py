@@ -0,0 +1,236 @@
+import os
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+
+# プロバイダーごとの1回の呼び出しのタイムアウト（秒。0は無制限。環境変数から）
+# レート制限の待ち時間を含むため、文字起こしは長めにする。文字起こしは区間
+# （TRANSCRIBE_SEGMENT_SECONDS）の長さを基準とし、それより長い音声は長さに比例して延ばす
+PROVIDER_TIMEOUTS: Dict[str, float] = {
+    "openai": float(os.getenv("OPENAI_TIMEOUT_SECONDS", "300")),
+    "claude": float(os.getenv("CLAUDE_TIMEOUT_SECONDS", "120")),
+    # 非同期認識の完了待ち（GOOGLE_OPERATION_TIMEOUT）より長くする
+    "google": float(os.getenv("GOOGLE_TIMEOUT_SECONDS", "960")),
+}
+
+# ヘッジ（プライマリが遅い場合に予備のプロバイダーにも送る）の設定（環境変数から）
+PROVIDER_HEDGING = os.getenv("PROVIDER_HEDGING", "true").lower() == "true"
+# プライマリの応答時間がこの分位を超えたら予備のプロバイダーにも送る
+PROVIDER_HEDGE_QUANTILE = float(os.getenv("PROVIDER_HEDGE_QUANTILE", "0.95"))
+# 分位を計算する直近の応答時間の数と、ヘッジを始めるのに必要な数
+PROVIDER_LATENCY_WINDOW = int(os.getenv("PROVIDER_LATENCY_WINDOW", "200"))
+PROVIDER_HEDGE_MIN_SAMPLES = int(os.getenv("PROVIDER_HEDGE_MIN_SAMPLES", "20"))
+
+# 呼び出しに必要な認証情報（環境変数）。設定されていないプロバイダーは予備に使わない
+_PROVIDER_CREDENTIALS = {
+    "openai": "OPENAI_API_KEY",
+    "claude": "CLAUDE_API_KEY",
+    "google": "GOOGLE_APPLICATION_CREDENTIALS",
+}
+
+T = TypeVar("T")
+
+
+def parse_fallbacks(spec: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    予備のプロバイダーの設定を解析
+
+    "claude:claude-3-haiku,openai" のように、優先順にカンマ区切りで「API[:モデル]」を指定する。
+    """
+    fallbacks = []
+    for item in spec.split(","):
+        api_type, _, model = item.strip().partition(":")
+        if api_type:
+            fallbacks.append((api_type.strip(), model.strip() or None))
+    return fallbacks
+
+
+def fallback_model(fallbacks: List[Tuple[str, Optional[str]]], api_type: str, default: Optional[str]) -> Optional[str]:
+    """予備のプロバイダーで使うモデル（指定がなければ default）"""
+    for fallback_api, model in fallbacks:
+        if fallback_api == api_type and model:
+            return model
+    return default
+
+
+def provider_configured(api_type: str) -> bool:
+    """プロバイダーの認証情報が設定されているか（モックは常に利用できる）"""
+    env = _PROVIDER_CREDENTIALS.get(api_type)
+    return env is None or bool(os.getenv(env))
+
+
+class LatencyTracker:
+    """直近の応答時間（ヘッジを始める時間の計算用）"""
+
+    def __init__(self, window: int = PROVIDER_LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=max(1, window))
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """応答時間の分位（記録が少ない場合はNone）"""
+        if len(self._samples) < max(1, PROVIDER_HEDGE_MIN_SAMPLES):
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class ProviderRegistry:
+    """
+    処理（文字起こし・要約・タグ提案）ごとのプロバイダーの実装
+
+    設定の *_api の値をキーに、同じ引数で呼び出せる非同期関数を登録する。
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self._handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+
+    def register(self, api_type: str, handler: Callable[..., Awaitable[Any]]):
+        self._handlers[api_type] = handler
+
+    def __contains__(self, api_type: str) -> bool:
+        return api_type in self._handlers
+
+    def get(self, api_type: str) -> Callable[..., Awaitable[Any]]:
+        handler = self._handlers.get(api_type)
+        if handler is None:
+            raise ValueError(f"Unsupported {self.operation} API: {api_type}")
+        return handler
+
+    def order(self, primary: str, fallbacks: List[Tuple[str, Optional[str]]]) -> List[str]:
+        """呼び出す順のプロバイダー（プライマリと、登録済みで認証情報が設定されている予備）"""
+        self.get(primary)
+        apis = [primary]
+        for api_type, _ in fallbacks:
+            if api_type not in apis and api_type in self._handlers and provider_configured(api_type):
+                apis.append(api_type)
+        return apis
+
+
+class ProviderPolicy:
+    """
+    プロバイダーの呼び出し順・ヘッジ・タイムアウト
+
+    先頭のプロバイダー（プライマリ）から呼び出し、失敗（タイムアウトを含む）したら次の
+    プロバイダーへ切り替える。プライマリが直近の応答時間の p95 を過ぎても終わらない場合は
+    次のプロバイダーにも送り、先に成功した結果を使って残りは中止する。1つのプロバイダーの
+    遅延がそのまま全体の応答時間の裾にならないようにする。応答時間は処理ごとに記録し、
+    入力量（units、音声の秒数等）が分かる呼び出しは単位あたりの時間で記録・比較する
+    （短い音声の p95 を長い音声が超えるたびにヘッジして二重に課金されないように）。
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self._latencies: Dict[str, LatencyTracker] = {}
+
+    def latency(self, api_type: str, per_unit: bool = False) -> LatencyTracker:
+        key = f"{api_type}/unit" if per_unit else api_type
+        tracker = self._latencies.get(key)
+        if tracker is None:
+            tracker = self._latencies[key] = LatencyTracker()
+        return tracker
+
+    async def run(
+        self,
+        apis: List[str],
+        call: Callable[[str], Awaitable[T]],
+        timeout_scale: Optional[float] = 1.0,
+        units: Optional[float] = None,
+    ) -> T:
+        """
+        プロバイダーを順に呼び出す
+
+        Args:
+            apis: 呼び出す順のプロバイダー（先頭がプライマリ）
+            call: プロバイダーを指定して1回呼び出す関数
+            timeout_scale: タイムアウトに掛ける倍率（入力が長い場合。Noneはタイムアウトなし）
+            units: 応答時間を割る入力量（音声の秒数等。不明な場合はNone）
+
+        Raises:
+            全プロバイダーが失敗した場合はプライマリのエラー
+        """
+        loop = asyncio.get_running_loop()
+        remaining = list(apis)
+        pending: Dict[asyncio.Task, Tuple[str, float]] = {}
+        errors: Dict[str, Exception] = {}
+
+        def _launch():
+            api_type = remaining.pop(0)
+            task = asyncio.create_task(self._attempt(api_type, call, timeout_scale, units))
+            # 中止した呼び出しの例外を取り出しておく（未取得の警告を出さない）
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            pending[task] = (api_type, loop.time())
+
+        _launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=self._hedge_delay(pending, remaining, loop.time(), units),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    slow = [api_type for api_type, _ in pending.values()]
+                    print(f"{self.operation} on {', '.join(slow)} exceeded p95 latency, hedging to {remaining[0]}")
+                    _launch()
+                    continue
+                for task in done:
+                    api_type, _ = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        errors[api_type] = e
+                        if remaining or pending:
+                            print(f"{self.operation} on {api_type} failed, trying next provider: {str(e)}")
+                if not pending and remaining:
+                    _launch()
+            raise next(errors[api_type] for api_type in apis if api_type in errors)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _hedge_delay(
+        self, pending: Dict[asyncio.Task, Tuple[str, float]], remaining: List[str], now: float,
+        units: Optional[float] = None
+    ) -> Optional[float]:
+        """最後に送ったプロバイダーの p95 までの残り時間（ヘッジしない場合はNone）"""
+        if not PROVIDER_HEDGING or not remaining:
+            return None
+        api_type, started = list(pending.values())[-1]
+        threshold = self.latency(api_type, bool(units)).quantile(PROVIDER_HEDGE_QUANTILE)
+        if threshold is None:
+            return None
+        if units:
+            threshold *= units
+        return max(0.0, started + threshold - now)
+
+    def _record(self, api_type: str, elapsed: float, units: Optional[float]):
+        self.latency(api_type, bool(units)).record(elapsed / units if units else elapsed)
+
+    async def _attempt(
+        self,
+        api_type: str,
+        call: Callable[[str], Awaitable[T]],
+        timeout_scale: Optional[float] = 1.0,
+        units: Optional[float] = None,
+    ) -> T:
+        timeout = PROVIDER_TIMEOUTS.get(api_type) or None
+        if timeout is not None:
+            timeout = timeout * timeout_scale if timeout_scale is not None else None
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            result = await asyncio.wait_for(call(api_type), timeout)
+        except asyncio.TimeoutError:
+            if timeout is None:
+                raise
+            self._record(api_type, loop.time() - started, units)
+            raise TimeoutError(f"{api_type} {self.operation} timed out after {timeout:g} seconds")
+        except asyncio.CancelledError:
+            # ヘッジで中止した遅い呼び出しも記録する（記録しないと p95 が実際より短くなる）
+            self._record(api_type, loop.time() - started, units)
+            raise
+        self._record(api_type, loop.time() - started, units)
+        return result
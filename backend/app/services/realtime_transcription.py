@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import shutil
+import fcntl
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .audio_probe import find_clusters
+from .audio_storage import MAX_UPLOAD_SIZE, write_stream
+from .transcription import transcription_service
+from .transcript_segments import shift_segments
+
+
+# リアルタイム文字起こしの設定（環境変数から）
+REALTIME_WINDOW_SECONDS = int(os.getenv("REALTIME_WINDOW_SECONDS", "30"))
+# 他のプロセスが文字起こし中のウィンドウの結果を確認する間隔と、
+# 実行中の印が更新されなくなってから停止したとみなすまでの時間（秒）
+REALTIME_WINDOW_POLL_SECONDS = float(os.getenv("REALTIME_WINDOW_POLL_SECONDS", "0.5"))
+REALTIME_WINDOW_STALE_SECONDS = float(os.getenv("REALTIME_WINDOW_STALE_SECONDS", "30"))
+# 最後の追記からこの秒数が経過した録音は放棄されたとみなして削除する
+REALTIME_SESSION_TTL = int(os.getenv("REALTIME_SESSION_TTL", str(24 * 60 * 60)))
+
+# クラスタ検出時に再走査する末尾のバイト数（ID・サイズ・Timecodeが分割されても拾えるように）
+_RESCAN_TAIL = 32
+
+
+class SegmentOutOfOrder(Exception):
+    """セグメント番号が期待値と異なる場合のエラー"""
+
+    def __init__(self, expected: int):
+        super().__init__(f"expected segment {expected}")
+        self.expected = expected
+
+
+class RealtimeTranscriber:
+    """
+    録音中に送られてくるWebMセグメントを追記し、完了したクラスタから順に文字起こしする
+
+    MediaRecorderのセグメントはクラスタ境界と一致しないため、追記されたデータから
+    Clusterを検出し、REALTIME_WINDOW_SECONDS 分たまるごとに
+    「ヘッダ（最初のClusterより前）+ クラスタ群」を単体のWebMとして切り出して文字起こしする。
+
+    状態は音声ファイルの隣のディレクトリ（<audio>.rt/）に保存する:
+        state.json           追記状況とクラスタ位置
+        window_NNNN.webm     文字起こし待ちのウィンドウ
+        window_NNNN.running  文字起こし中の印（実行中のプロセスが定期的に更新する）
+        window_NNNN.json     ウィンドウの文字起こし結果
+
+    作業ディレクトリは全ワーカープロセスで共有するため、ウィンドウの文字起こしは
+    実行中の印を作成できたプロセスだけが行い、他のプロセスは結果が書き込まれるのを待つ。
+    作業ディレクトリは結果の結合に成功するまで残し、完了の失敗後に再試行できるようにする。
+    最後の追記から ttl 秒経過した録音は放棄されたとみなして削除する。
+    """
+
+    def __init__(
+        self, window_seconds: int = REALTIME_WINDOW_SECONDS, max_size: int = MAX_UPLOAD_SIZE,
+        ttl: int = REALTIME_SESSION_TTL
+    ):
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self.ttl = ttl
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _work_dir(self, audio_path: Path) -> Path:
+        return audio_path.with_name(audio_path.name + ".rt")
+
+    def _read_state(self, work_dir: Path) -> Dict[str, Any]:
+        return json.loads((work_dir / "state.json").read_text())
+
+    def _write_state(self, work_dir: Path, state: Dict[str, Any]):
+        tmp_path = work_dir / "state.json.tmp"
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, work_dir / "state.json")
+
+    @asynccontextmanager
+    async def _locked(self, work_dir: Path):
+        """複数ワーカープロセスからの同時追記を防ぐファイルロック"""
+        lock_file = await asyncio.to_thread(open, work_dir / "lock", "a")
+        try:
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def start(self, audio_path: Path, realtime: bool):
+        """録音セッションを開始"""
+        work_dir = self._work_dir(audio_path)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        audio_path.touch()
+        self._write_state(work_dir, {
+            "realtime": realtime,
+            "next_seq": 0,
+            "size": 0,
+            "scanned": 0,
+            "header_size": None,
+            "window_start": None,  # [オフセット, Timecode ms]
+            "clusters": [],        # window_start 以降のクラスタ
+            "windows": 0,
+            "window_timecodes": [],  # 各ウィンドウの開始Timecode（ms）
+        })
+
+    async def append_segment(self, audio_path: Path, seq: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        セグメントを音声ファイルへ追記する
+
+        同じ番号の再送は無視し（冪等）、番号が飛んだ場合は SegmentOutOfOrder を送出する。
+        """
+        work_dir = self._work_dir(audio_path)
+        async with self._locked(work_dir):
+            state = await asyncio.to_thread(self._read_state, work_dir)
+            if seq < state["next_seq"]:
+                return {"next_seq": state["next_seq"], "size": state["size"], "windows": state["windows"]}
+            if seq > state["next_seq"]:
+                raise SegmentOutOfOrder(state["next_seq"])
+
+            stored = await write_stream(chunks, audio_path, max_size=self.max_size - state["size"], append=True)
+            state["size"] += stored.size
+            state["next_seq"] += 1
+
+            if state["realtime"]:
+                await asyncio.to_thread(self._scan_clusters, audio_path, state)
+                for index, start, end in self._cut_windows(state):
+                    await asyncio.to_thread(self._write_window, audio_path, state, index, start, end)
+                    self._schedule(audio_path, index)
+
+            await asyncio.to_thread(self._write_state, work_dir, state)
+            return {"next_seq": state["next_seq"], "size": state["size"], "windows": state["windows"]}
+
+    def _scan_clusters(self, audio_path: Path, state: Dict[str, Any]):
+        """前回走査位置以降に追記されたデータからClusterを検出"""
+        scan_from = max(0, state["scanned"] - _RESCAN_TAIL)
+        with open(audio_path, "rb") as f:
+            f.seek(scan_from)
+            data = f.read()
+
+        # 再走査した範囲で検出済みのクラスタは除外
+        last_known = max(
+            [offset for offset, _ in state["clusters"]]
+            + ([state["window_start"][0]] if state["window_start"] else [-1])
+        )
+        for offset, timecode in find_clusters(data, scan_from):
+            if offset <= last_known:
+                continue
+            if state["header_size"] is None:
+                state["header_size"] = offset
+            if state["window_start"] is None:
+                state["window_start"] = [offset, timecode]
+            else:
+                state["clusters"].append([offset, timecode])
+        state["scanned"] = state["size"]
+
+    def _cut_windows(self, state: Dict[str, Any]) -> List[Tuple[int, int, int]]:
+        """window_seconds 分たまったクラスタ範囲を切り出し、[(番号, 開始, 終了)] を返す"""
+        windows = []
+        window_ms = self.window_seconds * 1000
+        while state["window_start"]:
+            start_offset, start_timecode = state["window_start"]
+            # 次のClusterの開始位置までは完了している
+            boundary = None
+            for i, (offset, timecode) in enumerate(state["clusters"]):
+                if timecode - start_timecode >= window_ms:
+                    boundary = i
+                    break
+            if boundary is None:
+                break
+            end_offset, end_timecode = state["clusters"][boundary]
+            windows.append((state["windows"], start_offset, end_offset))
+            state["window_timecodes"].append(start_timecode)
+            state["windows"] += 1
+            state["window_start"] = [end_offset, end_timecode]
+            state["clusters"] = state["clusters"][boundary + 1:]
+        return windows
+
+    def _write_window(self, audio_path: Path, state: Dict[str, Any], index: int, start: int, end: Optional[int]):
+        """ヘッダ + [start, end) のクラスタを単体のWebMとして書き出す"""
+        work_dir = self._work_dir(audio_path)
+        with open(audio_path, "rb") as src, open(self._window_path(work_dir, index, ".webm"), "wb") as dst:
+            dst.write(src.read(state["header_size"]))
+            src.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                data = src.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+                if not data:
+                    break
+                dst.write(data)
+                if remaining is not None:
+                    remaining -= len(data)
+
+    def _window_path(self, work_dir: Path, index: int, suffix: str) -> Path:
+        return work_dir / f"window_{index:04d}{suffix}"
+
+    def _claim_window(self, work_dir: Path, index: int) -> bool:
+        """ウィンドウの文字起こしの実行中の印を作成（他のプロセスが文字起こし中ならFalse）"""
+        marker = self._window_path(work_dir, index, ".running")
+        for _ in range(2):
+            try:
+                os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - marker.stat().st_mtime < REALTIME_WINDOW_STALE_SECONDS:
+                    return False
+            except FileNotFoundError:
+                continue
+            # 更新されなくなった印（文字起こし中に停止したプロセス）は引き継ぐ
+            marker.unlink(missing_ok=True)
+        return False
+
+    async def _keep_claim(self, marker: Path):
+        """実行中の印を定期的に更新（停止したとみなされないように）"""
+        while True:
+            await asyncio.sleep(REALTIME_WINDOW_STALE_SECONDS / 3)
+            try:
+                await asyncio.to_thread(os.utime, marker)
+            except FileNotFoundError:
+                return
+
+    def _read_window_result(self, work_dir: Path, index: int) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._window_path(work_dir, index, ".json").read_text())
+        except FileNotFoundError:
+            return None
+
+    def _write_window_result(self, work_dir: Path, index: int, result: Dict[str, Any]):
+        # 待っている他のプロセスが書き込み途中の結果を読まないよう、置き換えで書き込む
+        result_path = self._window_path(work_dir, index, ".json")
+        tmp_path = result_path.with_name(result_path.name + ".tmp")
+        try:
+            tmp_path.write_text(json.dumps(result))
+            os.replace(tmp_path, result_path)
+        except FileNotFoundError:
+            # 録音が破棄された
+            pass
+
+    def _schedule(self, audio_path: Path, index: int):
+        key = f"{audio_path}:{index}"
+        self._tasks[key] = asyncio.create_task(self._transcribe_window(audio_path, index))
+
+    async def _transcribe_window(self, audio_path: Path, index: int) -> Optional[Dict[str, Any]]:
+        """ウィンドウを文字起こしして結果を保存（他のプロセスが文字起こし中の場合はNone）"""
+        work_dir = self._work_dir(audio_path)
+        try:
+            claimed = await asyncio.to_thread(self._claim_window, work_dir, index)
+        except FileNotFoundError:
+            # 録音が破棄された
+            return None
+        if not claimed:
+            return None
+
+        marker = self._window_path(work_dir, index, ".running")
+        heartbeat = asyncio.create_task(self._keep_claim(marker))
+        try:
+            try:
+                result = await transcription_service.transcribe_audio(str(self._window_path(work_dir, index, ".webm")))
+            except Exception as e:
+                result = {"error": str(e)}
+            await asyncio.to_thread(self._write_window_result, work_dir, index, result)
+            return result
+        finally:
+            heartbeat.cancel()
+            marker.unlink(missing_ok=True)
+
+    async def _window_result(self, audio_path: Path, index: int) -> Dict[str, Any]:
+        """
+        ウィンドウの文字起こし結果を取得（未完了なら待つ、失敗していれば再実行）
+
+        別のプロセスで文字起こし中のウィンドウは、重複してプロバイダーを呼び出さずに
+        結果が書き込まれるのを待つ。文字起こし中のプロセスが停止していた場合はここで文字起こしする。
+        """
+        work_dir = self._work_dir(audio_path)
+        task = self._tasks.pop(f"{audio_path}:{index}", None)
+        result = await task if task else None
+
+        while result is None:
+            result = await asyncio.to_thread(self._read_window_result, work_dir, index)
+            if result is not None:
+                break
+            if not await asyncio.to_thread(work_dir.exists):
+                raise FileNotFoundError(str(work_dir))
+            result = await self._transcribe_window(audio_path, index)
+            if result is None:
+                await asyncio.sleep(REALTIME_WINDOW_POLL_SECONDS)
+        if "error" in result:
+            # 失敗したウィンドウはもう一度文字起こしする（成功した結果は完了の再試行でも使う）
+            result = await transcription_service.transcribe_audio(str(self._window_path(work_dir, index, ".webm")))
+            await asyncio.to_thread(self._write_window_result, work_dir, index, result)
+        return result
+
+    async def finish(self, audio_path: Path) -> Optional[Dict[str, Any]]:
+        """
+        録音を完了し、残りのウィンドウを文字起こしして結果を結合する
+
+        文字起こしに失敗した場合は作業ディレクトリを残すため、もう一度呼び出すと
+        文字起こし済みのウィンドウの結果を使って失敗したウィンドウから再開する。
+
+        Returns:
+            Dict: transcribe_audio と同じ形式の結果（リアルタイム文字起こし無効時はNone）
+        """
+        work_dir = self._work_dir(audio_path)
+        async with self._locked(work_dir):
+            state = await asyncio.to_thread(self._read_state, work_dir)
+            if state["realtime"] and state["window_start"]:
+                # 最後のウィンドウはファイル末尾まで
+                index = state["windows"]
+                await asyncio.to_thread(self._write_window, audio_path, state, index, state["window_start"][0], None)
+                state["window_timecodes"].append(state["window_start"][1])
+                state["windows"] += 1
+                state["window_start"] = None
+                state["clusters"] = []
+                self._schedule(audio_path, index)
+                await asyncio.to_thread(self._write_state, work_dir, state)
+
+        if not state["realtime"]:
+            result = None
+        elif state["windows"] == 0:
+            # Clusterを検出できない場合はファイル全体を文字起こし
+            result = await transcription_service.transcribe_audio(str(audio_path))
+        else:
+            results = [await self._window_result(audio_path, i) for i in range(state["windows"])]
+            texts = [r["transcription"] for r in results if r.get("transcription")]
+            # ウィンドウ内の位置を録音全体での位置に変換（Timecodeはミリ秒単位）
+            timecodes = state["window_timecodes"]
+            result = {
+                "transcription": "".join(texts),
+                "confidence": min(r.get("confidence", 0.0) for r in results),
+                "model": results[0]["model"],
+                "language": results[0].get("language", "ja"),
+                "segments": [
+                    segment
+                    for r, timecode in zip(results, timecodes)
+                    for segment in shift_segments(r.get("segments"), (timecode - timecodes[0]) / 1000)
+                ],
+            }
+
+        # 結合に成功した場合のみ作業ディレクトリを削除（失敗時は再試行に備えて残す）
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+        return result
+
+    async def abort(self, audio_path: Path):
+        """録音を破棄"""
+        for key in [k for k in self._tasks if k.startswith(f"{audio_path}:")]:
+            self._tasks.pop(key).cancel()
+        await asyncio.to_thread(shutil.rmtree, self._work_dir(audio_path), True)
+
+    def _expired(self, directory: Path) -> List[Path]:
+        """最後の追記から ttl 秒経過した録音の音声ファイルのパス"""
+        if not directory.exists():
+            return []
+
+        expired = []
+        now = time.time()
+        for work_dir in directory.glob("*.rt"):
+            try:
+                updated_at = (work_dir / "state.json").stat().st_mtime
+            except (FileNotFoundError, NotADirectoryError):
+                # 状態が壊れている場合はディレクトリの更新時刻で判定
+                updated_at = work_dir.stat().st_mtime
+            if now - updated_at > self.ttl:
+                expired.append(work_dir.with_name(work_dir.name[:-len(".rt")]))
+        return expired
+
+    async def cleanup_expired(self, directory: Path) -> List[Path]:
+        """
+        放棄された録音（完了も破棄もされず ttl 秒経過したもの）の作業ディレクトリと音声を削除
+
+        Returns:
+            List[Path]: 削除した音声ファイルのパス（日記エントリの削除は呼び出し側で行う）
+        """
+        expired = await asyncio.to_thread(self._expired, directory)
+        for audio_path in expired:
+            await self.abort(audio_path)
+            await asyncio.to_thread(audio_path.unlink, missing_ok=True)
+        return expired
+
+
+# シングルトンインスタンス
+realtime_transcriber = RealtimeTranscriber()
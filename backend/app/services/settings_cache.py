@@ -0,0 +1,156 @@
+import os
+import asyncio
+from typing import Any, Dict, Optional
+
+import asyncpg
+from sqlalchemy import Integer, Text, cast, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..database import DATABASE_URL, async_session_factory
+from ..models import UserSettings
+
+
+# 設定の変更の通知チャンネル
+SETTINGS_CHANNEL = "settings_changed"
+# 通知を受け取れなかった場合に備えて、キャッシュした設定を読み直すまでの時間（秒）
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "60"))
+# 接続が切れた場合の再接続間隔（秒）
+SETTINGS_RECONNECT_SECONDS = float(os.getenv("SETTINGS_RECONNECT_SECONDS", "3"))
+
+# 設定のバージョンを保存するキー（設定の保存ごとに1増える）
+SETTINGS_VERSION_KEY = "_version"
+
+
+class SettingsCache:
+    """
+    ユーザー設定（user_settings）のプロセス内キャッシュ
+
+    文字起こし・要約・タグ提案の呼び出しごとに設定を読む代わりに、メモリ上の設定を返す。
+    POST /settings は設定と同じトランザクションでバージョンを上げて NOTIFY するため、
+    全プロセスのキャッシュがすぐに無効になる。通知より前に読み始めた古い設定は
+    バージョンで判別してキャッシュしない。通知の取りこぼしに備えて一定時間で読み直す。
+    """
+
+    def __init__(self, ttl: float = SETTINGS_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._settings: Optional[Dict[str, Any]] = None
+        self._version = 0
+        self._latest_version = 0
+        self._loaded_at = 0.0
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get(self) -> Dict[str, Any]:
+        """設定を取得（保存されているキーのみ。未設定のキーは含まない）"""
+        self._ensure_listener()
+        settings = self._cached()
+        if settings is not None:
+            return settings
+        async with async_session_factory() as db:
+            result = await db.execute(select(UserSettings.key, UserSettings.value))
+            return self._store(result.all())
+
+    def current(self, db: Session) -> Dict[str, Any]:
+        """設定を取得（同期セッションを使うルーター用）"""
+        self._ensure_listener()
+        settings = self._cached()
+        if settings is not None:
+            return settings
+        return self._store(db.query(UserSettings.key, UserSettings.value).all())
+
+    async def bump(self, db: AsyncSession) -> int:
+        """
+        設定のバージョンを上げて変更を通知（コミットしない）
+
+        設定の保存と同じトランザクションで実行すると、コミット時に全プロセスへ通知される。
+        """
+        version = (await db.execute(
+            insert(UserSettings)
+            .values(key=SETTINGS_VERSION_KEY, value=1)
+            .on_conflict_do_update(
+                index_elements=[UserSettings.key],
+                set_={"value": func.to_jsonb(cast(cast(UserSettings.value, Text), Integer) + 1)}
+            )
+            .returning(UserSettings.value)
+        )).scalar_one()
+        await db.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": SETTINGS_CHANNEL, "payload": str(version)}
+        )
+        return int(version)
+
+    def invalidate(self, version: Optional[int] = None):
+        """キャッシュを無効にする（version より古い設定は以後キャッシュしない）"""
+        if version is not None:
+            self._latest_version = max(self._latest_version, version)
+        self._settings = None
+
+    async def stop(self):
+        """LISTENを停止"""
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    def _now(self) -> float:
+        try:
+            return asyncio.get_running_loop().time()
+        except RuntimeError:
+            return 0.0
+
+    def _cached(self) -> Optional[Dict[str, Any]]:
+        if self._settings is not None and self._now() - self._loaded_at < self.ttl:
+            return self._settings
+        return None
+
+    def _store(self, rows: Any) -> Dict[str, Any]:
+        settings = {key: value for key, value in rows}
+        version = int(settings.pop(SETTINGS_VERSION_KEY, 0) or 0)
+        # 読んでいる間に新しい設定が通知された場合はキャッシュしない
+        if version >= self._latest_version:
+            self._settings = settings
+            self._version = version
+            self._latest_version = version
+            self._loaded_at = self._now()
+        return settings
+
+    def _ensure_listener(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    def _notified(self, connection, pid, channel, payload: str):
+        try:
+            version = int(payload)
+        except ValueError:
+            version = None
+        if version is None or version > self._version:
+            self.invalidate(version)
+
+    async def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(DATABASE_URL)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(SETTINGS_CHANNEL, self._notified)
+                # 接続していなかった間の変更を取りこぼした可能性があるため読み直す
+                self.invalidate()
+                await lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Settings listener error: {str(e)}")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(SETTINGS_RECONNECT_SECONDS)
+
+
+# シングルトンインスタンス
+settings_cache = SettingsCache()
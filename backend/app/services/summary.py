@@ -1,14 +1,20 @@
 import os
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-import openai
-import anthropic
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
-from ..database import async_session_factory
-from ..models import UserSettings
+from .provider_clients import provider_clients
+from .provider_limits import estimate_tokens, provider_limiter
+from .provider_policy import ProviderPolicy, ProviderRegistry, fallback_model, parse_fallbacks
+from .settings_cache import settings_cache
+
+
+# 設定のプロバイダー（プライマリ）が失敗・遅延した場合に使う予備のプロバイダー（環境変数から）
+# 優先順にカンマ区切りで「API[:モデル]」を指定する（例: claude:claude-3-haiku,openai）
+SUMMARY_FALLBACK_APIS = parse_fallbacks(os.getenv("SUMMARY_FALLBACK_APIS", ""))
+# 予備のプロバイダーでモデルを指定しない場合のモデル（タグ提案と共通）
+SUMMARY_FALLBACK_MODELS = {"openai": "gpt-4o-mini", "claude": "claude-3-haiku"}
 
 
 class SummaryService:
@@ -18,37 +24,47 @@ class SummaryService:
         self.model = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
         self.openai_client = None
         self.claude_client = None
+        # プロバイダーごとの要約の実装（引数: テキスト, モデル）
+        self.providers = ProviderRegistry("summary")
+        self.providers.register("mock", self._mock_summarize)
+        self.providers.register("openai", self._openai_summarize)
+        self.providers.register("claude", self._claude_summarize)
+        self.policy = ProviderPolicy("summary")
         self._setup_clients()
     
     def _setup_clients(self):
-        """APIクライアントをセットアップ"""
+        """APIクライアントをセットアップ（予備のプロバイダーはAPIキーが設定されている場合のみ）"""
+        self._client_api_type = self.api_type
+        apis = {self.api_type} | {api_type for api_type, _ in SUMMARY_FALLBACK_APIS}
         # OpenAI API設定
-        if self.api_type == "openai":
+        if "openai" in apis:
             openai_api_key = os.getenv("OPENAI_API_KEY")
-            if not openai_api_key:
+            if openai_api_key:
+                # プロバイダーごとに共有するクライアント（接続プールも共有）
+                self.openai_client = provider_clients.openai(openai_api_key)
+            elif self.api_type == "openai":
                 raise ValueError("OPENAI_API_KEY environment variable is required for OpenAI summary")
-            self.openai_client = openai.AsyncOpenAI(api_key=openai_api_key)
         
         # Claude API設定
-        elif self.api_type == "claude":
+        if "claude" in apis:
             claude_api_key = os.getenv("CLAUDE_API_KEY")
-            if not claude_api_key:
+            if claude_api_key:
+                self.claude_client = provider_clients.anthropic(claude_api_key)
+            elif self.api_type == "claude":
                 raise ValueError("CLAUDE_API_KEY environment variable is required for Claude summary")
-            self.claude_client = anthropic.AsyncAnthropic(api_key=claude_api_key)
+        # 取得したクライアントが使う接続プールの世代
+        self._client_generation = provider_clients.generation
+    
+    def _model_for(self, api_type: str) -> str:
+        """プロバイダーで使うモデル（プライマリは設定のモデル）"""
+        if api_type == self.api_type:
+            return self.model
+        return fallback_model(SUMMARY_FALLBACK_APIS, api_type, SUMMARY_FALLBACK_MODELS.get(api_type, self.model))
     
     async def _get_settings_from_db(self) -> Dict[str, Any]:
-        """データベースから設定を取得"""
+        """データベースから設定を取得（プロセス内のキャッシュから。変更時は通知で読み直される）"""
         try:
-            async with async_session_factory() as db:
-                result = await db.execute(select(UserSettings))
-                settings_rows = result.fetchall()
-                
-                settings = {}
-                for row in settings_rows:
-                    setting = row[0]
-                    settings[setting.key] = setting.value
-                
-                return settings
+            return await settings_cache.get()
         except Exception:
             # DB接続エラーの場合は環境変数を使用
             return {}
@@ -63,8 +79,9 @@ class SummaryService:
         if "summary_model" in db_settings:
             self.model = db_settings["summary_model"]
         
-        # クライアントを再セットアップ
-        self._setup_clients()
+        # APIの種類が変わった場合、または共有の接続プールが作り直された場合にクライアントを再セットアップ
+        if self.api_type != self._client_api_type or self._client_generation != provider_clients.generation:
+            self._setup_clients()
     
     async def summarize_text(self, text: str) -> Dict[str, Any]:
         """
@@ -84,16 +101,13 @@ class SummaryService:
         # 設定を最新に更新
         await self._update_config()
         
-        if self.api_type == "mock":
-            return await self._mock_summarize(text)
-        elif self.api_type == "openai":
-            return await self._openai_summarize(text)
-        elif self.api_type == "claude":
-            return await self._claude_summarize(text)
-        else:
-            raise ValueError(f"Unsupported summary API: {self.api_type}")
+        # 設定のプロバイダーから呼び出し、失敗・遅延した場合は予備のプロバイダーを使う
+        apis = self.providers.order(self.api_type, SUMMARY_FALLBACK_APIS)
+        return await self.policy.run(
+            apis, lambda api_type: self.providers.get(api_type)(text, self._model_for(api_type))
+        )
     
-    async def _mock_summarize(self, text: str) -> Dict[str, Any]:
+    async def _mock_summarize(self, text: str, model: Optional[str] = None) -> Dict[str, Any]:
         """モック要約（開発用）"""
         await asyncio.sleep(4)  # 実際のAPI呼び出しをシミュレート
         
@@ -107,8 +121,9 @@ class SummaryService:
             "tokens_used": 150
         }
     
-    async def _openai_summarize(self, text: str) -> Dict[str, Any]:
+    async def _openai_summarize(self, text: str, model: Optional[str] = None) -> Dict[str, Any]:
         """OpenAI GPT APIを使用した要約"""
+        model = model or self.model
         try:
             # システムプロンプト（日本語音声日記専用）
             system_prompt = """あなたは日本語の音声日記を要約する専門AIです。以下の指示に従って要約とタイトルを作成してください：
@@ -125,14 +140,18 @@ class SummaryService:
 
             user_prompt = f"以下の音声から文字起こしされたテキストを要約してください：\n\n{text}"
             
-            response = await self.openai_client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=400,
-                temperature=0.7
+            response = await provider_limiter("openai").call(
+                lambda: self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    max_tokens=400,
+                    temperature=0.7
+                ),
+                tokens=estimate_tokens(system_prompt, user_prompt, max_output=400),
+                usage=lambda r: r.usage.total_tokens if r.usage else None
             )
             
             content = response.choices[0].message.content.strip()
@@ -143,15 +162,16 @@ class SummaryService:
             return {
                 "summary": summary,
                 "title": title,
-                "model": self.model,
+                "model": model,
                 "tokens_used": response.usage.total_tokens if response.usage else 0
             }
             
         except Exception as e:
             raise Exception(f"OpenAI summary failed: {str(e)}")
     
-    async def _claude_summarize(self, text: str) -> Dict[str, Any]:
+    async def _claude_summarize(self, text: str, model: Optional[str] = None) -> Dict[str, Any]:
         """Claude APIを使用した要約"""
+        model = model or self.model
         try:
             # Claude用プロンプト
             prompt = f"""あなたは日本語の音声日記を要約する専門AIです。以下の音声から文字起こしされたテキストを要約してください：
@@ -170,14 +190,18 @@ class SummaryService:
 タイトル: [40文字以内で内容を表現する魅力的なタイトル]
 要約: [上記の指示に従った要約文]"""
 
-            response = await self.claude_client.messages.create(
-                model=self.model,
-                max_tokens=400,
-                temperature=0.7,
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
+            response = await provider_limiter("claude").call(
+                lambda: self.claude_client.messages.create(
+                    model=model,
+                    max_tokens=400,
+                    temperature=0.7,
+                    messages=[{
+                        "role": "user",
+                        "content": prompt
+                    }]
+                ),
+                tokens=estimate_tokens(prompt, max_output=400),
+                usage=lambda r: r.usage.input_tokens + r.usage.output_tokens if r.usage else None
             )
             
             content = response.content[0].text.strip()
@@ -188,7 +212,7 @@ class SummaryService:
             return {
                 "summary": summary,
                 "title": title,
-                "model": self.model,
+                "model": model,
                 "tokens_used": response.usage.input_tokens + response.usage.output_tokens if response.usage else 0
             }
             
@@ -1,15 +1,18 @@
 import os
 import asyncio
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 
-import openai
-import anthropic
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from ..database import async_session_factory
-from ..models import UserSettings, DiaryEntry
+from ..models import DiaryEntry
+from .provider_clients import provider_clients
+from .provider_limits import estimate_tokens, provider_limiter
+from .provider_policy import ProviderPolicy, ProviderRegistry, fallback_model, provider_configured
+from .settings_cache import settings_cache
+from .summary import SUMMARY_FALLBACK_APIS, SUMMARY_FALLBACK_MODELS
 
 
 class TagSuggestionService:
@@ -19,35 +22,44 @@ class TagSuggestionService:
         self.model = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
         self.openai_client = None
         self.claude_client = None
+        # プロバイダーごとのタグ提案の実装（引数: 文字起こし, 要約, 既存タグ, モデル。予備は要約と共通）
+        self.providers = ProviderRegistry("tag suggestion")
+        self.providers.register(
+            "mock", lambda transcription, summary, existing_tags, model=None: self._mock_suggest_tags(existing_tags)
+        )
+        self.providers.register("openai", self._openai_suggest_tags)
+        self.providers.register("claude", self._claude_suggest_tags)
+        self.policy = ProviderPolicy("tag suggestion")
         self._setup_clients()
     
     def _setup_clients(self):
         """APIクライアントをセットアップ"""
+        self._client_api_type = self.api_type
+        apis = {self.api_type} | {api_type for api_type, _ in SUMMARY_FALLBACK_APIS}
         # OpenAI API設定
-        if self.api_type == "openai":
+        if "openai" in apis:
             openai_api_key = os.getenv("OPENAI_API_KEY")
             if openai_api_key:
-                self.openai_client = openai.AsyncOpenAI(api_key=openai_api_key)
+                self.openai_client = provider_clients.openai(openai_api_key)
         
         # Claude API設定
-        elif self.api_type == "claude":
+        if "claude" in apis:
             claude_api_key = os.getenv("CLAUDE_API_KEY")
             if claude_api_key:
-                self.claude_client = anthropic.AsyncAnthropic(api_key=claude_api_key)
+                self.claude_client = provider_clients.anthropic(claude_api_key)
+        # 取得したクライアントが使う接続プールの世代
+        self._client_generation = provider_clients.generation
+    
+    def _model_for(self, api_type: str) -> str:
+        """プロバイダーで使うモデル（プライマリは設定のモデル）"""
+        if api_type == self.api_type:
+            return self.model
+        return fallback_model(SUMMARY_FALLBACK_APIS, api_type, SUMMARY_FALLBACK_MODELS.get(api_type, self.model))
     
     async def _get_settings_from_db(self) -> Dict[str, Any]:
-        """データベースから設定を取得"""
+        """データベースから設定を取得（プロセス内のキャッシュから。変更時は通知で読み直される）"""
         try:
-            async with async_session_factory() as db:
-                result = await db.execute(select(UserSettings))
-                settings_rows = result.fetchall()
-                
-                settings = {}
-                for row in settings_rows:
-                    setting = row[0]
-                    settings[setting.key] = setting.value
-                
-                return settings
+            return await settings_cache.get()
         except Exception:
             return {}
     
@@ -61,8 +73,9 @@ class TagSuggestionService:
         if "summary_model" in db_settings:
             self.model = db_settings["summary_model"]
         
-        # クライアントを再セットアップ
-        self._setup_clients()
+        # APIの種類が変わった場合、または共有の接続プールが作り直された場合にクライアントを再セットアップ
+        if self.api_type != self._client_api_type or self._client_generation != provider_clients.generation:
+            self._setup_clients()
     
     async def get_existing_tags(self) -> List[str]:
         """既存のタグを取得"""
@@ -102,14 +115,25 @@ class TagSuggestionService:
         # 既存タグを取得
         existing_tags = await self.get_existing_tags()
         
-        if self.api_type == "mock":
-            return await self._mock_suggest_tags(existing_tags)
-        elif self.api_type == "openai" and self.openai_client:
-            return await self._openai_suggest_tags(transcription, summary, existing_tags)
-        elif self.api_type == "claude" and self.claude_client:
-            return await self._claude_suggest_tags(transcription, summary, existing_tags)
-        else:
-            # APIが利用できない場合は空のリストを返す
+        # APIキーが設定されているプロバイダーのみ（利用できない場合は空のリストを返す）
+        if self.api_type not in self.providers:
+            return []
+        apis = [
+            api_type for api_type in self.providers.order(self.api_type, SUMMARY_FALLBACK_APIS)
+            if provider_configured(api_type)
+        ]
+        if not apis:
+            return []
+        
+        try:
+            return await self.policy.run(
+                apis,
+                lambda api_type: self.providers.get(api_type)(
+                    transcription, summary, existing_tags, self._model_for(api_type)
+                )
+            )
+        except Exception as e:
+            print(f"Tag suggestion failed: {str(e)}")
             return []
     
     async def _mock_suggest_tags(self, existing_tags: List[str]) -> List[str]:
@@ -124,8 +148,11 @@ class TagSuggestionService:
         else:
             return ["日常", "振り返り", "体験"]
     
-    async def _openai_suggest_tags(self, transcription: str, summary: str, existing_tags: List[str]) -> List[str]:
+    async def _openai_suggest_tags(
+        self, transcription: str, summary: str, existing_tags: List[str], model: Optional[str] = None
+    ) -> List[str]:
         """OpenAI GPT APIを使用したタグ提案"""
+        model = model or self.model
         try:
             # 既存タグを文字列化
             existing_tags_str = ", ".join(existing_tags[:20]) if existing_tags else "なし"
@@ -152,14 +179,18 @@ class TagSuggestionService:
 
 適切なタグを最大3つ提案してください。"""
             
-            response = await self.openai_client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=150,
-                temperature=0.3
+            response = await provider_limiter("openai").call(
+                lambda: self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    max_tokens=150,
+                    temperature=0.3
+                ),
+                tokens=estimate_tokens(system_prompt, user_prompt, max_output=150),
+                usage=lambda r: r.usage.total_tokens if r.usage else None
             )
             
             content = response.choices[0].message.content.strip()
@@ -174,11 +205,13 @@ class TagSuggestionService:
                 return self._extract_tags_from_text(content)
             
         except Exception as e:
-            print(f"OpenAI tag suggestion failed: {str(e)}")
-            return []
+            raise Exception(f"OpenAI tag suggestion failed: {str(e)}")
     
-    async def _claude_suggest_tags(self, transcription: str, summary: str, existing_tags: List[str]) -> List[str]:
+    async def _claude_suggest_tags(
+        self, transcription: str, summary: str, existing_tags: List[str], model: Optional[str] = None
+    ) -> List[str]:
         """Claude APIを使用したタグ提案"""
+        model = model or self.model
         try:
             # 既存タグを文字列化
             existing_tags_str = ", ".join(existing_tags[:20]) if existing_tags else "なし"
@@ -205,14 +238,18 @@ class TagSuggestionService:
 出力形式：
 {{"tags": ["タグ1", "タグ2", "タグ3"]}}"""
 
-            response = await self.claude_client.messages.create(
-                model=self.model,
-                max_tokens=150,
-                temperature=0.3,
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
+            response = await provider_limiter("claude").call(
+                lambda: self.claude_client.messages.create(
+                    model=model,
+                    max_tokens=150,
+                    temperature=0.3,
+                    messages=[{
+                        "role": "user",
+                        "content": prompt
+                    }]
+                ),
+                tokens=estimate_tokens(prompt, max_output=150),
+                usage=lambda r: r.usage.input_tokens + r.usage.output_tokens if r.usage else None
             )
             
             content = response.content[0].text.strip()
@@ -227,8 +264,7 @@ class TagSuggestionService:
                 return self._extract_tags_from_text(content)
             
         except Exception as e:
-            print(f"Claude tag suggestion failed: {str(e)}")
-            return []
+            raise Exception(f"Claude tag suggestion failed: {str(e)}")
     
     def _extract_tags_from_text(self, text: str) -> List[str]:
         """テキストからタグを抽出（JSONパース失敗時のフォールバック）"""
@@ -0,0 +1,41 @@
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from ..models import TranscriptionSegment
+
+
+def shift_segments(segments: Optional[List[Dict[str, Any]]], offset: float) -> List[Dict[str, Any]]:
+    """区間の開始・終了位置を offset 秒ずらす（分割して文字起こしした結果を結合する場合）"""
+    return [
+        {**segment, "start": segment["start"] + offset, "end": segment["end"] + offset}
+        for segment in segments or []
+    ]
+
+
+def replace_segments(db: Session, entry_id: UUID, segments: Optional[List[Dict[str, Any]]]):
+    """
+    日記エントリの文字起こし区間を置き換える
+
+    コミットしないため、文字起こし結果の保存と同じトランザクションで確定すること。
+    """
+    db.query(TranscriptionSegment).filter(TranscriptionSegment.entry_id == entry_id).delete()
+    for seq, segment in enumerate(s for s in segments or [] if s.get("text")):
+        db.add(TranscriptionSegment(
+            entry_id=entry_id,
+            seq=seq,
+            start_seconds=segment["start"],
+            end_seconds=segment["end"],
+            text=segment["text"],
+        ))
+
+
+def copy_segments(db: Session, source_entry_id: UUID, entry_id: UUID):
+    """同じ音声の日記エントリから文字起こし区間をコピーする（コミットしない）"""
+    segments = db.query(TranscriptionSegment).filter(
+        TranscriptionSegment.entry_id == source_entry_id
+    ).order_by(TranscriptionSegment.seq).all()
+    replace_segments(db, entry_id, [
+        {"start": s.start_seconds, "end": s.end_seconds, "text": s.text} for s in segments
+    ])
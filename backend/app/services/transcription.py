@@ -1,17 +1,89 @@
 import os
 import asyncio
-from typing import Optional, Dict, Any
+from contextlib import aclosing, asynccontextmanager
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, BinaryIO, Callable, List, Tuple
 from pathlib import Path
-import tempfile
 
-import openai
 from google.cloud import speech
-from pydub import AudioSegment
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
-from ..database import async_session_factory
-from ..models import UserSettings
+from .audio_artifacts import audio_artifact_service
+from .audio_probe import AudioFormat, probe_duration, sniff_format
+from .audio_transcode import WIRE_FORMATS, TranscodeError, WireFormat, transcode_stream, transcoded_file
+from .audio_vad import detect_speech_segments
+from .audio_workers import audio_worker_pool
+from .provider_clients import provider_clients
+from .provider_limits import provider_limiter
+from .provider_policy import ProviderPolicy, ProviderRegistry, fallback_model, parse_fallbacks
+from .settings_cache import settings_cache
+from .transcript_segments import shift_segments
+
+
+# プロバイダーへ送信する音声形式の設定（環境変数から）
+# OpenAI: auto（対応形式かつ上限以下ならそのまま、それ以外はOpus）/ passthrough / opus / flac / wav
+OPENAI_WIRE_FORMAT = os.getenv("OPENAI_WIRE_FORMAT", "auto")
+# Google: flac / wav
+GOOGLE_WIRE_FORMAT = os.getenv("GOOGLE_WIRE_FORMAT", "flac")
+
+# Whisper APIが受け付けるコンテナとファイルサイズの上限
+WHISPER_ACCEPTED_CONTAINERS = {"webm", "ogg", "mp4", "mp3", "wav", "flac"}
+WHISPER_MAX_UPLOAD_SIZE = 25 * 1024 * 1024
+
+# Google Speech-to-Textがそのまま受け付ける (コンテナ, コーデック) とエンコーディング
+GOOGLE_ENCODINGS = {
+    ("flac", "flac"): speech.RecognitionConfig.AudioEncoding.FLAC,
+    ("wav", "pcm"): speech.RecognitionConfig.AudioEncoding.LINEAR16,
+    ("ogg", "opus"): speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
+    ("webm", "opus"): speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
+}
+GOOGLE_OPUS_SAMPLE_RATES = {8000, 12000, 16000, 24000, 48000}
+# 同期認識（recognize）とストリーミング認識で扱える音声の長さの上限（秒）
+GOOGLE_SYNC_MAX_SECONDS = 60
+GOOGLE_STREAMING_MAX_SECONDS = 300
+# 同期・非同期認識でリクエストに直接含められる音声データの上限（超える場合は区切って送信）
+GOOGLE_INLINE_MAX_BYTES = 10 * 1024 * 1024
+# ストリーミング認識の1リクエストあたりの音声データの大きさ
+GOOGLE_STREAM_CHUNK_SIZE = 16 * 1024
+# 非同期認識（long_running_recognize）の完了を待つ時間（秒）
+GOOGLE_OPERATION_TIMEOUT = float(os.getenv("GOOGLE_OPERATION_TIMEOUT", "900"))
+
+# 長い録音の分割設定（環境変数から）
+# これより長い録音は無音部分で区間に分割し、区間ごとに並列で文字起こしする（秒）
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "120"))
+# 1件の文字起こしで同時に送信する区間数
+TRANSCRIBE_SEGMENT_CONCURRENCY = int(os.getenv("TRANSCRIBE_SEGMENT_CONCURRENCY", "4"))
+
+# 設定のプロバイダー（プライマリ）が失敗・遅延した場合に使う予備のプロバイダー（環境変数から）
+# 優先順にカンマ区切りで「API[:モデル]」を指定する（例: google,openai:whisper-1）
+TRANSCRIBE_FALLBACK_APIS = parse_fallbacks(os.getenv("TRANSCRIBE_FALLBACK_APIS", ""))
+# 予備のプロバイダーでモデルを指定しない場合のモデル
+TRANSCRIBE_FALLBACK_MODELS = {"openai": "whisper-1"}
+
+_PROVIDER_NAMES = {"openai": "OpenAI", "google": "Google"}
+
+
+def _timeout_scale(duration: Optional[float]) -> Optional[float]:
+    """
+    文字起こしのタイムアウトの倍率
+
+    プロバイダーごとのタイムアウトは区間（TRANSCRIBE_SEGMENT_SECONDS）の長さを基準とし、
+    それより長い音声は長さに比例して延ばす。長さが分からない音声はタイムアウトなし（None）。
+    """
+    if duration is None:
+        return None
+    return max(1.0, duration / TRANSCRIBE_SEGMENT_SECONDS)
+
+
+def _file_size(audio_file: BinaryIO) -> int:
+    """ファイルオブジェクトの大きさ（読み込み位置は先頭に戻す）"""
+    audio_file.seek(0, os.SEEK_END)
+    size = audio_file.tell()
+    audio_file.seek(0)
+    return size
+
+
+# 文字起こしの進捗の通知先（進捗率, 途中までのテキスト）
+ProgressCallback = Callable[[float, str], Awaitable[None]]
 
 
 class TranscriptionService:
@@ -21,37 +93,54 @@ class TranscriptionService:
         self.model = os.getenv("TRANSCRIBE_MODEL", "whisper-1")
         self.openai_client = None
         self.google_client = None
+        # プロバイダーごとの文字起こしの実装
+        # ファイル全体（引数: 音声ファイルのパス, 内容ハッシュ）
+        self.providers = ProviderRegistry("transcription")
+        self.providers.register("mock", lambda audio_file_path, audio_sha256=None: self._mock_transcribe())
+        self.providers.register("openai", self._openai_transcribe)
+        self.providers.register("google", self._google_transcribe)
+        # 長い録音の区間（引数: 切り出し元の音声のパス, 開始秒, 終了秒）
+        self.segment_providers = ProviderRegistry("transcription")
+        self.segment_providers.register("openai", self._openai_segment)
+        self.segment_providers.register("google", self._google_segment)
+        # 応答時間は録音全体と区間で大きく異なるため別々に記録する
+        self.policy = ProviderPolicy("transcription")
+        self.segment_policy = ProviderPolicy("segment transcription")
         self._setup_clients()
     
     def _setup_clients(self):
-        """APIクライアントをセットアップ"""
+        """APIクライアントをセットアップ（予備のプロバイダーは認証情報が設定されている場合のみ）"""
+        self._client_api_type = self.api_type
+        apis = {self.api_type} | {api_type for api_type, _ in TRANSCRIBE_FALLBACK_APIS}
         # OpenAI API設定
-        if self.api_type == "openai":
+        if "openai" in apis:
             openai_api_key = os.getenv("OPENAI_API_KEY")
-            if not openai_api_key:
+            if openai_api_key:
+                # プロバイダーごとに共有するクライアント（接続プールも共有）
+                self.openai_client = provider_clients.openai(openai_api_key)
+            elif self.api_type == "openai":
                 raise ValueError("OPENAI_API_KEY environment variable is required for OpenAI transcription")
-            self.openai_client = openai.AsyncOpenAI(api_key=openai_api_key)
         
         # Google Cloud設定
-        elif self.api_type == "google":
+        if "google" in apis:
             credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-            if not credentials_path:
+            if not credentials_path and self.api_type == "google":
                 raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable is required for Google transcription")
-            self.google_client = speech.SpeechClient()
+            # gRPCの非同期チャネルはイベントループ上で作成する必要があるため、初回の呼び出し時に作成
+            self.google_client = None
+        # 取得したクライアントが使う接続プールの世代
+        self._client_generation = provider_clients.generation
+    
+    def _model_for(self, api_type: str) -> str:
+        """プロバイダーで使うモデル（プライマリは設定のモデル）"""
+        if api_type == self.api_type:
+            return self.model
+        return fallback_model(TRANSCRIBE_FALLBACK_APIS, api_type, TRANSCRIBE_FALLBACK_MODELS.get(api_type, self.model))
     
     async def _get_settings_from_db(self) -> Dict[str, Any]:
-        """データベースから設定を取得"""
+        """データベースから設定を取得（プロセス内のキャッシュから。変更時は通知で読み直される）"""
         try:
-            async with async_session_factory() as db:
-                result = await db.execute(select(UserSettings))
-                settings_rows = result.fetchall()
-                
-                settings = {}
-                for row in settings_rows:
-                    setting = row[0]
-                    settings[setting.key] = setting.value
-                
-                return settings
+            return await settings_cache.get()
         except Exception:
             # DB接続エラーの場合は環境変数を使用
             return {}
@@ -66,150 +155,504 @@ class TranscriptionService:
         if "transcribe_model" in db_settings:
             self.model = db_settings["transcribe_model"]
         
-        # クライアントを再セットアップ
-        self._setup_clients()
+        # APIの種類が変わった場合、または共有の接続プールが作り直された場合にクライアントを再セットアップ
+        if self.api_type != self._client_api_type or self._client_generation != provider_clients.generation:
+            self._setup_clients()
     
-    async def transcribe_audio(self, audio_file_path: str) -> Dict[str, Any]:
+    async def transcribe_audio(
+        self,
+        audio_file_path: str,
+        audio_sha256: Optional[str] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
         """
         音声ファイルを文字起こしする
         
         Args:
             audio_file_path: 音声ファイルのパス
+            audio_sha256: 音声の内容ハッシュ（指定時は正規化済みの音声を再利用する）
+            on_progress: 分割して文字起こしする場合に、区間が完了するごとに
+                (進捗率 0〜1, 先頭から続けて完了した区間のテキスト) で呼ばれる
             
         Returns:
             Dict: {
                 "transcription": str,
                 "confidence": float,
                 "model": str,
-                "language": str
+                "language": str,
+                "segments": [{"start": float, "end": float, "text": str}]  # 音声上の位置（秒）
             }
         """
         # 設定を最新に更新
         await self._update_config()
         
-        if self.api_type == "mock":
-            return await self._mock_transcribe()
-        elif self.api_type == "openai":
-            return await self._openai_transcribe(audio_file_path)
-        elif self.api_type == "google":
-            return await self._google_transcribe(audio_file_path)
-        else:
-            raise ValueError(f"Unsupported transcription API: {self.api_type}")
+        apis = self.providers.order(self.api_type, TRANSCRIBE_FALLBACK_APIS)
+        
+        # 長い録音は無音部分で分割して並列に文字起こし（モックは分割しない）
+        duration = None
+        if self.api_type != "mock":
+            duration = await asyncio.to_thread(probe_duration, audio_file_path)
+            segments = await self._plan_segments(audio_file_path, duration)
+            if segments:
+                return await self._transcribe_segments(audio_file_path, audio_sha256, segments, on_progress)
+        
+        # 設定のプロバイダーから呼び出し、失敗・遅延した場合は予備のプロバイダーを使う
+        # （分割できなかった長い録音や長さ不明の音声も打ち切らないよう、タイムアウトは長さに合わせる）
+        return await self.policy.run(
+            apis, lambda api_type: self.providers.get(api_type)(audio_file_path, audio_sha256),
+            timeout_scale=_timeout_scale(duration) if self.api_type != "mock" else 1.0,
+            units=duration
+        )
     
     async def _mock_transcribe(self) -> Dict[str, Any]:
         """モック文字起こし（開発用）"""
         await asyncio.sleep(2)  # 実際のAPI呼び出しをシミュレート
+        transcription = "これはモック文字起こし結果です。実際の音声から生成された文字起こしテキストがここに表示されます。本日は充実した一日でした。朝から晩まで様々な活動に取り組み、多くのことを学ぶことができました。"
+        sentences = [sentence + "。" for sentence in transcription.split("。") if sentence]
         return {
-            "transcription": "これはモック文字起こし結果です。実際の音声から生成された文字起こしテキストがここに表示されます。本日は充実した一日でした。朝から晩まで様々な活動に取り組み、多くのことを学ぶことができました。",
+            "transcription": transcription,
             "confidence": 0.95,
             "model": "mock-whisper-v1",
-            "language": "ja"
+            "language": "ja",
+            # 1文5秒として区間を作成
+            "segments": [
+                {"start": i * 5.0, "end": (i + 1) * 5.0, "text": sentence} for i, sentence in enumerate(sentences)
+            ]
         }
     
-    async def _openai_transcribe(self, audio_file_path: str) -> Dict[str, Any]:
+    async def prepare_audio(self, audio_file_path: str, audio_sha256: str) -> Optional[Path]:
+        """
+        送信用の正規化済み音声を事前に作成する（アップロード時にバックグラウンドで実行）
+        
+        Returns:
+            Optional[Path]: 正規化済み音声のパス（変換せずに送信できる場合はNone）
+        """
+        await self._update_config()
+        if self.api_type == "mock":
+            return None
+        
+        audio_path = Path(audio_file_path)
+        source = await asyncio.to_thread(sniff_format, audio_path)
+        wire = await asyncio.to_thread(self._select_wire_format, audio_path, source)
+        if wire is None:
+            return None
+        return await audio_artifact_service.ensure_normalized(audio_file_path, audio_sha256, wire)
+    
+    async def _openai_transcribe(self, audio_file_path: str, audio_sha256: Optional[str] = None) -> Dict[str, Any]:
         """OpenAI Whisper APIを使用した文字起こし"""
         try:
-            # WebMファイルをWAVに変換（OpenAI APIはWebMを直接サポートしていない場合があるため）
-            audio_path = Path(audio_file_path)
-            if audio_path.suffix.lower() == '.webm':
-                wav_path = await self._convert_webm_to_wav(audio_file_path)
-            else:
-                wav_path = audio_file_path
-            
-            # OpenAI Whisper APIで文字起こし
-            with open(wav_path, "rb") as audio_file:
-                transcript = await self.openai_client.audio.transcriptions.create(
-                    model=self.model,
-                    file=audio_file,
-                    language="ja",  # 日本語を指定
-                    response_format="verbose_json"
-                )
-            
-            # 一時ファイルを削除
-            if wav_path != audio_file_path and Path(wav_path).exists():
-                Path(wav_path).unlink()
-            
-            return {
-                "transcription": transcript.text,
-                "confidence": getattr(transcript, 'confidence', 0.9),  # Whisperは信頼度を返さない場合があるので仮の値
-                "model": self.model,
-                "language": transcript.language or "ja"
-            }
+            duration = await asyncio.to_thread(probe_duration, audio_file_path)
+            # 対応形式で上限以下のファイルはそのまま、それ以外は変換して送信
+            async with self._open_audio(audio_file_path, audio_sha256, "openai") as (filename, audio_file, _):
+                return await self._openai_request(filename, audio_file, duration)
             
         except Exception as e:
             raise Exception(f"OpenAI transcription failed: {str(e)}")
     
-    async def _google_transcribe(self, audio_file_path: str) -> Dict[str, Any]:
+    async def _openai_request(
+        self, filename: str, audio_file: BinaryIO, duration: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """OpenAI Whisper APIで文字起こし（duration は応答時間を音声の長さあたりで見るための秒数）"""
+        model = self._model_for("openai")
+        
+        async def _request():
+            # レート制限で再試行する場合も先頭から送信する
+            await asyncio.to_thread(audio_file.seek, 0)
+            return await self.openai_client.audio.transcriptions.create(
+                model=model,
+                file=(filename, audio_file),
+                language="ja",  # 日本語を指定
+                response_format="verbose_json"
+            )
+        
+        transcript = await provider_limiter("openai").call(_request, operation="transcription", units=duration)
+        
+        # verbose_jsonの区間（SDKのバージョンによりdictまたはオブジェクト）
+        segments = []
+        for segment in getattr(transcript, "segments", None) or []:
+            field = segment.get if isinstance(segment, dict) else lambda key: getattr(segment, key, None)
+            segments.append({
+                "start": float(field("start") or 0.0),
+                "end": float(field("end") or 0.0),
+                "text": (field("text") or "").strip()
+            })
+        
+        return {
+            "transcription": transcript.text,
+            "confidence": getattr(transcript, 'confidence', 0.9),  # Whisperは信頼度を返さない場合があるので仮の値
+            "model": model,
+            "language": getattr(transcript, 'language', None) or "ja",
+            "segments": segments
+        }
+    
+    async def _google_transcribe(self, audio_file_path: str, audio_sha256: Optional[str] = None) -> Dict[str, Any]:
         """Google Cloud Speech-to-Text APIを使用した文字起こし"""
         try:
-            # WebMファイルをWAVに変換
-            audio_path = Path(audio_file_path)
-            if audio_path.suffix.lower() == '.webm':
-                wav_path = await self._convert_webm_to_wav(audio_file_path)
-            else:
-                wav_path = audio_file_path
-            
-            # 音声ファイルを読み込み
-            with open(wav_path, "rb") as audio_file:
-                content = audio_file.read()
+            duration = await asyncio.to_thread(probe_duration, audio_file_path)
             
-            # Google Cloud Speech-to-Text API設定
-            audio = speech.RecognitionAudio(content=content)
-            config = speech.RecognitionConfig(
-                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                sample_rate_hertz=16000,
-                language_code="ja-JP",
-                model="latest_long",  # 長時間音声用
-                use_enhanced=True,    # 高精度モード
-                enable_automatic_punctuation=True  # 自動句読点
-            )
-            
-            # 文字起こし実行
-            response = self.google_client.recognize(config=config, audio=audio)
+            # 正規化済みの音声がなく変換が必要な短い音声は、変換しながらストリーミング認識に送る
+            if not audio_sha256 and duration is not None and duration <= GOOGLE_STREAMING_MAX_SECONDS:
+                audio_path = Path(audio_file_path)
+                source = await asyncio.to_thread(sniff_format, audio_path)
+                wire = self._select_wire_format(audio_path, source, "google")
+                if wire is not None:
+                    async with aclosing(transcode_stream(
+                        audio_file_path, wire.container, 16000, list(wire.codec_args)
+                    )) as chunks:
+                        return await self._google_stream(chunks, wire.output, duration)
             
-            # 一時ファイルを削除
-            if wav_path != audio_file_path and Path(wav_path).exists():
-                Path(wav_path).unlink()
+            # 音声ファイルを読み込み（受け付けない形式はFLACに変換）
+            async with self._open_audio(audio_file_path, audio_sha256, "google") as (_, audio_file, audio_format):
+                if await asyncio.to_thread(_file_size, audio_file) <= GOOGLE_INLINE_MAX_BYTES:
+                    return await self._google_request(audio_file, audio_format, duration)
             
-            if not response.results:
-                return {
-                    "transcription": "",
-                    "confidence": 0.0,
-                    "model": "google-speech-to-text",
-                    "language": "ja"
-                }
-            
-            # 最も信頼度の高い結果を使用
-            best_result = response.results[0]
-            best_alternative = best_result.alternatives[0]
+            # リクエストに含められない大きさの音声は、ストリーミング認識の長さに区切って送る
+            if duration is None:
+                raise Exception("audio is too large to send inline and its duration is unknown")
+            source_path = audio_file_path
+            if audio_sha256:
+                source_path = str(await audio_artifact_service.ensure_normalized(
+                    audio_file_path, audio_sha256, self._segment_wire_format("google")
+                ))
+            return await self._google_split(source_path, 0.0, duration)
             
+        except Exception as e:
+            raise Exception(f"Google transcription failed: {str(e)}")
+    
+    def _google(self) -> speech.SpeechAsyncClient:
+        if self.google_client is None:
+            self.google_client = provider_clients.google_speech()
+        return self.google_client
+    
+    def _google_config(self, audio_format: AudioFormat) -> speech.RecognitionConfig:
+        """Google Cloud Speech-to-Text API設定"""
+        return speech.RecognitionConfig(
+            encoding=GOOGLE_ENCODINGS[(audio_format.container, audio_format.codec)],
+            sample_rate_hertz=audio_format.sample_rate or 0,  # 0の場合はヘッダから取得
+            language_code="ja-JP",
+            model="latest_long",  # 長時間音声用
+            use_enhanced=True,    # 高精度モード
+            enable_automatic_punctuation=True  # 自動句読点
+        )
+    
+    def _google_result(self, results: List[Any]) -> Dict[str, Any]:
+        """認識結果（音声の区間ごとに分かれている）を結合"""
+        alternatives = []
+        segments = []
+        start = 0.0
+        for result in results:
+            # 各区間の終了位置（開始位置は前の区間の終了位置）
+            end_time = getattr(result, "result_end_time", None)
+            end = end_time.total_seconds() if end_time else start
+            if result.alternatives:
+                # 各区間の最も信頼度の高い候補を使用
+                alternative = result.alternatives[0]
+                alternatives.append(alternative)
+                segments.append({"start": start, "end": end, "text": alternative.transcript.strip()})
+            start = end
+        
+        if not alternatives:
             return {
-                "transcription": best_alternative.transcript,
-                "confidence": best_alternative.confidence,
+                "transcription": "",
+                "confidence": 0.0,
                 "model": "google-speech-to-text",
-                "language": "ja"
+                "language": "ja",
+                "segments": []
             }
-            
-        except Exception as e:
-            raise Exception(f"Google transcription failed: {str(e)}")
+        
+        return {
+            "transcription": "".join(alternative.transcript for alternative in alternatives),
+            "confidence": sum(alternative.confidence for alternative in alternatives) / len(alternatives),
+            "model": "google-speech-to-text",
+            "language": "ja",
+            "segments": segments
+        }
+    
+    async def _google_request(
+        self, audio_file: BinaryIO, audio_format: AudioFormat, duration: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        音声ファイルをGoogle Cloud Speech-to-Text APIで文字起こし
+        
+        1分以内の音声は同期認識、それ以外（長さ不明を含む）は非同期認識を使う。
+        どちらもイベントループを塞がず、非同期認識の完了待ちのポーリングも非同期で行う。
+        """
+        content = await asyncio.to_thread(audio_file.read)
+        if len(content) > GOOGLE_INLINE_MAX_BYTES:
+            raise ValueError(f"audio is too large to send inline ({len(content)} bytes)")
+        audio = speech.RecognitionAudio(content=content)
+        config = self._google_config(audio_format)
+        
+        limiter = provider_limiter("google")
+        if duration is not None and duration <= GOOGLE_SYNC_MAX_SECONDS:
+            response = await limiter.call(
+                lambda: self._google().recognize(config=config, audio=audio), operation="recognize", units=duration
+            )
+        else:
+            # 実行枠は登録のリクエストのみ（完了待ちのポーリングは含めない）
+            operation = await limiter.call(
+                lambda: self._google().long_running_recognize(config=config, audio=audio),
+                operation="long_running_recognize"
+            )
+            response = await operation.result(timeout=GOOGLE_OPERATION_TIMEOUT)
+        
+        return self._google_result(response.results)
+    
+    async def _google_stream(
+        self, chunks: AsyncIterator[bytes], audio_format: AudioFormat, duration: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        チャンク単位で届く音声をストリーミング認識で文字起こし
+        
+        変換結果をためずにそのまま送信するため、音声全体をメモリに載せない（最長5分程度）。
+        """
+        async def _requests() -> AsyncIterator[speech.StreamingRecognizeRequest]:
+            yield speech.StreamingRecognizeRequest(
+                streaming_config=speech.StreamingRecognitionConfig(config=self._google_config(audio_format))
+            )
+            async for chunk in chunks:
+                for i in range(0, len(chunk), GOOGLE_STREAM_CHUNK_SIZE):
+                    yield speech.StreamingRecognizeRequest(audio_content=chunk[i:i + GOOGLE_STREAM_CHUNK_SIZE])
+        
+        # 送信済みの音声を再送できないため、レート制限を受けても再試行しない（ジョブ全体で再試行）
+        results = []
+        async with provider_limiter("google").slot(operation="streaming_recognize", units=duration):
+            responses = await self._google().streaming_recognize(requests=_requests())
+            async for response in responses:
+                results.extend(result for result in response.results if result.is_final)
+        return self._google_result(results)
+    
+    async def _plan_segments(
+        self, audio_file_path: str, duration: Optional[float]
+    ) -> Optional[List[Tuple[float, float]]]:
+        """
+        長い録音を無音部分で区間に分割する
+        
+        Args:
+            audio_file_path: 音声ファイルのパス
+            duration: 録音時間（秒。不明な場合はNone）
+        
+        Returns:
+            Optional[List[Tuple[float, float]]]: [(開始秒, 終了秒)]（分割しない場合はNone）
+        """
+        if duration is None or duration <= TRANSCRIBE_SEGMENT_SECONDS:
+            return None
+        try:
+            # デコードと音量計算はCPU負荷が高いためワーカープロセスで実行
+            segments = await audio_worker_pool.run(
+                detect_speech_segments, audio_file_path, TRANSCRIBE_SEGMENT_SECONDS
+            )
+        except Exception:
+            # 区間検出に失敗した場合はファイル全体を1回で文字起こし
+            return None
+        # 発話を検出できない場合も誤判定の可能性があるためファイル全体を文字起こし
+        return segments or None
+    
+    def _segment_wire_format(self, api_type: Optional[str] = None) -> WireFormat:
+        """区間ごとに切り出した音声の送信形式（api_type を省略した場合は設定のプロバイダー）"""
+        if (api_type or self.api_type) == "openai":
+            wire = OPENAI_WIRE_FORMAT
+            return WIRE_FORMATS["opus" if wire in ("auto", "passthrough") else wire]
+        return WIRE_FORMATS[GOOGLE_WIRE_FORMAT]
     
-    async def _convert_webm_to_wav(self, webm_path: str) -> str:
-        """WebMファイルをWAVに変換"""
+    async def _transcribe_segments(
+        self,
+        audio_file_path: str,
+        audio_sha256: Optional[str],
+        segments: List[Tuple[float, float]],
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """区間ごとに並列で文字起こしし、開始位置の順に結合する"""
+        provider = _PROVIDER_NAMES.get(self.api_type, self.api_type)
+        apis = self.segment_providers.order(self.api_type, TRANSCRIBE_FALLBACK_APIS)
+        wire = self._segment_wire_format()
+        semaphore = asyncio.Semaphore(TRANSCRIBE_SEGMENT_CONCURRENCY)
+        completed: Dict[int, str] = {}
+        
+        async def _report(index: int, result: Dict[str, Any]):
+            if on_progress is None:
+                return
+            completed[index] = result.get("transcription") or ""
+            # 先頭から続けて完了した区間までのテキスト（途中経過）
+            partial = []
+            for i in range(len(segments)):
+                if i not in completed:
+                    break
+                partial.append(completed[i])
+            try:
+                await on_progress(len(completed) / len(segments), "".join(partial))
+            except Exception as e:
+                print(f"Transcription progress callback failed: {str(e)}")
+        
         try:
-            # pydubを使用してWebMをWAVに変換
-            audio = AudioSegment.from_file(webm_path, format="webm")
+            # 正規化済みの音声があればそこから切り出す（元の音声のデコードは一度だけ）
+            source_path = audio_file_path
+            if audio_sha256:
+                source_path = str(await audio_artifact_service.ensure_normalized(audio_file_path, audio_sha256, wire))
             
-            # 16kHz, モノラル, 16bitに正規化（音声認識API用の標準設定）
-            audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
+            async def _transcribe_segment(index: int, start: float, end: float) -> Tuple[float, Dict[str, Any]]:
+                result = await _transcribe_range(start, end)
+                await _report(index, result)
+                return start, result
             
-            # 一時ファイルとして保存
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
-                audio.export(temp_wav.name, format="wav")
-                return temp_wav.name
-                
+            async def _transcribe_range(start: float, end: float) -> Dict[str, Any]:
+                # 区間ごとに予備のプロバイダーへの切り替え・ヘッジを行う（ヘッジも同じ実行枠で送る）
+                async with semaphore:
+                    return await self.segment_policy.run(
+                        apis, lambda api_type: self.segment_providers.get(api_type)(source_path, start, end),
+                        timeout_scale=_timeout_scale(end - start), units=end - start
+                    )
+            
+            tasks = [
+                asyncio.create_task(_transcribe_segment(index, start, end))
+                for index, (start, end) in enumerate(segments)
+            ]
+            try:
+                results = await asyncio.gather(*tasks)
+            finally:
+                # 1区間でも失敗した場合は残りの区間を中止
+                for task in tasks:
+                    task.cancel()
         except Exception as e:
-            raise Exception(f"Audio conversion failed: {str(e)}")
+            raise Exception(f"{provider} transcription failed: {str(e)}")
+        
+        results = sorted(results, key=lambda r: r[0])
+        texts = [r["transcription"] for _, r in results if r.get("transcription")]
+        return {
+            "transcription": "".join(texts),
+            "confidence": min(r.get("confidence", 0.0) for _, r in results),
+            "model": results[0][1]["model"],
+            "language": results[0][1].get("language", "ja"),
+            # 区間内の位置を録音全体での位置に変換
+            "segments": [
+                segment for start, r in results for segment in shift_segments(r.get("segments"), start)
+            ]
+        }
+    
+    async def _openai_segment(self, source_path: str, start: float, end: float) -> Dict[str, Any]:
+        """区間を切り出してOpenAI Whisper APIで文字起こし"""
+        wire = self._segment_wire_format("openai")
+        async with transcoded_file(
+            source_path, wire.container, 16000, list(wire.codec_args), start=start, duration=end - start
+        ) as audio_file:
+            return await self._openai_request(f"audio{wire.suffix}", audio_file, end - start)
+    
+    async def _google_segment(self, source_path: str, start: float, end: float) -> Dict[str, Any]:
+        """区間を切り出してGoogle Cloud Speech-to-Text APIで文字起こし"""
+        wire = self._segment_wire_format("google")
+        if end - start <= GOOGLE_STREAMING_MAX_SECONDS:
+            # 短い区間は変換しながらストリーミング認識に送る
+            async with aclosing(transcode_stream(
+                source_path, wire.container, 16000, list(wire.codec_args), start=start, duration=end - start
+            )) as chunks:
+                return await self._google_stream(chunks, wire.output, end - start)
+        async with transcoded_file(
+            source_path, wire.container, 16000, list(wire.codec_args), start=start, duration=end - start
+        ) as audio_file:
+            if await asyncio.to_thread(_file_size, audio_file) <= GOOGLE_INLINE_MAX_BYTES:
+                return await self._google_request(audio_file, wire.output, end - start)
+        return await self._google_split(source_path, start, end)
+    
+    async def _google_split(self, source_path: str, start: float, end: float) -> Dict[str, Any]:
+        """
+        リクエストに含められない大きさの区間を、ストリーミング認識で扱える長さに区切って順に文字起こし
+        
+        無音部分で分割できなかった長い録音のための予備の経路で、区切りは時間のみで決める。
+        """
+        results = []
+        position = start
+        while position < end:
+            piece_end = min(position + GOOGLE_STREAMING_MAX_SECONDS, end)
+            results.append((position - start, await self._google_segment(source_path, position, piece_end)))
+            position = piece_end
+        
+        texts = [r["transcription"] for _, r in results if r.get("transcription")]
+        return {
+            "transcription": "".join(texts),
+            # 無音の区切りは信頼度 0.0 になるため、テキストのある区切りのみで見る
+            "confidence": min((r.get("confidence", 0.0) for _, r in results if r.get("transcription")), default=0.0),
+            "model": "google-speech-to-text",
+            "language": "ja",
+            # 区切った位置を区間の先頭からの位置に変換
+            "segments": [
+                segment for offset, r in results for segment in shift_segments(r.get("segments"), offset)
+            ]
+        }
+    
+    def _google_accepts(self, audio_format: AudioFormat) -> bool:
+        """Google Speech-to-Textが変換なしで受け付ける形式か"""
+        if (audio_format.container, audio_format.codec) not in GOOGLE_ENCODINGS:
+            return False
+        if audio_format.codec == "opus":
+            return audio_format.sample_rate in GOOGLE_OPUS_SAMPLE_RATES
+        # FLAC/WAVはモノラルのみ（複数チャンネルは別途指定が必要なため変換する）
+        return audio_format.channels == 1
+    
+    def _select_wire_format(
+        self, audio_path: Path, source: Optional[AudioFormat], api_type: Optional[str] = None
+    ) -> Optional[WireFormat]:
+        """
+        プロバイダーへ送信する形式を選択
+        
+        Args:
+            audio_path: 音声ファイルのパス
+            source: 音声ファイルの形式（判定できない場合はNone）
+            api_type: 送信先のプロバイダー（省略した場合は設定のプロバイダー）
+        
+        Returns:
+            WireFormat: 変換後の形式（変換せずそのまま送信する場合はNone）
+        """
+        if (api_type or self.api_type) == "openai":
+            wire = OPENAI_WIRE_FORMAT
+            if wire in ("auto", "passthrough"):
+                if source is not None and source.container in WHISPER_ACCEPTED_CONTAINERS and (
+                    wire == "passthrough" or audio_path.stat().st_size <= WHISPER_MAX_UPLOAD_SIZE
+                ):
+                    return None
+                wire = "opus"
+        else:
+            wire = GOOGLE_WIRE_FORMAT
+            if source is not None and self._google_accepts(source):
+                return None
+        return WIRE_FORMATS[wire]
+    
+    @asynccontextmanager
+    async def _open_audio(
+        self, audio_file_path: str, audio_sha256: Optional[str] = None, api_type: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, BinaryIO, AudioFormat]]:
+        """
+        送信用の音声を (ファイル名, ファイルオブジェクト, 形式) として開く
 
+        実際の形式をマジックバイトから判定し、プロバイダーがそのまま受け付ける形式は変換しない。
+        それ以外は内容ハッシュがあれば正規化済みの音声（なければ作成して保存）を使い、
+        ハッシュがない場合はffmpegのパイプで16kHzモノラルに変換する。
+        変換結果は一時ファイル名を持たないため、API呼び出しが失敗しても残らない。
+        """
+        audio_path = Path(audio_file_path)
+        source = await asyncio.to_thread(sniff_format, audio_path)
+        wire = await asyncio.to_thread(self._select_wire_format, audio_path, source, api_type)
+        if wire is None:
+            audio_file = await asyncio.to_thread(open, audio_file_path, "rb")
+            try:
+                yield f"audio{source.suffix}", audio_file, source
+            finally:
+                audio_file.close()
+        elif audio_sha256:
+            try:
+                normalized_path = await audio_artifact_service.ensure_normalized(audio_file_path, audio_sha256, wire)
+            except TranscodeError as e:
+                raise Exception(f"Audio conversion failed: {str(e)}")
+            audio_file = await asyncio.to_thread(open, normalized_path, "rb")
+            try:
+                yield f"audio{wire.suffix}", audio_file, wire.output
+            finally:
+                audio_file.close()
+        else:
+            try:
+                async with transcoded_file(audio_file_path, wire.container, 16000, list(wire.codec_args)) as audio_file:
+                    yield f"audio{wire.suffix}", audio_file, wire.output
+            except TranscodeError as e:
+                raise Exception(f"Audio conversion failed: {str(e)}")
 
 # シングルトンインスタンス
 transcription_service = TranscriptionService()
\ No newline at end of file
@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import shutil
+import asyncio
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .audio_storage import UPLOAD_DIR, MAX_UPLOAD_SIZE, UPLOAD_CHUNK_SIZE, StoredFile, write_stream
+
+
+# 再開可能アップロードの設定（環境変数から）
+UPLOAD_SESSION_DIR = Path(os.getenv("UPLOAD_SESSION_DIR", str(UPLOAD_DIR / ".sessions")))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))  # 秒
+
+_SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_CHUNK_SUFFIX = ".chunk"
+
+
+class UploadSessionNotFound(Exception):
+    """セッションが存在しない、または期限切れの場合のエラー"""
+
+
+class UploadSessionIncomplete(Exception):
+    """チャンクが揃っていない状態で完了しようとした場合のエラー"""
+
+
+class UploadSessionService:
+    """
+    再開可能なチャンクアップロードのセッション管理
+
+    セッションの状態はディスク上に保存する:
+        UPLOAD_SESSION_DIR/<session_id>/meta.json
+        UPLOAD_SESSION_DIR/<session_id>/<index>.chunk
+    最終更新から UPLOAD_SESSION_TTL 秒経過したセッションは期限切れとして削除する。
+    """
+
+    def __init__(self, base_dir: Path = UPLOAD_SESSION_DIR, ttl: int = UPLOAD_SESSION_TTL,
+                 max_size: int = MAX_UPLOAD_SIZE):
+        self.base_dir = base_dir
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def _session_dir(self, session_id: str) -> Path:
+        if not _SESSION_ID_PATTERN.match(session_id):
+            raise UploadSessionNotFound(session_id)
+        return self.base_dir / session_id
+
+    def _chunk_path(self, session_dir: Path, index: int) -> Path:
+        return session_dir / f"{index:06d}{_CHUNK_SUFFIX}"
+
+    def _read_meta(self, session_dir: Path) -> Dict[str, Any]:
+        meta_path = session_dir / "meta.json"
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            raise UploadSessionNotFound(session_dir.name)
+        if time.time() - meta["updated_at"] > self.ttl:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            raise UploadSessionNotFound(session_dir.name)
+        return meta
+
+    def _write_meta(self, session_dir: Path, meta: Dict[str, Any]):
+        meta["updated_at"] = time.time()
+        # 複数のチャンクの受信が同時に更新しても互いの一時ファイルを置き換えないよう一意な名前にする
+        tmp_path = session_dir / f"meta.json.{uuid.uuid4().hex}.tmp"
+        try:
+            tmp_path.write_text(json.dumps(meta))
+            os.replace(tmp_path, session_dir / "meta.json")
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _received_chunks(self, session_dir: Path) -> Dict[int, int]:
+        """受信済みチャンクの {index: size} を返す"""
+        chunks = {}
+        for path in session_dir.glob(f"*{_CHUNK_SUFFIX}"):
+            chunks[int(path.stem)] = path.stat().st_size
+        return chunks
+
+    def _status(self, session_dir: Path, meta: Dict[str, Any]) -> Dict[str, Any]:
+        chunks = self._received_chunks(session_dir)
+
+        # 先頭から連続して受信済みのチャンク数とバイト数
+        next_chunk = 0
+        received_bytes = 0
+        while next_chunk in chunks:
+            received_bytes += chunks[next_chunk]
+            next_chunk += 1
+
+        return {
+            "session_id": meta["session_id"],
+            "filename": meta.get("filename"),
+            "content_type": meta.get("content_type"),
+            "total_size": meta.get("total_size"),
+            "received_chunks": sorted(chunks),
+            "next_chunk": next_chunk,
+            "received_bytes": received_bytes,
+            "expires_at": meta["updated_at"] + self.ttl,
+        }
+
+    def cleanup_expired(self) -> int:
+        """期限切れのセッションを削除し、削除件数を返す"""
+        if not self.base_dir.exists():
+            return 0
+
+        removed = 0
+        now = time.time()
+        for session_dir in self.base_dir.iterdir():
+            meta_path = session_dir / "meta.json"
+            try:
+                updated_at = json.loads(meta_path.read_text())["updated_at"]
+            except (FileNotFoundError, NotADirectoryError, KeyError, json.JSONDecodeError):
+                # メタ情報が壊れている場合はディレクトリの更新時刻で判定
+                updated_at = session_dir.stat().st_mtime
+            if now - updated_at > self.ttl:
+                shutil.rmtree(session_dir, ignore_errors=True)
+                removed += 1
+        return removed
+
+    async def create(self, content_type: str, filename: Optional[str] = None,
+                     total_size: Optional[int] = None) -> Dict[str, Any]:
+        """新しいアップロードセッションを作成"""
+        await asyncio.to_thread(self.cleanup_expired)
+
+        session_id = uuid.uuid4().hex
+        session_dir = self.base_dir / session_id
+        meta = {
+            "session_id": session_id,
+            "content_type": content_type,
+            "filename": filename,
+            "total_size": total_size,
+            "created_at": time.time(),
+        }
+
+        def _create():
+            session_dir.mkdir(parents=True)
+            self._write_meta(session_dir, meta)
+            return self._status(session_dir, meta)
+
+        return await asyncio.to_thread(_create)
+
+    async def get_status(self, session_id: str) -> Dict[str, Any]:
+        """セッションの受信状況を取得"""
+        session_dir = self._session_dir(session_id)
+
+        def _get():
+            return self._status(session_dir, self._read_meta(session_dir))
+
+        return await asyncio.to_thread(_get)
+
+    async def put_chunk(self, session_id: str, index: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        番号付きチャンクを保存する
+
+        同じ番号のチャンクを再送した場合は上書きする（リトライを冪等にするため）。
+        同じ番号の再送が同時に届いても、それぞれ一意な一時ファイルに書き込んでから置き換えるため
+        互いのデータが混ざらない（後に受信を終えたチャンクが残る）。
+
+        Raises:
+            UploadSessionNotFound: 受信中にセッションが期限切れ・破棄された場合も含む
+        """
+        session_dir = self._session_dir(session_id)
+        meta = await asyncio.to_thread(self._read_meta, session_dir)
+
+        # 他のチャンクと合わせてサイズ上限を超えないようにする
+        existing = await asyncio.to_thread(self._received_chunks, session_dir)
+        existing.pop(index, None)
+        remaining = self.max_size - sum(existing.values())
+
+        chunk_path = self._chunk_path(session_dir, index)
+        part_path = chunk_path.with_name(f"{chunk_path.name}.{uuid.uuid4().hex}.part")
+        try:
+            await write_stream(chunks, part_path, max_size=remaining)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(session_id)
+
+        def _commit():
+            try:
+                os.replace(part_path, chunk_path)
+                self._write_meta(session_dir, meta)
+            except FileNotFoundError:
+                raise UploadSessionNotFound(session_id)
+            finally:
+                part_path.unlink(missing_ok=True)
+            return self._status(session_dir, meta)
+
+        return await asyncio.to_thread(_commit)
+
+    async def complete(self, session_id: str, dest_path: Path) -> StoredFile:
+        """
+        受信済みチャンクを結合して最終ファイルを作成し、セッションを削除する
+
+        Raises:
+            UploadSessionIncomplete: チャンクに欠番がある、または宣言サイズと一致しない場合
+        """
+        session_dir = self._session_dir(session_id)
+        meta = await asyncio.to_thread(self._read_meta, session_dir)
+        status = await asyncio.to_thread(self._status, session_dir, meta)
+
+        if status["next_chunk"] == 0 or status["next_chunk"] != len(status["received_chunks"]):
+            raise UploadSessionIncomplete(f"missing chunk {status['next_chunk']}")
+        if meta.get("total_size") is not None and status["received_bytes"] != meta["total_size"]:
+            raise UploadSessionIncomplete(
+                f"received {status['received_bytes']} of {meta['total_size']} bytes"
+            )
+
+        chunk_paths: List[Path] = [self._chunk_path(session_dir, i) for i in range(status["next_chunk"])]
+
+        async def _iter_chunks() -> AsyncIterator[bytes]:
+            for chunk_path in chunk_paths:
+                f = await asyncio.to_thread(open, chunk_path, "rb")
+                try:
+                    while True:
+                        data = await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE)
+                        if not data:
+                            break
+                        yield data
+                finally:
+                    await asyncio.to_thread(f.close)
+
+        part_path = dest_path.with_name(dest_path.name + ".part")
+        stored = await write_stream(_iter_chunks(), part_path, max_size=self.max_size)
+        await asyncio.to_thread(os.replace, part_path, dest_path)
+        stored.path = dest_path
+
+        await asyncio.to_thread(shutil.rmtree, session_dir, True)
+        return stored
+
+    async def abort(self, session_id: str):
+        """セッションを破棄"""
+        session_dir = self._session_dir(session_id)
+        if not session_dir.exists():
+            raise UploadSessionNotFound(session_id)
+        await asyncio.to_thread(shutil.rmtree, session_dir, True)
+
+
+# シングルトンインスタンス
+upload_session_service = UploadSessionService()
@@ -104,6 +104,26 @@ class TestAudioEndpoints:
             assert "result" in data
             assert data["result"]["transcription"] == "モックの文字起こし結果です。"
             
+    @pytest.mark.asyncio
+    async def test_stream_endpoints_reject_stored_audio(self, async_client, diary_entry_factory, test_session):
+        """録音中でないエントリ（内容アドレスの共有音声）は録音の破棄・完了の対象にならないテスト"""
+        from app.models import DiaryEntry
+        
+        file_id = str(uuid4())
+        entry = diary_entry_factory(
+            file_id=file_id,
+            audio_file_path="/app/uploads/ab/cd/" + "ab" * 32 + ".webm",
+            audio_sha256="ab" * 32
+        )
+        
+        response = await async_client.delete(f"/api/audio/stream/{file_id}")
+        assert response.status_code == status.HTTP_409_CONFLICT
+        response = await async_client.post(f"/api/audio/stream/{file_id}/complete")
+        assert response.status_code == status.HTTP_409_CONFLICT
+        
+        test_session.expire_all()
+        assert test_session.get(DiaryEntry, entry.id) is not None
+
     @pytest.mark.asyncio
     async def test_transcribe_task_not_found(self, async_client):
         """存在しないタスクIDでの文字起こし結果取得テスト"""
@@ -152,6 +172,68 @@ class TestSummaryEndpoints:
             assert data["result"]["title"] == "モックのタイトル"
 
 
+@pytest.mark.integration
+class TestTaskStatusEndpoints:
+    """タスク状態の一括取得エンドポイントのテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_batch_task_status(self, async_client, diary_entry_factory):
+        """複数の文字起こし・要約タスクの状態をまとめて取得するテスト"""
+        first = diary_entry_factory(
+            transcription_task_id="t-1", transcription_status="completed",
+            summary_task_id="s-1", summary_status="processing"
+        )
+        second = diary_entry_factory(transcription_task_id="t-2", transcription_status="processing")
+        
+        response = await async_client.post("/api/tasks/status", json={
+            "transcription_task_ids": ["t-1", "t-2", "t-unknown"],
+            "summary_task_ids": ["s-1"]
+        })
+        assert response.status_code == status.HTTP_200_OK
+        
+        tasks = {(t["type"], t["task_id"]): t for t in response.json()["tasks"]}
+        assert tasks[("transcription", "t-1")]["status"] == "completed"
+        assert tasks[("transcription", "t-1")]["entry_id"] == str(first.id)
+        assert tasks[("transcription", "t-2")]["status"] == "processing"
+        assert tasks[("transcription", "t-2")]["entry_id"] == str(second.id)
+        assert tasks[("transcription", "t-unknown")]["status"] == "not_found"
+        assert tasks[("summary", "s-1")]["status"] == "processing"
+        
+    @pytest.mark.asyncio
+    async def test_batch_task_status_limit(self, async_client):
+        """一度に問い合わせできるタスク数の上限のテスト"""
+        from app.routers.tasks import TASK_STATUS_BATCH_LIMIT
+        
+        response = await async_client.post("/api/tasks/status", json={
+            "transcription_task_ids": [str(uuid4()) for _ in range(TASK_STATUS_BATCH_LIMIT + 1)]
+        })
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        
+    @pytest.mark.asyncio
+    async def test_reprocess_failed_entries_on_backfill_lane(self, async_client, diary_entry_factory, test_session):
+        """失敗したエントリの一括再処理で低優先度のジョブを登録するテスト"""
+        from types import SimpleNamespace
+        from app.main import app
+        from app.models import ProcessingJob
+        from app.routers.auth import get_current_user
+        
+        failed = diary_entry_factory(summary_status="failed")
+        diary_entry_factory(summary_status="completed")
+        
+        app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(is_admin=True)
+        response = await async_client.post("/api/tasks/reprocess", json={"stage": "summary"})
+        assert response.status_code == status.HTTP_200_OK
+        
+        tasks = response.json()["tasks"]
+        assert [t["entry_id"] for t in tasks] == [str(failed.id)]
+        job = test_session.query(ProcessingJob).filter(ProcessingJob.task_id == tasks[0]["task_id"]).one()
+        assert job.priority == "backfill"
+        
+        app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(is_admin=False)
+        response = await async_client.post("/api/tasks/reprocess", json={"stage": "summary"})
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
 @pytest.mark.integration
 class TestDiaryEndpoints:
     """日記関連エンドポイントのテスト"""
@@ -2,7 +2,7 @@ import pytest
 from datetime import datetime, timezone
 from uuid import uuid4
 
-from app.models import DiaryEntry, UserSettings
+from app.models import DiaryEntry, ProcessingJob, UserSettings
 
 
 @pytest.mark.unit
@@ -227,4 +227,39 @@ class TestUserSettings:
         ).all()
         
         assert len(provider_settings) == 1
-        assert provider_settings[0].key == "api_config"
\ No newline at end of file
+        assert provider_settings[0].key == "api_config"
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestProcessingJob:
+    """ProcessingJobモデルのテスト"""
+    
+    def test_create_job_defaults(self, test_session):
+        """ジョブ作成時の初期値テスト"""
+        entry = DiaryEntry(transcription_status="processing")
+        test_session.add(entry)
+        test_session.commit()
+        
+        job = ProcessingJob(stage="transcription", entry_id=entry.id, task_id=str(uuid4()))
+        test_session.add(job)
+        test_session.commit()
+        test_session.refresh(job)
+        
+        assert job.status == "queued"
+        assert job.attempts == 0
+        assert job.run_after is not None
+        assert job.lease_until is None
+        assert job.priority == "interactive"
+        
+    def test_job_deleted_with_entry(self, test_session):
+        """日記エントリの削除でジョブも削除されるテスト"""
+        entry = DiaryEntry(summary_status="processing")
+        test_session.add(entry)
+        test_session.commit()
+        test_session.add(ProcessingJob(stage="summary", entry_id=entry.id, task_id=str(uuid4())))
+        test_session.commit()
+        
+        test_session.delete(entry)
+        test_session.commit()
+        
+        assert test_session.query(ProcessingJob).count() == 0
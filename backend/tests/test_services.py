@@ -63,49 +63,6 @@ class TestTranscriptionService:
         with pytest.raises(FileNotFoundError):
             await service.transcribe_audio("non_existent_file.webm")
             
-    @pytest.mark.asyncio
-    @patch('app.services.transcription.TranscriptionService._convert_webm_to_wav')
-    async def test_convert_webm_to_wav_called(self, mock_convert):
-        """WebM→WAV変換の呼び出しテスト"""
-        service = TranscriptionService()
-        mock_convert.return_value = "/tmp/converted.wav"
-        
-        with tempfile.NamedTemporaryFile(suffix=".webm") as temp_file:
-            temp_file.write(b"dummy webm content")
-            temp_file.flush()
-            
-            # _mock_transcribeを直接実行してWebM変換をスキップ
-            await service._mock_transcribe(temp_file.name)
-            
-            # WebMファイルの場合は変換が呼び出されることを確認
-            # （実際のテストではmockを使用）
-            
-    def test_convert_webm_to_wav(self):
-        """WebM→WAV変換のテスト（ファイル操作のみ）"""
-        service = TranscriptionService()
-        
-        with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as input_file:
-            input_file.write(b"dummy webm content")
-            input_file.flush()
-            
-            try:
-                # 変換処理を実行（pydubがない場合はスキップ）
-                try:
-                    output_path = service._convert_webm_to_wav(input_file.name)
-                    assert output_path.endswith('.wav')
-                    # 変換されたファイルが存在することを確認
-                    assert os.path.exists(output_path)
-                    # クリーンアップ
-                    os.unlink(output_path)
-                except ImportError:
-                    # pydubがインストールされていない場合はスキップ
-                    pytest.skip("pydub not installed")
-                except Exception as e:
-                    # その他のエラー（ffmpegがない等）もスキップ
-                    pytest.skip(f"Audio conversion not available: {e}")
-            finally:
-                os.unlink(input_file.name)
-                
     @pytest.mark.asyncio
     @patch('openai.AsyncOpenAI')
     async def test_openai_transcribe(self, mock_openai):
@@ -278,4 +235,1906 @@ class TestSummaryService:
         for result in results:
             assert "summary" in result
             assert "title" in result
-            assert result["model"] == "mock"
\ No newline at end of file
+            assert result["model"] == "mock"
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestAudioStorage:
+    """音声ファイル保存処理のテスト"""
+    
+    @staticmethod
+    def _upload_file(content: bytes):
+        import io
+        from fastapi import UploadFile
+        return UploadFile(file=io.BytesIO(content), filename="test.webm")
+        
+    @pytest.mark.asyncio
+    async def test_save_upload_file_streams_and_hashes(self, tmp_path):
+        """チャンク単位で保存しSHA-256とサイズを計算するテスト"""
+        import hashlib
+        from app.services.audio_storage import save_upload_file
+        
+        content = b"\x1a\x45\xdf\xa3" + b"a" * 5000
+        dest = tmp_path / "audio.webm"
+        
+        stored = await save_upload_file(self._upload_file(content), dest, chunk_size=1024)
+        
+        assert stored.path == dest
+        assert stored.size == len(content)
+        assert stored.sha256 == hashlib.sha256(content).hexdigest()
+        assert dest.read_bytes() == content
+        assert not (tmp_path / "audio.webm.part").exists()
+        
+    @pytest.mark.asyncio
+    async def test_save_upload_file_too_large(self, tmp_path):
+        """サイズ上限超過時に中断し、途中のファイルを残さないテスト"""
+        from app.services.audio_storage import save_upload_file, UploadTooLargeError
+        
+        dest = tmp_path / "audio.webm"
+        with pytest.raises(UploadTooLargeError):
+            await save_upload_file(self._upload_file(b"a" * 5000), dest, max_size=2048, chunk_size=1024)
+        
+        assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestUploadSessionService:
+    """再開可能アップロードのセッション管理テスト"""
+    
+    @staticmethod
+    async def _stream(data: bytes):
+        yield data
+        
+    @pytest.mark.asyncio
+    async def test_chunked_upload_and_complete(self, tmp_path):
+        """チャンクの受信状況取得と結合のテスト"""
+        import hashlib
+        from app.services.upload_sessions import UploadSessionService
+        
+        service = UploadSessionService(base_dir=tmp_path / "sessions", ttl=60)
+        session = await service.create("audio/webm", total_size=6)
+        session_id = session["session_id"]
+        
+        # 順不同で受信しても先頭から連続した分だけが受信済みになる
+        status = await service.put_chunk(session_id, 1, self._stream(b"cd"))
+        assert status["next_chunk"] == 0
+        assert status["received_bytes"] == 0
+        
+        await service.put_chunk(session_id, 0, self._stream(b"ab"))
+        await service.put_chunk(session_id, 2, self._stream(b"ef"))
+        status = await service.get_status(session_id)
+        assert status["received_chunks"] == [0, 1, 2]
+        assert status["received_bytes"] == 6
+        
+        dest = tmp_path / "audio.webm"
+        stored = await service.complete(session_id, dest)
+        assert dest.read_bytes() == b"abcdef"
+        assert stored.sha256 == hashlib.sha256(b"abcdef").hexdigest()
+        assert not (tmp_path / "sessions" / session_id).exists()
+        
+    @pytest.mark.asyncio
+    async def test_complete_with_missing_chunk(self, tmp_path):
+        """欠番がある場合は完了できないテスト"""
+        from app.services.upload_sessions import UploadSessionService, UploadSessionIncomplete
+        
+        service = UploadSessionService(base_dir=tmp_path / "sessions", ttl=60)
+        session = await service.create("audio/webm")
+        await service.put_chunk(session["session_id"], 0, self._stream(b"ab"))
+        await service.put_chunk(session["session_id"], 2, self._stream(b"ef"))
+        
+        with pytest.raises(UploadSessionIncomplete):
+            await service.complete(session["session_id"], tmp_path / "audio.webm")
+            
+    @pytest.mark.asyncio
+    async def test_expired_session(self, tmp_path):
+        """TTLを過ぎたセッションが削除されるテスト"""
+        from app.services.upload_sessions import UploadSessionService, UploadSessionNotFound
+        
+        service = UploadSessionService(base_dir=tmp_path / "sessions", ttl=-1)
+        session = await service.create("audio/webm")
+        
+        with pytest.raises(UploadSessionNotFound):
+            await service.get_status(session["session_id"])
+        assert service.cleanup_expired() == 0
+        assert list((tmp_path / "sessions").iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_concurrent_retries_of_same_chunk(self, tmp_path):
+        """同じ番号のチャンクの再送が同時に届いてもデータが混ざらないテスト"""
+        from app.services.upload_sessions import UploadSessionService
+        
+        service = UploadSessionService(base_dir=tmp_path / "sessions", ttl=60)
+        session = await service.create("audio/webm")
+        session_id = session["session_id"]
+        
+        async def slow_stream(data: bytes):
+            for i in range(0, len(data), 2):
+                await asyncio.sleep(0)
+                yield data[i:i + 2]
+        
+        await asyncio.gather(
+            service.put_chunk(session_id, 0, slow_stream(b"a" * 10)),
+            service.put_chunk(session_id, 0, slow_stream(b"b" * 10)),
+        )
+        
+        chunk_files = sorted(p.name for p in (tmp_path / "sessions" / session_id).iterdir())
+        assert chunk_files == ["000000.chunk", "meta.json"]
+        assert (tmp_path / "sessions" / session_id / "000000.chunk").read_bytes() in (b"a" * 10, b"b" * 10)
+
+    @pytest.mark.asyncio
+    async def test_session_aborted_during_chunk_upload(self, tmp_path):
+        """チャンクの受信中にセッションが破棄された場合は UploadSessionNotFound になるテスト"""
+        from app.services.upload_sessions import UploadSessionService, UploadSessionNotFound
+        
+        service = UploadSessionService(base_dir=tmp_path / "sessions", ttl=60)
+        session = await service.create("audio/webm")
+        session_id = session["session_id"]
+        
+        async def aborting_stream():
+            yield b"ab"
+            await service.abort(session_id)
+            yield b"cd"
+        
+        with pytest.raises(UploadSessionNotFound):
+            await service.put_chunk(session_id, 0, aborting_stream())
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestRealtimeTranscriber:
+    """録音中の文字起こし（プログレッシブアップロード）のテスト"""
+    
+    HEADER = b"\x1a\x45\xdf\xa3" + b"h" * 60
+    
+    @staticmethod
+    def _cluster(timecode_ms: int, payload_size: int = 100) -> bytes:
+        """Timecode付きの最小限のClusterを生成（サイズは不定長）"""
+        timecode = timecode_ms.to_bytes(4, "big")
+        return b"\x1f\x43\xb6\x75" + b"\x01\xff\xff\xff\xff\xff\xff\xff" + b"\xe7\x84" + timecode + b"\xa3" * payload_size
+        
+    @staticmethod
+    async def _stream(data: bytes):
+        yield data
+        
+    def test_find_clusters(self):
+        """Clusterのオフセットとタイムコード検出のテスト"""
+        from app.services.realtime_transcription import find_clusters
+        
+        data = self.HEADER + self._cluster(0) + self._cluster(5000)
+        clusters = find_clusters(data, base_offset=10)
+        
+        cluster_size = len(self._cluster(0))
+        assert clusters == [
+            (10 + len(self.HEADER), 0),
+            (10 + len(self.HEADER) + cluster_size, 5000),
+        ]
+        
+    @pytest.mark.asyncio
+    async def test_windows_transcribed_while_recording(self, tmp_path):
+        """一定時間分のクラスタがたまるごとに文字起こしされ、完了時に結合されるテスト"""
+        from app.services.realtime_transcription import RealtimeTranscriber, SegmentOutOfOrder
+        
+        transcribed = []
+        
+        async def fake_transcribe(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            # ウィンドウはヘッダから始まる単体のWebMになっている
+            assert data.startswith(self.HEADER)
+            transcribed.append(path)
+            return {"transcription": f"[{len(transcribed)}]", "confidence": 0.9, "model": "mock", "language": "ja"}
+        
+        audio_path = tmp_path / "audio.webm"
+        transcriber = RealtimeTranscriber(window_seconds=10)
+        transcriber.start(audio_path, realtime=True)
+        
+        data = self.HEADER + b"".join(self._cluster(t * 1000) for t in range(0, 25, 5))
+        segments = [data[i:i + 150] for i in range(0, len(data), 150)]
+        
+        with patch("app.services.realtime_transcription.transcription_service.transcribe_audio", side_effect=fake_transcribe):
+            for seq, segment in enumerate(segments):
+                status = await transcriber.append_segment(audio_path, seq, self._stream(segment))
+            # 0-10秒、10-20秒の2ウィンドウが録音中に切り出される
+            assert status["windows"] == 2
+            
+            # 再送は無視、番号飛びはエラー
+            await transcriber.append_segment(audio_path, 0, self._stream(b"dup"))
+            with pytest.raises(SegmentOutOfOrder):
+                await transcriber.append_segment(audio_path, len(segments) + 1, self._stream(b"x"))
+            
+            result = await transcriber.finish(audio_path)
+        
+        assert audio_path.read_bytes() == data
+        assert len(transcribed) == 3
+        assert result["transcription"].count("[") == 3
+        assert not (tmp_path / "audio.webm.rt").exists()
+        
+    @pytest.mark.asyncio
+    async def test_failed_finish_can_be_retried(self, tmp_path):
+        """完了時の文字起こしに失敗しても作業ディレクトリを残し、再試行で失敗したウィンドウから再開するテスト"""
+        from app.services.realtime_transcription import RealtimeTranscriber
+        
+        calls = []
+        failures = 2
+        
+        async def flaky_transcribe(path):
+            nonlocal failures
+            calls.append(path)
+            # 2つ目のウィンドウは2回失敗する（録音中と完了時の再実行）
+            if path.endswith("window_0001.webm") and failures:
+                failures -= 1
+                raise RuntimeError("provider error")
+            return {"transcription": "[ok]", "confidence": 0.9, "model": "mock", "language": "ja"}
+        
+        audio_path = tmp_path / "audio.webm"
+        transcriber = RealtimeTranscriber(window_seconds=10)
+        transcriber.start(audio_path, realtime=True)
+        data = self.HEADER + b"".join(self._cluster(t * 1000) for t in range(0, 25, 5))
+        
+        with patch("app.services.realtime_transcription.transcription_service.transcribe_audio", side_effect=flaky_transcribe):
+            await transcriber.append_segment(audio_path, 0, self._stream(data))
+            with pytest.raises(RuntimeError):
+                await transcriber.finish(audio_path)
+            assert (tmp_path / "audio.webm.rt").exists()
+            result = await transcriber.finish(audio_path)
+        
+        # 文字起こし済みのウィンドウは再実行しない
+        names = [os.path.basename(c) for c in calls]
+        assert names.count("window_0000.webm") == 1
+        assert names.count("window_0001.webm") == 3
+        assert names.count("window_0002.webm") == 1
+        assert result["transcription"] == "[ok][ok][ok]"
+        assert not (tmp_path / "audio.webm.rt").exists()
+        
+    @pytest.mark.asyncio
+    async def test_abandoned_recordings_cleaned_up(self, tmp_path):
+        """期限切れの放棄された録音は作業ディレクトリ・音声・実行中のウィンドウごと削除するテスト"""
+        from app.services.realtime_transcription import RealtimeTranscriber
+        
+        transcriber = RealtimeTranscriber(ttl=60)
+        old_path, new_path = tmp_path / "old.webm", tmp_path / "new.webm"
+        transcriber.start(old_path, realtime=True)
+        transcriber.start(new_path, realtime=True)
+        stale = (tmp_path / "old.webm.rt" / "state.json").stat().st_mtime - 120
+        os.utime(tmp_path / "old.webm.rt" / "state.json", (stale, stale))
+        task = asyncio.create_task(asyncio.sleep(10))
+        transcriber._tasks[f"{old_path}:0"] = task
+        
+        removed = await transcriber.cleanup_expired(tmp_path)
+        
+        assert removed == [old_path]
+        assert not old_path.exists()
+        assert not (tmp_path / "old.webm.rt").exists()
+        assert new_path.exists()
+        assert (tmp_path / "new.webm.rt").exists()
+        assert transcriber._tasks == {}
+        await asyncio.sleep(0)
+        assert task.cancelled()
+        
+    @pytest.mark.asyncio
+    async def test_window_claimed_by_other_process_is_awaited(self, tmp_path):
+        """別プロセスが文字起こし中のウィンドウは再実行せずに結果を待つテスト"""
+        import json
+        from app.services.realtime_transcription import RealtimeTranscriber
+        
+        audio_path = tmp_path / "audio.webm"
+        work_dir = tmp_path / "audio.webm.rt"
+        work_dir.mkdir()
+        (work_dir / "window_0000.webm").write_bytes(self.HEADER)
+        # 別プロセスが文字起こし中（実行中の印が新しい）
+        (work_dir / "window_0000.running").touch()
+        
+        async def other_process():
+            await asyncio.sleep(0.05)
+            (work_dir / "window_0000.json").write_text(json.dumps({"transcription": "other", "confidence": 0.9}))
+            (work_dir / "window_0000.running").unlink()
+        
+        transcribe = AsyncMock()
+        with patch("app.services.realtime_transcription.transcription_service.transcribe_audio", transcribe), \
+             patch("app.services.realtime_transcription.REALTIME_WINDOW_POLL_SECONDS", 0.01):
+            writer = asyncio.create_task(other_process())
+            result = await RealtimeTranscriber()._window_result(audio_path, 0)
+            await writer
+        
+        assert result["transcription"] == "other"
+        transcribe.assert_not_called()
+        
+    @pytest.mark.asyncio
+    async def test_stale_window_claim_is_taken_over(self, tmp_path):
+        """更新されなくなった実行中の印（停止したプロセス）は引き継いで文字起こしするテスト"""
+        from app.services.realtime_transcription import RealtimeTranscriber, REALTIME_WINDOW_STALE_SECONDS
+        
+        audio_path = tmp_path / "audio.webm"
+        work_dir = tmp_path / "audio.webm.rt"
+        work_dir.mkdir()
+        (work_dir / "window_0000.webm").write_bytes(self.HEADER)
+        marker = work_dir / "window_0000.running"
+        marker.touch()
+        stale = marker.stat().st_mtime - REALTIME_WINDOW_STALE_SECONDS - 1
+        os.utime(marker, (stale, stale))
+        
+        transcribe = AsyncMock(return_value={"transcription": "retaken", "confidence": 0.9})
+        with patch("app.services.realtime_transcription.transcription_service.transcribe_audio", transcribe):
+            result = await RealtimeTranscriber()._window_result(audio_path, 0)
+        
+        assert result["transcription"] == "retaken"
+        transcribe.assert_called_once()
+        assert not marker.exists()
+        assert (work_dir / "window_0000.json").exists()
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestAudioProbe:
+    """コンテナヘッダからの録音時間取得テスト"""
+    
+    @staticmethod
+    def _ebml(element_id: int, payload: bytes, unknown_size: bool = False) -> bytes:
+        id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+        size = b"\x01\xff\xff\xff\xff\xff\xff\xff" if unknown_size else (0x10000000 | len(payload)).to_bytes(4, "big")
+        return id_bytes + size + payload
+        
+    def _webm(self, info: bytes, clusters: bytes) -> bytes:
+        return (
+            self._ebml(0x1A45DFA3, b"\x42\x82\x84webm")
+            + self._ebml(0x18538067, self._ebml(0x1549A966, info) + clusters, unknown_size=True)
+        )
+        
+    def test_wav_duration(self, tmp_path):
+        """WAVのdataチャンクとバイトレートから求めるテスト"""
+        import wave
+        from app.services.audio_probe import probe_duration
+        
+        path = tmp_path / "audio.wav"
+        with wave.open(str(path), "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes(b"\x00\x00" * 16000 * 3)
+        
+        assert probe_duration(path) == pytest.approx(3.0)
+        
+    def test_webm_duration_from_info(self, tmp_path):
+        """Segment InfoのDurationから求めるテスト"""
+        import struct
+        from app.services.audio_probe import probe_duration
+        
+        info = self._ebml(0x2AD7B1, (1_000_000).to_bytes(3, "big")) + self._ebml(0x4489, struct.pack(">d", 12500.0))
+        path = tmp_path / "audio.webm"
+        path.write_bytes(self._webm(info, b""))
+        
+        assert probe_duration(path) == pytest.approx(12.5)
+        
+    def test_webm_duration_without_info_duration(self, tmp_path):
+        """MediaRecorder形式（Durationなし）は最後のブロックから求めるテスト"""
+        from app.services.audio_probe import probe_duration
+        
+        def cluster(timecode: int, block_offsets):
+            payload = self._ebml(0xE7, timecode.to_bytes(2, "big"))
+            for offset in block_offsets:
+                payload += self._ebml(0xA3, b"\x81" + offset.to_bytes(2, "big") + b"\x80" + b"\x00" * 40)
+            return self._ebml(0x1F43B675, payload, unknown_size=True)
+        
+        clusters = cluster(0, [0, 5000]) + cluster(10000, [0, 1000, 2480])
+        path = tmp_path / "audio.webm"
+        path.write_bytes(self._webm(b"", clusters))
+        
+        assert probe_duration(path) == pytest.approx(12.5)
+        
+    def test_ogg_opus_duration(self, tmp_path):
+        """Ogg Opusの最終ページのgranule positionから求めるテスト"""
+        import struct
+        from app.services.audio_probe import probe_duration
+        
+        def page(granule: int, packet: bytes) -> bytes:
+            return b"OggS\x00\x02" + struct.pack("<q", granule) + b"\x00" * 12 + bytes([1, len(packet)]) + packet
+        
+        opus_head = b"OpusHead\x01\x01" + struct.pack("<H", 312) + struct.pack("<I", 48000) + b"\x00\x00\x00"
+        path = tmp_path / "audio.ogg"
+        path.write_bytes(page(0, opus_head) + page(48000 * 20 + 312, b"\x00" * 50))
+        
+        assert probe_duration(path) == pytest.approx(20.0)
+        
+    def test_mp3_cbr_duration(self, tmp_path):
+        """CBRのMP3はビットレートとサイズから求めるテスト"""
+        from app.services.audio_probe import probe_duration
+        
+        # MPEG1 Layer III, 128kbps, 44.1kHz
+        frame_header = b"\xff\xfb\x90\x00"
+        path = tmp_path / "audio.mp3"
+        path.write_bytes(frame_header + b"\x00" * (16000 * 15 - 4))
+        
+        assert probe_duration(path) == pytest.approx(15.0)
+        
+    def test_unknown_format(self, tmp_path):
+        """不明な形式はNoneを返すテスト"""
+        from app.services.audio_probe import probe_duration
+        
+        path = tmp_path / "audio.bin"
+        path.write_bytes(b"not audio" * 100)
+        assert probe_duration(path) is None
+        assert probe_duration(tmp_path / "missing.webm") is None
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestContentAddressedStorage:
+    """内容アドレスによる音声保存のテスト"""
+    
+    def test_blob_path_is_sharded_by_hash(self):
+        """ハッシュの先頭でディレクトリを分割するテスト"""
+        from app.services.audio_storage import AUDIO_OBJECT_DIR, blob_path
+        
+        sha256 = "abcdef" + "0" * 58
+        assert blob_path(sha256) == AUDIO_OBJECT_DIR / "ab" / "cd" / f"{sha256}.webm"
+        
+    def test_identical_content_is_stored_once(self, tmp_path):
+        """同じ内容のファイルは1つだけ保存されるテスト"""
+        from app.services.audio_storage import _move_into_store, hash_file
+        
+        first = tmp_path / "first.webm"
+        second = tmp_path / "second.webm"
+        first.write_bytes(b"same audio")
+        second.write_bytes(b"same audio")
+        assert hash_file(first).sha256 == hash_file(second).sha256
+        
+        dest = tmp_path / "objects" / "ab" / "cd" / "hash.webm"
+        assert _move_into_store(first, dest) is True
+        assert _move_into_store(second, dest) is False
+        
+        assert dest.read_bytes() == b"same audio"
+        assert not first.exists()
+        assert not second.exists()
+        
+    def test_purge_rechecks_ref_count(self, tmp_path):
+        """参照がなくなった後に同じ内容が再び参照された場合は、ファイルを削除しないテスト"""
+        from types import SimpleNamespace
+        from app.services import audio_storage
+        
+        sha256 = "ab" * 32
+        blob = tmp_path / f"{sha256}.webm"
+        blob.write_bytes(b"audio")
+        db = MagicMock()
+        
+        # release_blob のコミット後に acquire_blob された
+        db.execute.return_value.first.return_value = SimpleNamespace(path=str(blob), ref_count=1)
+        assert audio_storage.purge_blob(db, sha256) is False
+        assert blob.exists()
+        db.commit.assert_not_called()
+        
+        db.execute.return_value.first.return_value = SimpleNamespace(path=str(blob), ref_count=0)
+        assert audio_storage.purge_blob(db, sha256) is True
+        assert not blob.exists()
+        db.commit.assert_called_once()
+        
+    @pytest.mark.asyncio
+    async def test_stored_file_removed_on_rollback(self, tmp_path):
+        """参照カウントの更新がロールバックされた場合は、格納したファイルを削除するテスト"""
+        from sqlalchemy.orm import Session
+        from app.services import audio_storage
+        from app.services.audio_storage import StoredFile
+        
+        src = tmp_path / "upload.webm"
+        src.write_bytes(b"audio")
+        sha256 = "cd" * 32
+        db = Session()
+        
+        with patch.object(audio_storage, "AUDIO_OBJECT_DIR", tmp_path / "objects"), \
+                patch.object(db, "execute"), \
+                patch.object(audio_storage, "SessionLocal", MagicMock()), \
+                patch.object(audio_storage, "purge_blob") as purge:
+            dest = await audio_storage.acquire_blob(db, StoredFile(path=src, size=5, sha256=sha256))
+            assert dest.exists()
+            
+            db.dispatch.after_rollback(db)
+            db.dispatch.after_rollback(db)
+        
+        purge.assert_called_once()
+        assert purge.call_args.args[1:] == (sha256, dest)
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestAudioWorkerPool:
+    """音声処理ワーカープールのテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_run_in_worker_process(self):
+        """ワーカープロセスで関数を実行できるテスト"""
+        import operator
+        from app.services.audio_workers import AudioWorkerPool
+        
+        pool = AudioWorkerPool(max_workers=2, timeout=30)
+        try:
+            results = await asyncio.gather(*[pool.run(operator.mul, i, i) for i in range(4)])
+            assert results == [0, 1, 4, 9]
+        finally:
+            pool.shutdown()
+            
+    @pytest.mark.asyncio
+    async def test_timeout_stops_job_and_pool_recovers(self):
+        """タイムアウトしたジョブを停止し、次のジョブは新しいプールで実行されるテスト"""
+        import operator
+        import time
+        from app.services.audio_workers import AudioWorkerPool, AudioJobTimeout
+        
+        pool = AudioWorkerPool(max_workers=1, timeout=30)
+        try:
+            with pytest.raises(AudioJobTimeout):
+                await pool.run(time.sleep, 30, timeout=1)
+            assert await pool.run(operator.add, 1, 2) == 3
+        finally:
+            pool.shutdown()
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestAudioTranscode:
+    """ffmpegパイプ変換のテスト（ffmpegの代わりにシェルスクリプトを使用）"""
+    
+    def _fake_ffmpeg(self, tmp_path, body):
+        script = tmp_path / "ffmpeg"
+        script.write_text("#!/bin/sh\n" + body + "\n")
+        script.chmod(0o755)
+        return str(script)
+        
+    @pytest.mark.asyncio
+    async def test_transcode_stream_yields_output(self, tmp_path):
+        """ffmpegの出力がチャンク単位で返されるテスト"""
+        from app.services import audio_transcode
+        
+        with patch.object(audio_transcode, "FFMPEG_BINARY", self._fake_ffmpeg(tmp_path, "printf 'abc'; printf 'def'")):
+            chunks = [c async for c in audio_transcode.transcode_stream(str(tmp_path / "in.webm"))]
+        assert b"".join(chunks) == b"abcdef"
+        
+    @pytest.mark.asyncio
+    async def test_transcode_failure_raises(self, tmp_path):
+        """ffmpegが異常終了した場合にエラーとなるテスト"""
+        from app.services import audio_transcode
+        
+        with patch.object(audio_transcode, "FFMPEG_BINARY", self._fake_ffmpeg(tmp_path, "echo broken >&2; exit 1")):
+            with pytest.raises(audio_transcode.TranscodeError, match="broken"):
+                async with audio_transcode.transcoded_file(str(tmp_path / "in.webm")):
+                    pass
+                    
+    @pytest.mark.asyncio
+    async def test_transcode_timeout_kills_process(self, tmp_path):
+        """タイムアウト時にffmpegプロセスを停止するテスト"""
+        from app.services import audio_transcode
+        
+        pid_file = tmp_path / "pid"
+        script = self._fake_ffmpeg(tmp_path, f"echo $$ > {pid_file}; exec sleep 30")
+        with patch.object(audio_transcode, "FFMPEG_BINARY", script):
+            with pytest.raises(audio_transcode.TranscodeError, match="timed out"):
+                async for _ in audio_transcode.transcode_stream(str(tmp_path / "in.webm"), timeout=1):
+                    pass
+        pid = int(pid_file.read_text())
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+            
+    @pytest.mark.asyncio
+    async def test_wav_header_sizes_are_fixed(self, tmp_path):
+        """パイプ出力のWAVヘッダのサイズ欄が補正されるテスト"""
+        import struct
+        from app.services import audio_transcode
+        
+        # サイズ欄が未確定（0xFFFFFFFF）のWAVを出力
+        header = (b"RIFF\\377\\377\\377\\377WAVEfmt \\020\\000\\000\\000" + b"\\000" * 16
+                  + b"data\\377\\377\\377\\377")
+        script = self._fake_ffmpeg(tmp_path, f"printf '{header.decode()}'; printf '%0100d' 0")
+        with patch.object(audio_transcode, "FFMPEG_BINARY", script):
+            async with audio_transcode.transcoded_file(str(tmp_path / "in.webm"), "wav") as f:
+                data = f.read()
+        assert len(data) == 144
+        assert struct.unpack("<I", data[4:8])[0] == 136
+        assert struct.unpack("<I", data[40:44])[0] == 100
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestWireFormatSelection:
+    """プロバイダーへの送信形式選択のテスト"""
+    
+    def _service(self, api_type):
+        service = TranscriptionService()
+        service.api_type = api_type
+        return service
+        
+    def test_openai_passthrough_for_accepted_format(self, tmp_path):
+        """Whisperが受け付ける形式は変換しないテスト"""
+        from app.services.audio_probe import AudioFormat
+        
+        audio_path = tmp_path / "recording.webm"
+        audio_path.write_bytes(b"\x00" * 1024)
+        service = self._service("openai")
+        assert service._select_wire_format(audio_path, AudioFormat("webm", "opus", 48000, 1)) is None
+        assert service._select_wire_format(audio_path, AudioFormat("mp4", "aac", 44100, 1)) is None
+        
+    def test_openai_unknown_or_large_file_is_compressed(self, tmp_path):
+        """判定できない形式・上限を超えるファイルはOpusに変換するテスト"""
+        from app.services import transcription
+        from app.services.audio_probe import AudioFormat
+        
+        audio_path = tmp_path / "recording.webm"
+        audio_path.write_bytes(b"\x00" * 1024)
+        service = self._service("openai")
+        assert service._select_wire_format(audio_path, None).name == "opus"
+        with patch.object(transcription, "WHISPER_MAX_UPLOAD_SIZE", 512):
+            wire = service._select_wire_format(audio_path, AudioFormat("webm", "opus", 48000, 1))
+        assert wire.name == "opus"
+        
+    def test_openai_explicit_format(self, tmp_path):
+        """明示的に指定した形式で変換するテスト"""
+        from app.services import transcription
+        from app.services.audio_probe import AudioFormat
+        
+        audio_path = tmp_path / "recording.webm"
+        audio_path.write_bytes(b"\x00" * 1024)
+        with patch.object(transcription, "OPENAI_WIRE_FORMAT", "flac"):
+            wire = self._service("openai")._select_wire_format(audio_path, AudioFormat("webm", "opus", 48000, 1))
+        assert wire.name == "flac"
+            
+    def test_google_passthrough_or_flac(self, tmp_path):
+        """Googleが受け付ける形式はそのまま、それ以外はFLACに変換するテスト"""
+        from app.services.audio_probe import AudioFormat
+        
+        audio_path = tmp_path / "recording"
+        service = self._service("google")
+        assert service._select_wire_format(audio_path, AudioFormat("webm", "opus", 48000, 1)) is None
+        assert service._select_wire_format(audio_path, AudioFormat("flac", "flac", 16000, 1)) is None
+        assert service._select_wire_format(audio_path, AudioFormat("mp4", "aac", 44100, 1)).name == "flac"
+        assert service._select_wire_format(audio_path, AudioFormat("wav", "pcm", 44100, 2)).name == "flac"
+        assert service._select_wire_format(audio_path, None).name == "flac"
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestAudioFormatSniffing:
+    """マジックバイトによる形式判定のテスト"""
+    
+    def test_sniff_wav(self, tmp_path):
+        """WAVのコーデック・サンプルレート・チャンネル数を判定するテスト"""
+        import wave
+        from app.services.audio_probe import sniff_format
+        
+        path = tmp_path / "audio.webm"  # 拡張子は判定に使わない
+        with wave.open(str(path), "wb") as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            w.writeframes(b"\x00\x00" * 100)
+        
+        audio_format = sniff_format(path)
+        assert (audio_format.container, audio_format.codec) == ("wav", "pcm")
+        assert (audio_format.sample_rate, audio_format.channels) == (44100, 2)
+        assert audio_format.media_type == "audio/wav"
+        
+    def test_sniff_ogg_opus(self, tmp_path):
+        """Ogg Opusを判定するテスト"""
+        import struct
+        from app.services.audio_probe import sniff_format
+        
+        opus_head = b"OpusHead" + bytes([1, 1]) + struct.pack("<HIh", 312, 48000, 0) + b"\x00"
+        page = b"OggS\x00\x02" + b"\x00" * 20 + bytes([1, len(opus_head)]) + opus_head
+        path = tmp_path / "audio.bin"
+        path.write_bytes(page)
+        
+        audio_format = sniff_format(path)
+        assert (audio_format.container, audio_format.codec) == ("ogg", "opus")
+        assert (audio_format.sample_rate, audio_format.channels) == (48000, 1)
+        assert audio_format.suffix == ".ogg"
+        
+    def test_sniff_m4a(self, tmp_path):
+        """moovが末尾にあるM4Aのコーデックと長さを判定するテスト"""
+        import struct
+        from app.services.audio_probe import probe_duration, sniff_format
+        
+        def box(box_type, payload):
+            return struct.pack(">I", 8 + len(payload)) + box_type + payload
+        
+        mvhd = box(b"mvhd", b"\x00" * 4 + struct.pack(">IIII", 0, 0, 1000, 15000) + b"\x00" * 80)
+        mp4a = box(b"mp4a", b"\x00" * 6 + struct.pack(">H", 1) + b"\x00" * 8
+                   + struct.pack(">HHHHI", 1, 16, 0, 0, 44100 << 16))
+        moov = box(b"moov", mvhd + box(b"trak", box(b"stsd", mp4a)))
+        path = tmp_path / "audio.webm"
+        path.write_bytes(box(b"ftyp", b"M4A \x00\x00\x00\x00") + box(b"mdat", b"\x00" * 1000) + moov)
+        
+        audio_format = sniff_format(path)
+        assert (audio_format.container, audio_format.codec) == ("mp4", "aac")
+        assert (audio_format.sample_rate, audio_format.channels) == (44100, 1)
+        assert (audio_format.suffix, audio_format.media_type) == (".m4a", "audio/mp4")
+        assert probe_duration(path) == pytest.approx(15.0)
+        
+    def test_sniff_unknown(self, tmp_path):
+        """未対応の形式はNoneを返すテスト"""
+        from app.services.audio_probe import sniff_format
+        
+        path = tmp_path / "audio.webm"
+        path.write_bytes(b"not audio content")
+        assert sniff_format(path) is None
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestAudioArtifactService:
+    """正規化済み音声の管理のテスト（ffmpegの代わりにシェルスクリプトを使用）"""
+    
+    @pytest.mark.asyncio
+    async def test_normalized_audio_is_created_once(self, tmp_path):
+        """同時に要求されても変換は1回だけで、以降は保存済みのファイルを使うテスト"""
+        from app.services import audio_storage, audio_transcode
+        from app.services.audio_artifacts import AudioArtifactService
+        from app.services.audio_transcode import WIRE_FORMATS
+        
+        runs = tmp_path / "runs"
+        script = tmp_path / "ffmpeg"
+        script.write_text(f"#!/bin/sh\necho run >> {runs}\nsleep 0.2\nprintf 'fLaC-normalized'\n")
+        script.chmod(0o755)
+        sha256 = "ab" * 32
+        
+        service = AudioArtifactService()
+        with patch.object(audio_storage, "AUDIO_OBJECT_DIR", tmp_path / "objects"), \
+                patch.object(audio_transcode, "FFMPEG_BINARY", str(script)):
+            paths = await asyncio.gather(*[
+                service.ensure_normalized(str(tmp_path / "in.webm"), sha256, WIRE_FORMATS["flac"]) for _ in range(3)
+            ])
+            again = await service.ensure_normalized(str(tmp_path / "in.webm"), sha256, WIRE_FORMATS["flac"])
+        
+        assert len(set(paths)) == 1 and again == paths[0]
+        assert paths[0] == tmp_path / "objects" / "ab" / "ab" / f"{sha256}.norm.flac"
+        assert paths[0].read_bytes() == b"fLaC-normalized"
+        assert runs.read_text().count("run") == 1
+        assert not list(paths[0].parent.glob("*.part"))
+        
+    def test_remove_blob_files_removes_artifacts(self, tmp_path):
+        """blobの削除時に正規化済み音声も削除されるテスト"""
+        from app.services import audio_storage
+        
+        sha256 = "cd" * 32
+        with patch.object(audio_storage, "AUDIO_OBJECT_DIR", tmp_path / "objects"):
+            blob = audio_storage.blob_path(sha256)
+            artifact = audio_storage.artifact_path(sha256, "norm", ".flac")
+            other = audio_storage.blob_path("cd" * 31 + "ef")
+            for path in (blob, artifact, other):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(b"data")
+            
+            audio_storage.remove_blob_files(sha256, blob)
+        
+        assert not blob.exists()
+        assert not artifact.exists()
+        assert other.exists()
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestVoiceActivitySegmentation:
+    """無音部分での区間分割のテスト"""
+    
+    def _mask(self, pattern):
+        """[(発話か, 秒数)] からフレームごとのマスクを作成"""
+        import numpy as np
+        from app.services.audio_vad import VAD_FRAME_SECONDS
+        
+        return np.concatenate([
+            np.full(int(round(seconds / VAD_FRAME_SECONDS)), speech) for speech, seconds in pattern
+        ])
+        
+    def test_energy_detects_speech(self):
+        """音量の大きいフレームを発話と判定するテスト"""
+        import numpy as np
+        from app.services.audio_vad import frame_energies_db, speech_mask
+        
+        t = np.arange(16000) / 16000
+        tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+        silence = np.zeros(16000, dtype=np.int16)
+        mask = speech_mask(frame_energies_db(np.concatenate([silence, tone, silence])))
+        
+        assert not mask[:30].any()
+        assert mask[35:60].all()
+        assert not mask[70:].any()
+        
+    def test_short_recording_is_single_segment(self):
+        """上限以下の録音は分割しないテスト"""
+        from app.services.audio_vad import plan_segments
+        
+        mask = self._mask([(True, 10), (False, 1), (True, 10)])
+        assert plan_segments(mask, 60) == [(0.0, pytest.approx(21.0, abs=0.1))]
+        
+    def test_split_at_latest_silence_within_limit(self):
+        """上限内で最も遅い無音の中央で区切るテスト"""
+        from app.services.audio_vad import plan_segments
+        
+        mask = self._mask([(True, 20), (False, 2), (True, 25), (False, 2), (True, 20), (False, 0.3), (True, 20)])
+        segments = plan_segments(mask, 60)
+        
+        assert segments[0] == (0.0, pytest.approx(48.0, abs=0.1))
+        assert all(end - start <= 60 for start, end in segments)
+        assert segments[-1][1] == pytest.approx(89.3, abs=0.1)
+        
+    def test_hard_cut_without_silence_and_skip_silent_segments(self):
+        """無音がない場合は上限で区切り、発話のない区間は除外するテスト"""
+        from app.services.audio_vad import plan_segments
+        
+        mask = self._mask([(True, 90), (False, 70)])
+        segments = plan_segments(mask, 60)
+        
+        assert segments[0] == (0.0, pytest.approx(60.0, abs=0.1))
+        assert segments[1][0] == pytest.approx(60.0, abs=0.1)
+        assert len(segments) == 2
+        
+    @pytest.mark.asyncio
+    async def test_segments_are_stitched_in_order(self, tmp_path):
+        """区間ごとの結果が開始位置の順に結合されるテスト"""
+        from contextlib import asynccontextmanager
+        from app.services import transcription
+        
+        service = TranscriptionService()
+        service.api_type = "openai"
+        segments = [(0.0, 50.0), (50.0, 110.0), (110.0, 130.0)]
+        
+        @asynccontextmanager
+        async def fake_transcoded_file(src, container, rate, codec_args, start=None, duration=None):
+            yield start
+            
+        async def fake_request(filename, start, duration=None):
+            # 後の区間ほど早く完了させる
+            await asyncio.sleep((130 - start) / 1000)
+            return {"transcription": f"[{int(start)}]", "confidence": 0.9, "model": "whisper-1", "language": "ja"}
+        
+        with patch.object(transcription, "transcoded_file", fake_transcoded_file), \
+                patch.object(service, "_openai_request", side_effect=fake_request):
+            result = await service._transcribe_segments(str(tmp_path / "in.webm"), None, segments)
+        
+        assert result["transcription"] == "[0][50][110]"
+        
+    @pytest.mark.asyncio
+    async def test_progress_reports_contiguous_prefix(self, tmp_path):
+        """区間の完了ごとに進捗と、先頭から続けて完了した区間のテキストを通知するテスト"""
+        from contextlib import asynccontextmanager
+        from app.services import transcription
+        
+        service = TranscriptionService()
+        service.api_type = "openai"
+        segments = [(0.0, 50.0), (50.0, 110.0), (110.0, 130.0)]
+        reports = []
+        
+        @asynccontextmanager
+        async def fake_transcoded_file(src, container, rate, codec_args, start=None, duration=None):
+            yield start
+            
+        async def fake_request(filename, start, duration=None):
+            # 後の区間ほど早く完了させる
+            await asyncio.sleep((130 - start) / 1000)
+            return {"transcription": f"[{int(start)}]", "confidence": 0.9, "model": "whisper-1", "language": "ja"}
+        
+        async def on_progress(progress, text):
+            reports.append((round(progress, 2), text))
+        
+        with patch.object(transcription, "transcoded_file", fake_transcoded_file), \
+                patch.object(service, "_openai_request", side_effect=fake_request):
+            await service._transcribe_segments(str(tmp_path / "in.webm"), None, segments, on_progress)
+        
+        assert reports == [(0.33, ""), (0.67, ""), (1.0, "[0][50][110]")]
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestGoogleAsyncTranscription:
+    """Google Speech-to-Text（非同期クライアント）のテスト"""
+    
+    def _result(self, text, confidence=0.9, is_final=True):
+        from types import SimpleNamespace
+        
+        return SimpleNamespace(
+            alternatives=[SimpleNamespace(transcript=text, confidence=confidence)], is_final=is_final
+        )
+        
+    def _service(self, client):
+        service = TranscriptionService()
+        service.api_type = "google"
+        service.google_client = client
+        return service
+        
+    @pytest.mark.asyncio
+    async def test_short_audio_uses_recognize(self):
+        """1分以内の音声は同期認識を使うテスト"""
+        import io
+        from types import SimpleNamespace
+        from app.services.audio_transcode import WIRE_FORMATS
+        
+        client = MagicMock()
+        client.recognize = AsyncMock(return_value=SimpleNamespace(results=[self._result("こんにちは")]))
+        client.long_running_recognize = AsyncMock()
+        service = self._service(client)
+        
+        result = await service._google_request(io.BytesIO(b"fLaC"), WIRE_FORMATS["flac"].output, 30)
+        
+        assert result["transcription"] == "こんにちは"
+        client.recognize.assert_awaited_once()
+        client.long_running_recognize.assert_not_called()
+        
+    @pytest.mark.asyncio
+    async def test_long_audio_uses_long_running_recognize(self):
+        """1分を超える音声は非同期認識を使い、区間ごとの結果を結合するテスト"""
+        import io
+        from types import SimpleNamespace
+        from app.services.audio_transcode import WIRE_FORMATS
+        
+        operation = MagicMock()
+        operation.result = AsyncMock(return_value=SimpleNamespace(
+            results=[self._result("今日は", 0.8), self._result("晴れでした。", 1.0)]
+        ))
+        client = MagicMock()
+        client.recognize = AsyncMock()
+        client.long_running_recognize = AsyncMock(return_value=operation)
+        service = self._service(client)
+        
+        result = await service._google_request(io.BytesIO(b"fLaC"), WIRE_FORMATS["flac"].output, 600)
+        
+        assert result["transcription"] == "今日は晴れでした。"
+        assert result["confidence"] == pytest.approx(0.9)
+        client.recognize.assert_not_called()
+        operation.result.assert_awaited_once()
+        
+    @pytest.mark.asyncio
+    async def test_large_audio_split_instead_of_inline(self, tmp_path):
+        """リクエストに含められない大きさの音声は、ストリーミング認識の長さに区切って送るテスト"""
+        import io
+        from app.services import transcription
+        from app.services.audio_transcode import WIRE_FORMATS
+        
+        audio_path = tmp_path / "long.flac"
+        audio_path.write_bytes(b"fLaC" + b"\0" * 64)
+        client = MagicMock()
+        client.long_running_recognize = AsyncMock()
+        service = self._service(client)
+        pieces = []
+        
+        async def fake_segment(source_path, start, end):
+            pieces.append((start, end))
+            text = f"{int(start)}秒から。"
+            return {
+                "transcription": text, "confidence": 0.9, "model": "google-speech-to-text", "language": "ja",
+                "segments": [{"start": 1.0, "end": 2.0, "text": text}]
+            }
+        
+        with patch.object(transcription, "GOOGLE_INLINE_MAX_BYTES", 16), \
+                patch.object(transcription, "probe_duration", return_value=700.0), \
+                patch.object(service, "_google_segment", side_effect=fake_segment):
+            result = await service._google_transcribe(str(audio_path))
+            
+            with pytest.raises(ValueError):
+                await service._google_request(io.BytesIO(b"\0" * 32), WIRE_FORMATS["flac"].output, 600)
+        
+        assert pieces == [(0.0, 300.0), (300.0, 600.0), (600.0, 700.0)]
+        assert result["transcription"] == "0秒から。300秒から。600秒から。"
+        assert [s["start"] for s in result["segments"]] == [1.0, 301.0, 601.0]
+        client.long_running_recognize.assert_not_called()
+        
+    @pytest.mark.asyncio
+    async def test_streaming_recognize_sends_chunks(self):
+        """ストリーミング認識で設定の後に音声を分割して送るテスト"""
+        from types import SimpleNamespace
+        from app.services import transcription
+        from app.services.audio_transcode import WIRE_FORMATS
+        
+        sent = []
+        
+        async def fake_streaming_recognize(requests):
+            async for request in requests:
+                sent.append(request)
+            
+            async def responses():
+                yield SimpleNamespace(results=[self._result("途中", is_final=False)])
+                yield SimpleNamespace(results=[self._result("最終結果")])
+            return responses()
+        
+        async def chunks():
+            yield b"a" * 10
+            yield b"b" * 25
+        
+        client = MagicMock()
+        client.streaming_recognize = fake_streaming_recognize
+        service = self._service(client)
+        
+        with patch.object(transcription, "GOOGLE_STREAM_CHUNK_SIZE", 16):
+            result = await service._google_stream(chunks(), WIRE_FORMATS["flac"].output)
+        
+        assert result["transcription"] == "最終結果"
+        assert sent[0].streaming_config.config.language_code == "ja-JP"
+        assert [len(r.audio_content) for r in sent[1:]] == [10, 16, 9]
+
+
+@pytest.mark.unit
+@pytest.mark.audio
+class TestTranscriptionSegments:
+    """文字起こし区間（音声内の位置）のテスト"""
+    
+    def test_shift_segments(self):
+        """分割した音声の区間を元の音声の位置へずらすテスト"""
+        from app.services.transcript_segments import shift_segments
+        
+        segments = [{"start": 0.0, "end": 2.5, "text": "おはよう"}, {"start": 2.5, "end": 4.0, "text": "ございます"}]
+        
+        shifted = shift_segments(segments, 120.0)
+        
+        assert [(s["start"], s["end"]) for s in shifted] == [(120.0, 122.5), (122.5, 124.0)]
+        assert [s["text"] for s in shifted] == ["おはよう", "ございます"]
+        assert shift_segments(None, 10.0) == []
+        
+    @pytest.mark.asyncio
+    async def test_mock_transcription_has_segments(self):
+        """モックの文字起こし結果に区間が含まれるテスト"""
+        service = TranscriptionService()
+        
+        result = await service._mock_transcribe()
+        
+        assert "".join(s["text"] for s in result["segments"]) == result["transcription"]
+        assert result["segments"][1]["start"] == result["segments"][0]["end"]
+        
+    @pytest.mark.asyncio
+    async def test_openai_verbose_json_segments(self):
+        """Whisperのverbose_jsonの区間を取り出すテスト"""
+        import io
+        from types import SimpleNamespace
+        
+        transcript = SimpleNamespace(
+            text="今日は晴れ。散歩した。",
+            language="japanese",
+            segments=[
+                {"start": 0.0, "end": 1.8, "text": " 今日は晴れ。"},
+                SimpleNamespace(start=1.8, end=3.2, text="散歩した。"),
+            ]
+        )
+        service = TranscriptionService()
+        service.model = "whisper-1"
+        service.openai_client = MagicMock()
+        service.openai_client.audio.transcriptions.create = AsyncMock(return_value=transcript)
+        
+        result = await service._openai_request("audio.webm", io.BytesIO(b"data"))
+        
+        assert result["segments"] == [
+            {"start": 0.0, "end": 1.8, "text": "今日は晴れ。"},
+            {"start": 1.8, "end": 3.2, "text": "散歩した。"},
+        ]
+        
+    def test_google_result_segments(self):
+        """Googleの認識結果の終了位置から区間を作成するテスト"""
+        from datetime import timedelta
+        from types import SimpleNamespace
+        
+        def result(text, end):
+            return SimpleNamespace(
+                alternatives=[SimpleNamespace(transcript=text, confidence=0.9)],
+                result_end_time=timedelta(seconds=end)
+            )
+        
+        service = TranscriptionService()
+        
+        output = service._google_result([result("今日は", 2.0), result("晴れでした。", 5.5)])
+        
+        assert output["segments"] == [
+            {"start": 0.0, "end": 2.0, "text": "今日は"},
+            {"start": 2.0, "end": 5.5, "text": "晴れでした。"},
+        ]
+
+
+@pytest.mark.unit
+class TestProcessingQueue:
+    """文字起こし・要約ワーカーのテスト"""
+    
+    def _job(self, entry_id="entry-1", attempts=1, stage="transcription"):
+        from app.services.processing import ClaimedJob
+        
+        return ClaimedJob(id=1, stage=stage, entry_id=entry_id, task_id=f"task-{entry_id}", attempts=attempts)
+        
+    def _queue(self, stage, workers, handler, jobs):
+        """DBの代わりにリストからジョブを取得するワーカー"""
+        from app.services.processing import ProcessingQueue
+        
+        queue = ProcessingQueue({stage: workers})
+        queue.handlers = {stage: handler}
+        queue.poll_seconds = 0.01
+        queue.claim = lambda *_: jobs.pop(0) if jobs else None
+        queue.complete = MagicMock()
+        queue.retry_or_fail = MagicMock()
+        return queue
+        
+    def test_retry_delay_backoff(self):
+        """再試行の待ち時間が指数的に増え、上限で止まるテスト"""
+        from app.services import processing
+        
+        with patch.object(processing, "JOB_RETRY_BASE_SECONDS", 10), patch.object(processing, "JOB_RETRY_MAX_SECONDS", 600):
+            assert 8 <= processing.retry_delay(1) <= 10
+            assert 16 <= processing.retry_delay(2) <= 20
+            assert 32 <= processing.retry_delay(3) <= 40
+            assert 480 <= processing.retry_delay(20) <= 600
+        
+    @pytest.mark.asyncio
+    async def test_stage_concurrency_limit(self):
+        """段階ごとに指定した数までしか同時に実行しないテスト"""
+        running = 0
+        peak = 0
+        done = []
+        
+        async def handler(entry_id, task_id):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            done.append(entry_id)
+        
+        queue = self._queue("transcription", 2, handler, [self._job(f"entry-{i}") for i in range(6)])
+        queue.start()
+        try:
+            for _ in range(100):
+                if len(done) == 6:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        
+        assert sorted(done) == [f"entry-{i}" for i in range(6)]
+        assert peak == 2
+        assert queue.complete.call_count == 6
+        
+    @pytest.mark.asyncio
+    async def test_weighted_fair_lanes(self):
+        """両方のレーンにジョブがある場合、重みの比率で取得するテスト"""
+        order = []
+        lanes = {
+            "interactive": [self._job(f"i-{i}") for i in range(10)],
+            "backfill": [self._job(f"b-{i}") for i in range(10)],
+        }
+        
+        async def handler(entry_id, task_id):
+            order.append(entry_id[0])
+        
+        queue = self._queue("transcription", 1, handler, [])
+        queue.weights = {"interactive": 4, "backfill": 1}
+        queue.claim = lambda stage, lane: lanes[lane].pop(0) if lanes[lane] else None
+        queue.start()
+        try:
+            for _ in range(100):
+                if len(order) >= 10:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        
+        assert order[:10].count("i") == 8
+        assert order[:10].count("b") == 2
+        
+    @pytest.mark.asyncio
+    async def test_backfill_lane_concurrency_limit(self):
+        """一括再処理のレーンは段階の同時実行数より少ない上限で実行するテスト"""
+        from app.services.processing import ProcessingQueue
+        
+        running = 0
+        peak = 0
+        done = []
+        jobs = [self._job(f"entry-{i}") for i in range(4)]
+        
+        async def handler(entry_id, task_id):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            done.append(entry_id)
+        
+        queue = ProcessingQueue({"transcription": 3}, {"transcription": {"backfill": 1}})
+        queue.handlers = {"transcription": handler}
+        queue.poll_seconds = 0.01
+        queue.claim = lambda stage, lane: jobs.pop(0) if lane == "backfill" and jobs else None
+        queue.complete = MagicMock()
+        queue.retry_or_fail = MagicMock()
+        queue.start()
+        try:
+            for _ in range(100):
+                if len(done) == 4:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        
+        assert len(done) == 4
+        assert peak == 1
+        
+    @pytest.mark.asyncio
+    async def test_transient_error_is_retried(self):
+        """一時的なエラーは再試行待ちに戻すテスト"""
+        error = RuntimeError("provider error")
+        queue = self._queue("summary", 1, AsyncMock(side_effect=error), [])
+        job = self._job(stage="summary")
+        
+        await queue._run(job)
+        
+        queue.retry_or_fail.assert_called_once_with(job, error)
+        queue.complete.assert_not_called()
+        
+    @pytest.mark.asyncio
+    async def test_permanent_error_fails_immediately(self):
+        """再試行しても成功しないエラーはすぐに失敗にするテスト"""
+        from app.services.processing import JobFailed
+        
+        error = JobFailed("音声ファイルが見つかりません")
+        queue = self._queue("transcription", 1, AsyncMock(side_effect=error), [])
+        job = self._job()
+        
+        await queue._run(job)
+        
+        queue.retry_or_fail.assert_called_once_with(job, error, False)
+        
+    @pytest.mark.asyncio
+    async def test_exhausted_job_from_crashed_worker_is_failed(self):
+        """最後の試行中にワーカーが停止したジョブは実行せずに失敗にするテスト"""
+        handler = AsyncMock()
+        queue = self._queue("transcription", 1, handler, [])
+        queue.claim = MagicMock(side_effect=[self._job(attempts=queue.max_attempts + 1), None, None, None])
+        queue.start()
+        try:
+            for _ in range(100):
+                if queue.retry_or_fail.called:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        
+        handler.assert_not_called()
+        assert queue.retry_or_fail.call_args.args[2] is False
+        
+    @pytest.mark.asyncio
+    async def test_lease_renewed_while_running(self):
+        """実行中は実行権が延長されるテスト"""
+        async def handler(entry_id, task_id):
+            await asyncio.sleep(0.05)
+        
+        queue = self._queue("transcription", 1, handler, [])
+        queue.lease_seconds = 0.03
+        queue.renew = MagicMock(return_value=True)
+        
+        await queue._run(self._job())
+        
+        assert queue.renew.call_count >= 2
+        queue.complete.assert_called_once()
+        
+    @pytest.mark.asyncio
+    async def test_lost_lease_cancels_running_attempt(self):
+        """実行権が他のワーカーに引き継がれた場合は実行を中止し、ジョブの状態を更新しないテスト"""
+        cancelled = asyncio.Event()
+        
+        async def handler(entry_id, task_id):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        queue = self._queue("transcription", 1, handler, [])
+        queue.lease_seconds = 0.03
+        queue.renew = MagicMock(return_value=False)
+        
+        await asyncio.wait_for(queue._run(self._job()), 1)
+        
+        assert cancelled.is_set()
+        queue.complete.assert_not_called()
+        queue.retry_or_fail.assert_not_called()
+        assert queue._leases == {}
+        
+    def test_check_lease_rejects_stale_attempt(self):
+        """結果の保存時に、実行権を持つ試行でなければ LeaseLost を送出するテスト"""
+        from app.services.processing import LeaseLost, _Lease, _current_lease, check_lease
+        
+        db = MagicMock()
+        # ワーカーの外（実行権なし）では確認しない
+        check_lease(db)
+        db.execute.assert_not_called()
+        
+        token = _current_lease.set(_Lease(self._job(attempts=2)))
+        try:
+            db.execute.return_value.first.return_value = (1,)
+            check_lease(db)
+            db.execute.return_value.first.return_value = None
+            with pytest.raises(LeaseLost):
+                check_lease(db)
+        finally:
+            _current_lease.reset(token)
+        
+    @pytest.mark.asyncio
+    async def test_single_flight_continues_while_other_waiter_remains(self):
+        """待っている側の一方がキャンセルしても実行は続き、全員がキャンセルした場合は中止するテスト"""
+        from app.services.processing import SingleFlight
+        
+        flight = SingleFlight()
+        release = asyncio.Event()
+        
+        async def job():
+            await release.wait()
+            return "done"
+        
+        first = asyncio.create_task(flight.run("task-1", job))
+        second = asyncio.create_task(flight.run("task-1", job))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == "done"
+        
+        release.clear()
+        only = asyncio.create_task(flight.run("task-2", job))
+        await asyncio.sleep(0)
+        inner = flight._inflight["task-2"]
+        only.cancel()
+        await asyncio.gather(only, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert inner.cancelled()
+        assert flight._inflight == {}
+        
+    @pytest.mark.asyncio
+    async def test_reclaimed_job_shares_running_execution(self):
+        """実行権が切れて同じプロセスで再取得されたジョブは、実行中の処理の結果を待つテスト"""
+        calls = 0
+        
+        async def handler(entry_id, task_id):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+        
+        queue = self._queue("transcription", 2, handler, [])
+        first, reclaimed = self._job(attempts=1), self._job(attempts=2)
+        
+        await asyncio.gather(queue._run(first), queue._run(reclaimed))
+        
+        assert calls == 1
+        assert queue.complete.call_count == 2
+        assert queue._single_flight._inflight == {}
+        
+        # 完了後の同じタスクの実行は新たに行う
+        await queue._run(self._job(attempts=3))
+        assert calls == 2
+        
+    def test_start_stage_sets_entry_and_enqueues(self):
+        """段階の開始でタスクIDと状態を設定し、ジョブを登録するテスト"""
+        from types import SimpleNamespace
+        from app.services.processing import ProcessingQueue
+        
+        queue = ProcessingQueue()
+        queue.enqueue = MagicMock()
+        db = MagicMock()
+        entry = SimpleNamespace(id=uuid4(), transcription_task_id=None, transcription_status="pending")
+        
+        task_id = queue.start_stage(db, "transcription", entry, next_stage="summary")
+        
+        assert entry.transcription_task_id == task_id
+        assert entry.transcription_status == "processing"
+        queue.enqueue.assert_called_once_with(db, "transcription", entry.id, task_id, "summary", "interactive")
+        
+    def test_next_stage_started_after_completion(self):
+        """自動処理で文字起こしの完了後に要約を開始するテスト"""
+        from types import SimpleNamespace
+        
+        queue = self._queue("transcription", 1, AsyncMock(), [])
+        queue.start_stage = MagicMock()
+        job = self._job()
+        job.next_stage = "summary"
+        entry = SimpleNamespace(
+            transcription_task_id=job.task_id, transcription_status="completed", summary_status="pending"
+        )
+        db = MagicMock()
+        db.get.return_value = entry
+        
+        queue._start_next_stage(db, job)
+        
+        queue.start_stage.assert_called_once_with(db, "summary", entry, priority="interactive")
+        
+    def test_next_stage_not_started_when_superseded(self):
+        """やり直された文字起こしや開始済みの要約では自動処理を続けないテスト"""
+        from types import SimpleNamespace
+        
+        queue = self._queue("transcription", 1, AsyncMock(), [])
+        queue.start_stage = MagicMock()
+        job = self._job()
+        job.next_stage = "summary"
+        db = MagicMock()
+        
+        db.get.return_value = SimpleNamespace(
+            transcription_task_id="other-task", transcription_status="completed", summary_status="pending"
+        )
+        queue._start_next_stage(db, job)
+        db.get.return_value = SimpleNamespace(
+            transcription_task_id=job.task_id, transcription_status="completed", summary_status="processing"
+        )
+        queue._start_next_stage(db, job)
+        
+        queue.start_stage.assert_not_called()
+
+
+@pytest.mark.unit
+class TestEntryEventBroker:
+    """日記エントリの処理状況の配信のテスト"""
+    
+    def _broker(self):
+        from app.services.entry_events import EntryEventBroker
+        
+        broker = EntryEventBroker()
+        # LISTEN用の接続を使わずに配信する
+        broker._ready = asyncio.Event()
+        broker._ready.set()
+        broker._ensure_listener = MagicMock()
+        return broker
+        
+    def test_publish_uses_pg_notify_with_truncated_text(self):
+        """イベントをpg_notifyで送信し、長いテキストを切り詰めるテスト"""
+        import json
+        from app.services.entry_events import ENTRY_EVENTS_CHANNEL, EntryEventBroker
+        
+        db = MagicMock()
+        entry_id = uuid4()
+        
+        EntryEventBroker().publish(db, entry_id, "completed", stage="transcription", text="あ" * 5000)
+        
+        params = db.execute.call_args.args[1]
+        payload = json.loads(params["payload"])
+        assert params["channel"] == ENTRY_EVENTS_CHANNEL
+        assert payload["entry_id"] == str(entry_id)
+        assert payload["type"] == "completed"
+        assert payload["truncated"] is True
+        assert len(params["payload"].encode()) < 8000
+        
+    @pytest.mark.asyncio
+    async def test_dispatch_to_entry_subscribers(self):
+        """通知を同じエントリの購読者にだけ配信するテスト"""
+        import json
+        
+        broker = self._broker()
+        
+        async with broker.subscribe("entry-1") as first, broker.subscribe("entry-1") as second, \
+                broker.subscribe("entry-2") as other:
+            broker._dispatch(None, 0, "entry_events", json.dumps({"entry_id": "entry-1", "type": "started"}))
+            
+            assert first.get_nowait()["type"] == "started"
+            assert second.get_nowait()["type"] == "started"
+            assert other.empty()
+        
+        assert broker._subscribers == {}
+        
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_drops_events(self):
+        """読み出しが遅い購読者のイベントは捨て、配信を止めないテスト"""
+        from app.services import entry_events
+        
+        broker = self._broker()
+        
+        with patch.object(entry_events, "_SUBSCRIBER_QUEUE_SIZE", 2):
+            async with broker.subscribe("entry-1") as queue:
+                for i in range(5):
+                    broker._deliver("entry-1", {"entry_id": "entry-1", "type": "progress", "progress": i})
+                
+                assert queue.qsize() == 2
+    
+    @pytest.mark.asyncio
+    async def test_wait_for_stage(self):
+        """ロングポーリングで段階の完了を待つテスト"""
+        broker = self._broker()
+        
+        # 処理中でなければ待たずに戻る
+        assert await broker.wait_for_stage("entry-1", "transcription", 5, lambda: False) is True
+        
+        # 他の段階のイベントや進捗では戻らず、完了で戻る
+        async def deliver():
+            await asyncio.sleep(0.01)
+            broker._deliver("entry-1", {"entry_id": "entry-1", "type": "completed", "stage": "summary"})
+            broker._deliver("entry-1", {"entry_id": "entry-1", "type": "progress", "stage": "transcription"})
+            await asyncio.sleep(0.01)
+            broker._deliver("entry-1", {"entry_id": "entry-1", "type": "completed", "stage": "transcription"})
+        
+        task = asyncio.create_task(deliver())
+        assert await broker.wait_for_stage("entry-1", "transcription", 5, lambda: True) is True
+        await task
+        
+        # 状態が変わらなければタイムアウトする
+        assert await broker.wait_for_stage("entry-1", "transcription", 0.05, lambda: True) is False
+        assert broker._subscribers == {}
+
+
+class _ThrottledError(Exception):
+    """プロバイダーのレート制限エラー（429とRetry-After）"""
+    
+    def __init__(self, headers=None):
+        from types import SimpleNamespace
+        
+        super().__init__("rate limited")
+        self.status_code = 429
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+@pytest.mark.unit
+class TestProviderLimiter:
+    """プロバイダーごとのレート制限のテスト"""
+    
+    def _limiter(self, requests_per_minute=0, tokens_per_minute=0, max_concurrency=4):
+        from app.services.provider_limits import ProviderLimiter, ProviderQuota
+        
+        return ProviderLimiter("test", ProviderQuota(requests_per_minute, tokens_per_minute, max_concurrency))
+        
+    def test_throttle_detection_and_retry_after(self):
+        """429の判定とRetry-Afterの解釈のテスト"""
+        from email.utils import format_datetime
+        from datetime import datetime, timedelta, timezone
+        from app.services.provider_limits import is_throttled, retry_after
+        
+        google_error = Exception("quota")
+        google_error.code = 429
+        assert is_throttled(_ThrottledError())
+        assert is_throttled(google_error)
+        assert not is_throttled(ValueError("bad request"))
+        
+        assert retry_after(_ThrottledError({"retry-after-ms": "1500"})) == 1.5
+        assert retry_after(_ThrottledError({"retry-after": "20"})) == 20
+        http_date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+        assert 25 <= retry_after(_ThrottledError({"retry-after": http_date})) <= 30
+        assert retry_after(_ThrottledError()) is None
+        
+    def test_token_bucket_refill(self):
+        """トークンバケットが1分あたりの量で補充され、超過分は後の取得を待たせるテスト"""
+        from app.services.provider_limits import TokenBucket
+        
+        bucket = TokenBucket(60)
+        assert bucket.wait_time(60, 0.0) == 0
+        bucket.take(60, 0.0)
+        assert bucket.wait_time(1, 0.0) == pytest.approx(1.0)
+        assert bucket.wait_time(1, 0.5) == pytest.approx(0.5)
+        # 実際の使用量が見積もりより30多かった
+        bucket.adjust(30)
+        assert bucket.wait_time(1, 0.5) == pytest.approx(30.5)
+        assert TokenBucket(0).wait_time(10 ** 9, 0.0) == 0
+        
+    @pytest.mark.asyncio
+    async def test_throttled_call_waits_and_decreases_concurrency(self):
+        """429を受けた場合はRetry-Afterだけ待って再試行し、同時実行数を減らすテスト"""
+        limiter = self._limiter(max_concurrency=4)
+        request = AsyncMock(side_effect=[_ThrottledError({"retry-after-ms": "50"}), "ok"])
+        loop = asyncio.get_running_loop()
+        
+        started = loop.time()
+        assert await limiter.call(request) == "ok"
+        
+        assert loop.time() - started >= 0.05
+        assert request.call_count == 2
+        assert limiter.limit == pytest.approx(2.5)
+        assert limiter.in_flight == 0
+        
+    @pytest.mark.asyncio
+    async def test_other_errors_are_not_retried(self):
+        """レート制限以外のエラーは再試行せずにそのまま送出するテスト"""
+        limiter = self._limiter()
+        request = AsyncMock(side_effect=ValueError("bad request"))
+        
+        with pytest.raises(ValueError):
+            await limiter.call(request)
+        
+        assert request.call_count == 1
+        assert limiter.limit == 4
+        
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self):
+        """同時実行数の上限を超えて呼び出さないテスト"""
+        limiter = self._limiter(max_concurrency=2)
+        running = 0
+        peak = 0
+        
+        async def request():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+        
+        await asyncio.gather(*(limiter.call(request) for _ in range(6)))
+        
+        assert peak == 2
+        assert limiter.in_flight == 0
+        
+    def test_latency_tracked_per_operation(self):
+        """応答時間の平均は処理の種類ごと・音声の長さあたりで比べ、長い文字起こしで同時実行数を減らさないテスト"""
+        limiter = self._limiter(max_concurrency=4)
+        limiter.limit = 2.0
+        
+        # 短いチャットの呼び出しの後に、数分かかる文字起こし（音声10分）
+        limiter._on_success("chat", 1.0, 0.0)
+        limiter._on_success("transcription", 120.0, 1.0, units=600)
+        limiter._on_success("transcription", 60.0, 2.0, units=300)
+        assert limiter.limit > 2.0
+        
+        # 同じ種類で音声の長さあたりの応答時間が悪化した場合は減らす
+        limit = limiter.limit
+        limiter._on_success("transcription", 300.0, 3.0, units=300)
+        assert limiter.limit == pytest.approx(limit * 0.9)
+
+
+@pytest.mark.unit
+class TestSettingsCache:
+    """設定のキャッシュのテスト"""
+    
+    def _cache(self, rows):
+        from app.services.settings_cache import SettingsCache
+        
+        cache = SettingsCache(ttl=60)
+        # LISTEN用の接続を使わない
+        cache._ensure_listener = MagicMock()
+        db = MagicMock()
+        db.query.return_value.all.return_value = rows
+        return cache, db
+        
+    def test_cached_until_newer_version_notified(self):
+        """新しいバージョンが通知されるまではDBを読まずにキャッシュを返すテスト"""
+        cache, db = self._cache([("summary_api", "openai"), ("_version", 3)])
+        
+        assert cache.current(db) == {"summary_api": "openai"}
+        assert cache.current(db) == {"summary_api": "openai"}
+        assert db.query.call_count == 1
+        
+        # 読み込み済みのバージョン以下の通知は無視する
+        cache._notified(None, 0, "settings_changed", "3")
+        cache.current(db)
+        assert db.query.call_count == 1
+        
+        db.query.return_value.all.return_value = [("summary_api", "claude"), ("_version", 4)]
+        cache._notified(None, 0, "settings_changed", "4")
+        assert cache.current(db) == {"summary_api": "claude"}
+        assert db.query.call_count == 2
+        
+    def test_stale_read_not_cached(self):
+        """通知より古いバージョンの読み込み結果はキャッシュしないテスト"""
+        cache, db = self._cache([("summary_api", "openai"), ("_version", 3)])
+        cache.invalidate(4)
+        
+        assert cache.current(db) == {"summary_api": "openai"}
+        assert cache.current(db) == {"summary_api": "openai"}
+        assert db.query.call_count == 2
+        
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self):
+        """通知がなくても一定時間で読み直すテスト"""
+        cache, db = self._cache([("auto_pipeline", True)])
+        cache.ttl = 0.01
+        
+        assert cache.current(db) == {"auto_pipeline": True}
+        await asyncio.sleep(0.02)
+        cache.current(db)
+        
+        assert db.query.call_count == 2
+
+
+@pytest.mark.unit
+class TestProviderClientRegistry:
+    """プロバイダーのクライアントの共有のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_clients_shared_per_provider_and_key(self):
+        """同じプロバイダー・APIキーのクライアントを共有し、接続プールは全体で1つのテスト"""
+        from app.services.provider_clients import ProviderClientRegistry
+        
+        registry = ProviderClientRegistry()
+        try:
+            first = registry.openai("sk-test-1")
+            assert registry.openai("sk-test-1") is first
+            assert registry.openai("sk-test-2") is not first
+            claude = registry.anthropic("sk-ant-test")
+            
+            http = registry.http_client()
+            assert first._client is http
+            assert claude._client is http
+        finally:
+            await registry.aclose()
+        
+        assert http.is_closed
+        # 閉じた後は新しい接続プールでクライアントを作り直す
+        assert registry.openai("sk-test-1") is not first
+        await registry.aclose()
+        
+    @pytest.mark.asyncio
+    async def test_services_refresh_clients_after_pool_closed(self):
+        """接続プールが閉じられた後は、サービスが新しい接続プールのクライアントを取得し直すテスト"""
+        from app.services import summary
+        from app.services.provider_clients import ProviderClientRegistry
+        
+        registry = ProviderClientRegistry()
+        with patch.object(summary, "provider_clients", registry), \
+                patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}), \
+                patch.object(summary.settings_cache, "get", AsyncMock(return_value={"summary_api": "openai"})):
+            service = summary.SummaryService()
+            await service._update_config()
+            first = service.openai_client
+            
+            # 設定が変わらなければ同じクライアントを使う
+            await service._update_config()
+            assert service.openai_client is first
+            
+            await registry.aclose()
+            await service._update_config()
+            assert service.openai_client is not first
+            assert not service.openai_client._client.is_closed
+            await registry.aclose()
+
+
+@pytest.mark.unit
+class TestProviderPolicy:
+    """プロバイダーの切り替え・ヘッジ・タイムアウトのテスト"""
+    
+    def _policy(self, samples=None):
+        from app.services.provider_policy import ProviderPolicy
+        
+        policy = ProviderPolicy("test")
+        for api_type, latency in (samples or {}).items():
+            for _ in range(20):
+                policy.latency(api_type).record(latency)
+        return policy
+        
+    def test_parse_fallbacks_and_order(self):
+        """予備のプロバイダーの設定の解析と、認証情報のないプロバイダーを除いた呼び出し順のテスト"""
+        from app.services.provider_policy import ProviderRegistry, fallback_model, parse_fallbacks
+        
+        fallbacks = parse_fallbacks(" claude:claude-3-haiku, openai ,")
+        assert fallbacks == [("claude", "claude-3-haiku"), ("openai", None)]
+        assert fallback_model(fallbacks, "claude", "default") == "claude-3-haiku"
+        assert fallback_model(fallbacks, "openai", "default") == "default"
+        
+        registry = ProviderRegistry("summary")
+        for api_type in ("mock", "openai", "claude"):
+            registry.register(api_type, AsyncMock())
+        with patch.dict(os.environ, {"CLAUDE_API_KEY": "key"}, clear=False):
+            os.environ.pop("OPENAI_API_KEY", None)
+            assert registry.order("openai", fallbacks + [("google", None)]) == ["openai", "claude"]
+        with pytest.raises(ValueError, match="Unsupported summary API"):
+            registry.order("invalid", fallbacks)
+        
+    @pytest.mark.asyncio
+    async def test_fallback_on_failure(self):
+        """プライマリが失敗した場合は次のプロバイダーの結果を使うテスト"""
+        policy = self._policy()
+        calls = []
+        
+        async def call(api_type):
+            calls.append(api_type)
+            if api_type == "openai":
+                raise Exception("OpenAI summary failed: 500")
+            return api_type
+        
+        assert await policy.run(["openai", "claude"], call) == "claude"
+        assert calls == ["openai", "claude"]
+        
+    @pytest.mark.asyncio
+    async def test_all_failed_raises_primary_error(self):
+        """全プロバイダーが失敗した場合はプライマリのエラーを送出するテスト"""
+        policy = self._policy()
+        
+        async def call(api_type):
+            raise Exception(f"{api_type} failed")
+        
+        with pytest.raises(Exception, match="openai failed"):
+            await policy.run(["openai", "claude"], call)
+        
+    @pytest.mark.asyncio
+    async def test_timeout_switches_provider(self):
+        """プロバイダーごとのタイムアウトを過ぎた場合は次のプロバイダーへ切り替えるテスト"""
+        from app.services import provider_policy
+        
+        policy = self._policy()
+        
+        async def call(api_type):
+            if api_type == "openai":
+                await asyncio.sleep(10)
+            return api_type
+        
+        with patch.dict(provider_policy.PROVIDER_TIMEOUTS, {"openai": 0.05}):
+            assert await policy.run(["openai", "claude"], call) == "claude"
+            with pytest.raises(TimeoutError, match="timed out"):
+                await policy.run(["openai"], call)
+        
+    @pytest.mark.asyncio
+    async def test_timeout_scaled_for_long_input(self):
+        """長い音声はタイムアウトを倍率で延ばし、長さ不明の場合は打ち切らないテスト"""
+        from app.services import provider_policy
+        from app.services.transcription import _timeout_scale, TRANSCRIBE_SEGMENT_SECONDS
+        
+        policy = self._policy()
+        
+        async def call(api_type):
+            await asyncio.sleep(0.1)
+            return api_type
+        
+        with patch.dict(provider_policy.PROVIDER_TIMEOUTS, {"openai": 0.05}):
+            with pytest.raises(TimeoutError):
+                await policy.run(["openai"], call, timeout_scale=1.0)
+            assert await policy.run(["openai"], call, timeout_scale=4.0) == "openai"
+            assert await policy.run(["openai"], call, timeout_scale=None) == "openai"
+        
+        assert _timeout_scale(TRANSCRIBE_SEGMENT_SECONDS / 2) == 1.0
+        assert _timeout_scale(TRANSCRIBE_SEGMENT_SECONDS * 30) == 30.0
+        assert _timeout_scale(None) is None
+        
+    @pytest.mark.asyncio
+    async def test_hedge_after_p95(self):
+        """プライマリが p95 を過ぎても終わらない場合は予備にも送り、先に成功した結果を使うテスト"""
+        policy = self._policy({"openai": 0.02})
+        cancelled = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        
+        async def call(api_type):
+            if api_type == "openai":
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+            return api_type
+        
+        started = loop.time()
+        assert await policy.run(["openai", "claude"], call) == "claude"
+        
+        assert loop.time() - started < 1
+        await asyncio.wait_for(cancelled.wait(), 1)
+        
+    @pytest.mark.asyncio
+    async def test_hedge_threshold_per_unit_of_input(self):
+        """入力量が分かる呼び出しは単位あたりの p95 と比べ、長い入力を短い入力の p95 でヘッジしないテスト"""
+        policy = self._policy()
+        for _ in range(20):
+            # 音声1秒あたり0.01秒
+            policy.latency("openai", per_unit=True).record(0.01)
+        calls = []
+        
+        async def call(api_type):
+            calls.append(api_type)
+            await asyncio.sleep(0.05)
+            return api_type
+        
+        # 10秒の音声の p95 は0.1秒なのでヘッジしない
+        assert await policy.run(["openai", "claude"], call, units=10) == "openai"
+        assert calls == ["openai"]
+        # 単位あたりで記録される（0.05秒 / 10秒）
+        assert policy.latency("openai", per_unit=True)._samples[-1] == pytest.approx(0.005, rel=0.5)
+        assert len(policy.latency("openai")._samples) == 0
+        
+        # 1秒の音声で0.05秒かかる場合はヘッジする
+        calls.clear()
+        await policy.run(["openai", "claude"], call, units=1)
+        assert calls == ["openai", "claude"]
+        
+    @pytest.mark.asyncio
+    async def test_no_hedge_without_latency_history(self):
+        """応答時間の記録が少ない間はヘッジしないテスト"""
+        policy = self._policy()
+        calls = []
+        
+        async def call(api_type):
+            calls.append(api_type)
+            await asyncio.sleep(0.05)
+            return api_type
+        
+        assert await policy.run(["openai", "claude"], call) == "openai"
+        assert calls == ["openai"]
+        
+    @pytest.mark.asyncio
+    async def test_summary_falls_back_to_configured_provider(self):
+        """要約のプライマリが失敗した場合に予備のプロバイダーとそのモデルで要約するテスト"""
+        from app.services import summary
+        
+        claude_summarize = AsyncMock(return_value={"summary": "要約", "title": "タイトル", "model": "claude-3-haiku"})
+        with patch.dict(os.environ, {"CLAUDE_API_KEY": "key"}), \
+                patch.object(summary, "SUMMARY_FALLBACK_APIS", [("claude", None)]), \
+                patch.object(SummaryService, "_openai_summarize", AsyncMock(side_effect=Exception("OpenAI summary failed"))), \
+                patch.object(SummaryService, "_claude_summarize", claude_summarize), \
+                patch.object(SummaryService, "_get_settings_from_db", AsyncMock(return_value={})):
+            service = SummaryService()
+            service.api_type = service._client_api_type = "openai"
+            service.model = "gpt-4o"
+            result = await service.summarize_text("テキスト")
+        
+        assert result["model"] == "claude-3-haiku"
+        claude_summarize.assert_awaited_once_with("テキスト", "claude-3-haiku")
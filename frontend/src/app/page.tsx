@@ -37,6 +37,12 @@ export default function HomePage() {
       const uploadResult = await api.uploadAudio(audioBlob)
       console.log('アップロード成功:', uploadResult)
 
+      // 自動処理が有効な場合はサーバー側で文字起こし・要約が開始済み（進捗は詳細画面で確認）
+      if (uploadResult.transcription_status !== 'pending') {
+        router.push(`/diary/${uploadResult.entry_id}`)
+        return
+      }
+
       // 文字起こし開始
       const transcribeResult = await api.startTranscription(uploadResult.file_id)
       console.log('文字起こし開始:', transcribeResult)
@@ -44,31 +50,36 @@ export default function HomePage() {
       // 作成された日記の詳細画面に移動
       router.push(`/diary/${uploadResult.entry_id}`)
 
-      // モック用: 2秒後に文字起こし結果を取得
-      setTimeout(async () => {
+      // 文字起こし・要約はサーバーのワーカーで実行されるため、完了まで結果を確認する
+      // （getResultはサーバー側で完了を待つため、間隔は短くてよい）
+      const waitForResult = async (getResult: () => Promise<any>, interval: number = 500): Promise<any> => {
+        while (true) {
+          const result = await getResult()
+          if (result.status !== 'processing') {
+            return result
+          }
+          await new Promise((resolve) => setTimeout(resolve, interval))
+        }
+      }
+
+      const processResults = async () => {
         try {
-          const transcription = await api.getTranscriptionResult(transcribeResult.task_id)
+          const transcription = await waitForResult(() => api.getTranscriptionResult(transcribeResult.task_id, 25))
           console.log('文字起こし完了:', transcription)
 
           // 要約処理開始
-          if (transcription.transcription) {
+          if (transcription.status === 'completed' && transcription.transcription) {
             const summaryResult = await api.startSummarization(transcription.transcription, uploadResult.entry_id)
             console.log('要約開始:', summaryResult)
 
-            // さらに2秒後に要約結果を取得
-            setTimeout(async () => {
-              try {
-                const summary = await api.getSummaryResult(summaryResult.task_id)
-                console.log('要約完了:', summary)
-              } catch (error) {
-                console.error('要約取得エラー:', error)
-              }
-            }, 2000)
+            const summary = await waitForResult(() => api.getSummaryResult(summaryResult.task_id, 25))
+            console.log('要約完了:', summary)
           }
         } catch (error) {
-          console.error('文字起こし取得エラー:', error)
+          console.error('文字起こし・要約の取得エラー:', error)
         }
-      }, 2000)
+      }
+      processResults()
 
     } catch (error) {
       console.error('処理エラー:', error)
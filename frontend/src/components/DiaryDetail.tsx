@@ -28,13 +28,14 @@ export const DiaryDetail: React.FC<DiaryDetailProps> = ({ entry, onBack, onUpdat
   })
   const [hasChanges, setHasChanges] = useState(false)
   const [regeneratingSummary, setRegeneratingSummary] = useState(false)
+  const [transcriptionProgress, setTranscriptionProgress] = useState<{ progress: number; text: string } | null>(null)
 
-  // 処理中の場合は定期的に更新
+  // 処理中の場合はサーバーからの処理状況の通知で更新
   useEffect(() => {
     const isProcessing = currentEntry.transcription_status === 'processing' || currentEntry.summary_status === 'processing'
     
     if (isProcessing) {
-      const interval = setInterval(async () => {
+      const refresh = async () => {
         try {
           const updatedEntry = await api.getDiaryEntry(currentEntry.id)
           setCurrentEntry(updatedEntry)
@@ -42,9 +43,16 @@ export const DiaryDetail: React.FC<DiaryDetailProps> = ({ entry, onBack, onUpdat
         } catch (error) {
           console.error('エントリ更新エラー:', error)
         }
-      }, 3000) // 3秒ごとに更新
+      }
       
-      return () => clearInterval(interval)
+      return api.subscribeDiaryEvents(currentEntry.id, (type, data) => {
+        if (type === 'progress' && data.stage === 'transcription') {
+          setTranscriptionProgress({ progress: data.progress, text: data.text || '' })
+        } else if (type === 'snapshot' || type === 'completed' || type === 'failed') {
+          setTranscriptionProgress(null)
+          refresh()
+        }
+      })
     }
   }, [currentEntry.transcription_status, currentEntry.summary_status, currentEntry.id, onUpdate])
 
@@ -166,8 +174,11 @@ export const DiaryDetail: React.FC<DiaryDetailProps> = ({ entry, onBack, onUpdat
       // 要約結果を監視
       const pollResult = async () => {
         try {
-          const result = await api.getSummaryResult(summaryResult.task_id)
-          if (result.summary) {
+          const result = await api.getSummaryResult(summaryResult.task_id, 25)
+          if (result.status === 'failed') {
+            throw new Error('要約処理でエラーが発生しました')
+          }
+          if (result.status === 'completed') {
             // 新しい要約で更新（タイトルはそのまま）
             const newEditedEntry = {
               ...editedEntry,
@@ -184,8 +195,8 @@ export const DiaryDetail: React.FC<DiaryDetailProps> = ({ entry, onBack, onUpdat
             
             setRegeneratingSummary(false)
           } else {
-            // まだ処理中の場合は3秒後に再チェック
-            setTimeout(pollResult, 3000)
+            // まだ処理中の場合は再チェック（サーバー側で完了を待つため間隔は短くてよい）
+            setTimeout(pollResult, 500)
           }
         } catch (error) {
           console.error('要約結果取得エラー:', error)
@@ -328,7 +339,9 @@ export const DiaryDetail: React.FC<DiaryDetailProps> = ({ entry, onBack, onUpdat
             onChange={(e) => setEditedEntry(prev => ({ ...prev, transcription: e.target.value }))}
             placeholder={
               currentEntry.transcription_status === 'processing' 
-                ? '文字起こし処理中...' 
+                ? (transcriptionProgress
+                  ? `文字起こし処理中... ${transcriptionProgress.progress}%\n${transcriptionProgress.text}`
+                  : '文字起こし処理中...')
                 : '文字起こし結果がここに表示されます...'
             }
             className="w-full h-40 bg-bg-tertiary border border-border rounded-lg p-4 text-text-primary placeholder-text-muted resize-none focus:outline-none focus:ring-2 focus:ring-accent-primary"
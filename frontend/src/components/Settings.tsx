@@ -13,6 +13,7 @@ interface SettingsConfig {
   summary_api: string;
   summary_model: string;
   enable_realtime_transcription: boolean;
+  auto_pipeline: boolean;
 }
 
 const TRANSCRIBE_OPTIONS = [
@@ -67,7 +68,8 @@ export default function Settings() {
     transcribe_model: 'mock-whisper-v1',
     summary_api: 'mock',
     summary_model: 'mock-gpt-4o-mini',
-    enable_realtime_transcription: true
+    enable_realtime_transcription: true,
+    auto_pipeline: false
   });
   
   // プロフィール設定
@@ -445,6 +447,32 @@ export default function Settings() {
                 </div>
               </div>
 
+              {/* 自動処理設定 */}
+              <div className="space-y-4">
+                <h3 className="text-lg font-semibold text-text-primary flex items-center gap-2">
+                  🔁 自動処理設定
+                </h3>
+                
+                <div className="bg-bg-tertiary border border-border rounded-lg p-4">
+                  <label className="flex items-center gap-3 cursor-pointer">
+                    <input
+                      type="checkbox"
+                      checked={config.auto_pipeline}
+                      onChange={(e) => handleConfigChange('auto_pipeline', e.target.checked)}
+                      className="w-4 h-4 text-accent-primary bg-bg-tertiary border-border rounded focus:ring-accent-primary focus:ring-2"
+                    />
+                    <div>
+                      <span className="text-sm font-medium text-text-primary">
+                        録音後に文字起こし・要約・タグ付けを自動で実行する
+                      </span>
+                      <p className="text-xs text-text-secondary mt-1">
+                        アップロードの完了と同時にサーバー側で処理を開始し、画面を閉じても処理が続きます
+                      </p>
+                    </div>
+                  </label>
+                </div>
+              </div>
+
               {/* コスト目安 */}
               <div className="bg-info-light border border-info rounded-lg p-4">
                 <h4 className="font-semibold text-info mb-2">💰 コスト目安（月間100分想定）</h4>
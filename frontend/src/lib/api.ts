@@ -1,4 +1,4 @@
-import { DiaryEntry, DiaryEntryListResponse } from '@/types'
+import { DiaryEntry, DiaryEntryListResponse, TaskStatus, TranscriptionSegment } from '@/types'
 
 // API URLを環境に応じて決定
 function getApiBaseUrl(): string {
@@ -84,6 +84,24 @@ export const api = {
     return response.json()
   },
 
+  async getDiarySegments(id: string): Promise<TranscriptionSegment[]> {
+    const response = await authFetch(`${API_BASE_URL}/api/diary/${id}/segments`)
+    if (!response.ok) {
+      throw new Error(`文字起こし区間の取得に失敗しました: ${response.status}`)
+    }
+    return response.json()
+  },
+
+  // 日記エントリの処理状況（Server-Sent Events）を購読し、購読を終了する関数を返す
+  subscribeDiaryEvents(id: string, onEvent: (type: string, data: any) => void): () => void {
+    const source = new EventSource(`${API_BASE_URL}/api/diary/${id}/events`, { withCredentials: true })
+    const types = ['snapshot', 'started', 'progress', 'retrying', 'completed', 'failed']
+    types.forEach((type) => {
+      source.addEventListener(type, (event) => onEvent(type, JSON.parse((event as MessageEvent).data)))
+    })
+    return () => source.close()
+  },
+
   async updateDiaryEntry(id: string, data: Partial<DiaryEntry>): Promise<DiaryEntry> {
     const response = await authFetch(`${API_BASE_URL}/api/diary/${id}`, {
       method: 'PUT',
@@ -141,8 +159,9 @@ export const api = {
     return response.json()
   },
 
-  async getTranscriptionResult(taskId: string): Promise<any> {
-    const response = await authFetch(`${API_BASE_URL}/api/transcribe/${taskId}`)
+  // wait: 処理中の場合にサーバー側で完了を待つ秒数（ロングポーリング）
+  async getTranscriptionResult(taskId: string, wait: number = 0): Promise<any> {
+    const response = await authFetch(`${API_BASE_URL}/api/transcribe/${taskId}${wait > 0 ? `?wait=${wait}` : ''}`)
     
     if (!response.ok) {
       throw new Error(`文字起こし結果の取得に失敗しました: ${response.status}`)
@@ -168,8 +187,8 @@ export const api = {
     return response.json()
   },
 
-  async getSummaryResult(taskId: string): Promise<any> {
-    const response = await authFetch(`${API_BASE_URL}/api/summarize/${taskId}`)
+  async getSummaryResult(taskId: string, wait: number = 0): Promise<any> {
+    const response = await authFetch(`${API_BASE_URL}/api/summarize/${taskId}${wait > 0 ? `?wait=${wait}` : ''}`)
     
     if (!response.ok) {
       throw new Error(`要約結果の取得に失敗しました: ${response.status}`)
@@ -178,6 +197,24 @@ export const api = {
     return response.json()
   },
 
+  // 複数のタスクの状態を一括取得
+  async getTaskStatuses(transcriptionTaskIds: string[], summaryTaskIds: string[] = []): Promise<TaskStatus[]> {
+    const response = await authFetch(`${API_BASE_URL}/api/tasks/status`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ transcription_task_ids: transcriptionTaskIds, summary_task_ids: summaryTaskIds }),
+    })
+    
+    if (!response.ok) {
+      throw new Error(`タスク状態の取得に失敗しました: ${response.status}`)
+    }
+    
+    const data = await response.json()
+    return data.tasks
+  },
+
   // タグ関連
   async getTags(): Promise<{ tags: Array<{ name: string; count: number }> }> {
     const response = await authFetch(`${API_BASE_URL}/api/tags`)
@@ -196,7 +233,7 @@ export const api = {
   },
 
   // 全文検索
-  async searchDiaryEntries(query: string, page: number = 1, size: number = 10): Promise<DiaryEntryListResponse & { query: string }> {
+  async searchDiaryEntries(query: string, page: number = 1, size: number = 10): Promise<DiaryEntryListResponse & { query: string; hits: TranscriptionSegment[] }> {
     const response = await authFetch(`${API_BASE_URL}/api/search?q=${encodeURIComponent(query)}&page=${page}&size=${size}`)
     if (!response.ok) {
       throw new Error(`検索に失敗しました: ${response.status}`)
@@ -4,6 +4,9 @@ export interface DiaryEntry {
   recorded_at: string
   audio_file_path?: string
   file_id?: string
+  duration_seconds?: number | null
+  audio_container?: string | null
+  audio_codec?: string | null
   transcription?: string
   summary?: string
   tags?: string[]
@@ -24,6 +27,21 @@ export interface DiaryEntryListResponse {
   has_next: boolean
 }
 
+export interface TranscriptionSegment {
+  entry_id: string
+  seq: number
+  start_seconds: number
+  end_seconds: number
+  text: string
+}
+
+export interface TaskStatus {
+  task_id: string
+  type: 'transcription' | 'summary'
+  entry_id: string | null
+  status: 'pending' | 'processing' | 'completed' | 'failed' | 'not_found'
+}
+
 export interface ApiResponse<T> {
   data?: T
   error?: string